@@ -25,11 +25,51 @@ POSTGRES_HOST = os.environ.get('POSTGRES_HOST', '')
 POSTGRES_USER = os.environ.get('POSTGRES_USER', '')
 POSTGRES_PASS = os.environ.get('POSTGRES_PASS', '')
 
+# The release-specific databases, these are swapped when a new release is deployed
+GTDB_DB_NAME = os.environ.get('GTDB_DB_NAME', 'gtdb_r232')
+GTDB_WEB_DB_NAME = os.environ.get('GTDB_WEB_DB_NAME', 'gtdb_r232_web')
+
 # ------------------------------------------------------------------------------
 # Caching
 # ------------------------------------------------------------------------------
 CACHE_DIR: Path | None = Path(os.environ['CACHE_DIR']) if os.environ.get('CACHE_DIR') else None
 
+# Size of the in-memory tier (per process), and the largest response it will hold
+CACHE_MEMORY_MAX_MB = int(os.environ.get('CACHE_MEMORY_MAX_MB', 256))
+CACHE_MEMORY_MAX_ITEM_MB = int(os.environ.get('CACHE_MEMORY_MAX_ITEM_MB', 8))
+
+# The oldest files in CACHE_DIR are removed once it exceeds this size
+CACHE_DISK_MAX_GB = float(os.environ.get('CACHE_DISK_MAX_GB', 10))
+
+# ------------------------------------------------------------------------------
+# In-memory indexes (loaded at startup, reloaded on SIGHUP)
+# ------------------------------------------------------------------------------
+
+# If the GTDB tree (taxon browser) should be held in memory (per process), otherwise it is queried
+TAXON_TREE_INDEX_ENABLED = os.environ.get('TAXON_TREE_INDEX_ENABLED', 'true').lower() == 'true'
+
+# If the distinct taxa of each rank (taxon autocomplete) should be held in memory, otherwise they are queried
+TAXON_SEARCH_INDEX_ENABLED = os.environ.get('TAXON_SEARCH_INDEX_ENABLED', 'true').lower() == 'true'
+
+# If the taxa from previous releases (taxon_hist_summary) should be held in memory, otherwise taxon_hist is queried
+TAXON_HISTORY_INDEX_ENABLED = os.environ.get('TAXON_HISTORY_INDEX_ENABLED', 'true').lower() == 'true'
+
+# ------------------------------------------------------------------------------
+# Analytics (Plausible)
+# ------------------------------------------------------------------------------
+
+ANALYTICS_URL = 'https://gtdb-stats.ecogenomic.org/api/event'
+
+# Events are dropped once this many are waiting to be sent
+ANALYTICS_QUEUE_SIZE = int(os.environ.get('ANALYTICS_QUEUE_SIZE', 10000))
+
+# Maximum number of events sent concurrently, and how long to wait to fill a batch (seconds)
+ANALYTICS_BATCH_SIZE = int(os.environ.get('ANALYTICS_BATCH_SIZE', 20))
+ANALYTICS_FLUSH_INTERVAL = float(os.environ.get('ANALYTICS_FLUSH_INTERVAL', 1.0))
+
+# Timeout for each request to the analytics server (seconds)
+ANALYTICS_TIMEOUT = float(os.environ.get('ANALYTICS_TIMEOUT', 2.0))
+
 # ------------------------------------------------------------------------------
 # RedisQueue
 # ------------------------------------------------------------------------------
@@ -92,6 +132,19 @@ ANI_USER_MAX_FILE_NAME_LENGTH = 200
 ANI_QUEUE_MAX_PENDING_JOBS = 1000
 ANI_JOB_ID_MAX_VALUE = 2 ** 32 - 1
 
+# Optimal leaf ordering is super-linear, so heatmaps with more genomes than this (on an axis) are not optimally ordered
+ANI_HEATMAP_OPTIMAL_ORDERING_MAX_GENOMES = int(os.environ.get('ANI_HEATMAP_OPTIMAL_ORDERING_MAX_GENOMES', 250))
+
+# Uploaded genomes are stored here (gzip compressed, named by their SHA-256), otherwise in skani.user_genome
+ANI_USER_GENOME_DIR: Path | None = Path(os.environ['ANI_USER_GENOME_DIR']) if os.environ.get(
+    'ANI_USER_GENOME_DIR') else None
+
+# Queue positions (for job status polling) are computed from a list of queued jobs that is refreshed this often
+ANI_QUEUE_POSITION_CACHE_SECONDS = float(os.environ.get('ANI_QUEUE_POSITION_CACHE_SECONDS', 5))
+
+# Maximum number of completed jobs (including their results) to hold in memory per process
+ANI_JOB_SNAPSHOT_CACHE_MAX_ITEMS = int(os.environ.get('ANI_JOB_SNAPSHOT_CACHE_MAX_ITEMS', 32))
+
 # Maximum runtime before job is marked as failed (seconds)
 FASTANI_JOB_TIMEOUT = '10m'
 
@@ -17,6 +17,7 @@ from api.model.advanced import (
     AdvancedSearchResult,
     AdvancedSearchHeader
 )
+from api.util.pagination import CURSOR_START, COUNT_CACHE, STREAM_YIELD_PER, encode_cursor, decode_cursor
 from api.util.url import base64url_to_str
 
 # Pre-compiled Regex
@@ -88,11 +89,11 @@ def parse_groups(groups: Dict[int, str]) -> dict[int, tuple[AdvancedSearchColumn
     return out
 
 
-def get_method(
+def get_method_sql(
         expression,
-        groups: dict[int, tuple[AdvancedSearchColumn, AdvancedSearchOperator, str]],
-        db: Session
-):
+        groups: dict[int, tuple[AdvancedSearchColumn, AdvancedSearchOperator, str]]
+) -> tuple[list[AdvancedSearchColumn], str, str, dict[str, Any]]:
+    """Returns the columns to select, the where clause, the FROM clause (including the where clause) and parameters."""
     mv_prefix = 'mv'
 
     # Set the operators
@@ -147,17 +148,62 @@ def get_method(
     set_base_cols = frozenset(BASE_COLS)
     columns_to_select = list(BASE_COLS)
     columns_to_select.extend([v[0] for k, v in groups.items() if v[0] not in set_base_cols])
+    str_from = (f"FROM genomes g INNER JOIN metadata_mtview mv "
+                f"on mv.id = g.id WHERE g.genome_source_id != 1 AND ({str_where})")
+    return columns_to_select, str_where, str_from, parameters
+
+
+def get_method(
+        expression,
+        groups: dict[int, tuple[AdvancedSearchColumn, AdvancedSearchOperator, str]],
+        db: Session,
+        cursor: str | None = None,
+        items_per_page: int | None = None
+):
+    columns_to_select, str_where, str_from, parameters = get_method_sql(expression, groups)
     str_columns = ', '.join([f'mv.{x.column.key}' for x in columns_to_select])
-    query = sm.text(f"SELECT {str_columns} FROM genomes g INNER JOIN metadata_mtview mv "
-                    f"on mv.id = g.id WHERE g.genome_source_id != 1 AND ({str_where}) "
-                    f"ORDER BY g.id")
-    results = db.exec(query, params=parameters).all()
-    out_rows = [x._asdict() for x in results]
     out_headers = [AdvancedSearchHeader(text=x.display, value=x.column.key) for x in columns_to_select]
-    return AdvancedSearchResult(headers=out_headers, rows=out_rows)
 
+    if cursor is None:
+        query = sm.text(f"SELECT {str_columns} {str_from} ORDER BY g.id")
+        results = db.exec(query, params=parameters).all()
+        out_rows = [x._asdict() for x in results]
+        return AdvancedSearchResult(headers=out_headers, rows=out_rows)
+
+    # Cursor pagination, rows are ordered by the genome id
+    if not items_per_page or items_per_page < 1:
+        raise HttpBadRequest('You must specify itemsPerPage when using a cursor.')
+    if cursor == CURSOR_START:
+        count_key = f'advanced|{str_where}|{sorted(parameters.items())!r}'
+        total_rows = COUNT_CACHE.get(count_key)
+        if total_rows is None:
+            total_rows = db.exec(sm.text(f"SELECT count(*) {str_from}"), params=parameters).scalar_one()
+            COUNT_CACHE.set(count_key, total_rows)
+    else:
+        (last_id,), total_rows = decode_cursor(cursor, 1)
+        str_from = f'{str_from} AND g.id > :cursor_id'
+        parameters['cursor_id'] = int(last_id)
+
+    # Fetch one extra row to determine if there is another page
+    query = sm.text(f"SELECT g.id AS cursor_id, {str_columns} {str_from} ORDER BY g.id LIMIT :cursor_limit")
+    parameters['cursor_limit'] = items_per_page + 1
+    results = db.exec(query, params=parameters).all()
 
-def get_advanced_search(query: Dict[str, Any], db: Session) -> AdvancedSearchResult:
+    next_cursor = None
+    if len(results) > items_per_page:
+        results = results[:items_per_page]
+        next_cursor = encode_cursor([results[-1].cursor_id], total_rows)
+    out_rows = list()
+    for result in results:
+        row = result._asdict()
+        row.pop('cursor_id')
+        out_rows.append(row)
+    return AdvancedSearchResult(headers=out_headers, rows=out_rows, totalRows=total_rows, nextCursor=next_cursor)
+
+
+def parse_advanced_search_query(
+        query: Dict[str, Any]
+) -> tuple[str, dict[int, tuple[AdvancedSearchColumn, AdvancedSearchOperator, str]]]:
     """This method expects all parameters to be URL-Safe Base64 encoded.
          i.e. the static/js/util.js "base64EncodeUrl" method.
 
@@ -180,6 +226,9 @@ def get_advanced_search(query: Dict[str, Any], db: Session) -> AdvancedSearchRes
 
          The final URL will then be:
              /api/v2/search/advanced?exp=KDAmMSl8Mg~~&=0MX4yfmFzZA~~&1=...&2=...
+
+         Results can optionally be paged through by providing a cursor ("*" for
+         the first page, then the nextCursor of the previous page) and itemsPerPage.
     """
 
     # Get and validate the expression
@@ -211,21 +260,28 @@ def get_advanced_search(query: Dict[str, Any], db: Session) -> AdvancedSearchRes
     except Exception:
         raise HttpBadRequest('Error parsing groups.')
 
-    return get_method(expression, parsed_groups, db=db)
+    return expression, parsed_groups
 
 
-def adv_search_query_to_rows(result: AdvancedSearchResult):
-    out = list()
+def get_advanced_search(query: Dict[str, Any], db: Session, cursor: str | None = None,
+                        items_per_page: int | None = None) -> AdvancedSearchResult:
+    expression, parsed_groups = parse_advanced_search_query(query)
+    return get_method(expression, parsed_groups, db=db, cursor=cursor, items_per_page=items_per_page)
+
 
-    header_row = list()
-    for header in result.headers:
-        header_row.append(header.text)
-    out.append(header_row)
+def get_advanced_search_download_sql(query: Dict[str, Any]) -> tuple[list[AdvancedSearchColumn], str, dict[str, Any]]:
+    """Returns the columns, SQL statement, and parameters of an advanced search without pagination."""
+    expression, parsed_groups = parse_advanced_search_query(query)
+    columns_to_select, _, str_from, parameters = get_method_sql(expression, parsed_groups)
+    str_columns = ', '.join([f'mv.{x.column.key}' for x in columns_to_select])
+    return columns_to_select, f"SELECT {str_columns} {str_from} ORDER BY g.id", parameters
 
-    for row in result.rows:
-        row_out = list()
-        for key in result.headers:
-            row_out.append(row[key.value])
-        out.append(row_out)
 
-    return out
+def iter_advanced_search_download_rows(columns: list[AdvancedSearchColumn], statement: str,
+                                       parameters: dict[str, Any], db: Session):
+    """Yields the header and every row of the advanced search, read from a server-side cursor."""
+    yield [x.display for x in columns]
+    query = sm.text(statement).execution_options(yield_per=STREAM_YIELD_PER)
+    for partition in db.exec(query, params=parameters).partitions():
+        for row in partition:
+            yield tuple(row)
@@ -1,9 +1,12 @@
+import asyncio
 import re
 from typing import List, Optional
 
 import sqlmodel as sm
 from sqlalchemy import func
+from sqlalchemy.exc import ProgrammingError
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from api.config import GTDB_RELEASES
 from api.db.gtdb import (
@@ -11,8 +14,8 @@ from api.db.gtdb import (
     DbMetadataNucleotide,
     DbMetadataTaxonomy, DbMetadataTypeMaterial, DbGtdbTypeView
 )
-from api.db.gtdb_web import DbTaxonHist, DbLpsnUrl, DbGenomeTaxId
-from api.exceptions import HttpNotFound, HttpBadRequest
+from api.db.gtdb_web import DbTaxonHist, DbLpsnUrl, DbGenomeTaxId, DbGenomeCard
+from api.exceptions import HttpNotFound
 from api.model.genome import (
     GenomeMarkersSummary, GenomeMetadata, GenomeTaxonHistory, GenomeCard, GenomeBase,
     GenomeMetadataNucleotide,
@@ -37,38 +40,21 @@ def get_canonical_markers(gid: str, db: Session) -> GenomeMarkersSummary:
     results = db.exec(query).first()
     if results is None:
         raise HttpNotFound('Genome not found')
-
-    out = GenomeMarkersSummary(
-        bac_n_unique=results.bac_n_unq,
-        bac_n_multi_unique=results.bac_n_muq,
-        bac_n_multi_non_unique=results.bac_n_mul,
-        bac_n_missing=results.bac_n_mis,
-        arc_n_unique=results.arc_n_unq,
-        arc_n_multi_unique=results.arc_n_muq,
-        arc_n_multi_non_unique=results.arc_n_mul,
-        arc_n_missing=results.arc_n_mis
+    return canonical_markers_to_summary(results)
+
+
+def canonical_markers_to_summary(row: DbMvGenomeCanonicalMarkers) -> GenomeMarkersSummary:
+    return GenomeMarkersSummary(
+        bac_n_unique=row.bac_n_unq,
+        bac_n_multi_unique=row.bac_n_muq,
+        bac_n_multi_non_unique=row.bac_n_mul,
+        bac_n_missing=row.bac_n_mis,
+        arc_n_unique=row.arc_n_unq,
+        arc_n_multi_unique=row.arc_n_muq,
+        arc_n_multi_non_unique=row.arc_n_mul,
+        arc_n_missing=row.arc_n_mis
     )
-    return out
 
-def maybe_get_canonical_markers_by_id(gid: int, db: Session) -> GenomeMarkersSummary | None:
-    query = (
-        sm.select(DbMvGenomeCanonicalMarkers)
-        .where(DbMvGenomeCanonicalMarkers.genome_id == gid)
-    )
-    results = db.exec(query).first()
-    if results is None:
-        return None
-    out = GenomeMarkersSummary(
-        bac_n_unique=results.bac_n_unq,
-        bac_n_multi_unique=results.bac_n_muq,
-        bac_n_multi_non_unique=results.bac_n_mul,
-        bac_n_missing=results.bac_n_mis,
-        arc_n_unique=results.arc_n_unq,
-        arc_n_multi_unique=results.arc_n_muq,
-        arc_n_multi_non_unique=results.arc_n_mul,
-        arc_n_missing=results.arc_n_mis
-    )
-    return out
 
 def is_surveillance_genome(gid: str, db: Session) -> Optional[str]:
     # Check if this is a surveillance genome
@@ -118,88 +104,104 @@ def genome_taxon_history(gid: str, db: Session) -> List[GenomeTaxonHistory]:
     return sorted(out, key=lambda x: GTDB_RELEASES.index(x.release), reverse=True)
 
 
-def maybe_get_lspn_url(species: str, db_web: Session) -> Optional[str]:
-    # Load the LSPN URL if it exists
-    query = sm.select(DbLpsnUrl.lpsn_url).where(DbLpsnUrl.gtdb_species == species)
-    results = db_web.exec(query).all()
-    if len(results) == 1:
-        return results[0]
-    else:
-        return None
+async def get_species_cluster_summary(species: str | None, db_gtdb: AsyncSession) -> tuple[int | None, str]:
+    """Returns the number of genomes in the species cluster and the representative genome, in one query."""
+    if species is None or len(species) <= 3 or not species.startswith('s__'):
+        return None, 'Error'
 
+    is_rep = sm.and_(DbMetadataTaxonomy.gtdb_representative == True,
+                     DbMetadataTaxonomy.gtdb_genome_representative != None)
+    query = (
+        sm.select(
+            func.count().label('n_genomes'),
+            func.count().filter(is_rep).label('n_reps'),
+            func.max(DbMetadataNcbi.ncbi_genbank_assembly_accession).filter(is_rep).label('rep_accession')
+        )
+        .select_from(DbMetadataTaxonomy)
+        .outerjoin(DbMetadataNcbi, DbMetadataNcbi.id == DbMetadataTaxonomy.id)
+        .where(DbMetadataTaxonomy.gtdb_species == species)
+    )
+    result = (await db_gtdb.exec(query)).first()
+    if result.n_reps != 1:
+        return result.n_genomes, 'Error'
+    return result.n_genomes, result.rep_accession
 
-def rank_count(rank, db_gtdb: Session):
-    """Returns the number of genomes in a given GTDB rank."""
-    if rank is None:
-        raise HttpBadRequest('You must enter a GTDB rank.')
 
-    if len(rank) <= 3 or rank[0:3] not in {'d__', 'p__', 'c__', 'o__', 'f__', 'g__', 's__'}:
-        raise HttpBadRequest('Malformed GTDB rank.')
+async def get_genome_web_links(species: str | None, id_at_source: str,
+                               db_web: AsyncSession) -> tuple[str | None, dict | None]:
+    """Returns the LPSN URL for the species and the NCBI taxon ids for the genome, if they exist."""
+    lpsn_urls = (await db_web.exec(sm.select(DbLpsnUrl.lpsn_url).where(DbLpsnUrl.gtdb_species == species))).all()
+    taxids = (await db_web.exec(sm.select(DbGenomeTaxId.payload).where(DbGenomeTaxId.genome_id == id_at_source))).all()
+    lpsn_url = lpsn_urls[0] if len(lpsn_urls) == 1 else None
+    ranks_ncbi = taxids[0] if len(taxids) == 1 else None
+    return lpsn_url, ranks_ncbi
 
-    # Determine which rank to query.
-    rank_to_col = {'d__': DbMetadataTaxonomy.gtdb_domain,
-                   'p__': DbMetadataTaxonomy.gtdb_phylum,
-                   'c__': DbMetadataTaxonomy.gtdb_class,
-                   'o__': DbMetadataTaxonomy.gtdb_order,
-                   'f__': DbMetadataTaxonomy.gtdb_family,
-                   'g__': DbMetadataTaxonomy.gtdb_genus,
-                   's__': DbMetadataTaxonomy.gtdb_species}
 
-    # Query for the taxonomy history
+async def get_precomputed_genome_card(accession: str, db_web: AsyncSession) -> GenomeCard | None:
+    """Returns the genome card built at release time (scripts/release/update_genome_card.py), if it exists."""
     query = (
-        sm.select(func.count('*')).
-        select_from(DbMetadataTaxonomy).
-        where(rank_to_col[rank[0:3]] == rank)
+        sm.select(DbGenomeCard.accessions, DbGenomeCard.payload)
+        .where(DbGenomeCard.gid == canonical_gid(accession))
     )
-    cnt = db_gtdb.exec(query).first()
-    return {'count': cnt}
+    try:
+        row = (await db_web.exec(query)).first()
+    except ProgrammingError:
+        # The table has not been built for this release, the transaction must be reset before it can be re-used
+        await db_web.rollback()
+        return None
 
+    # Other forms of the accession (e.g. a different version) are not found by build_genome_card
+    if row is None or accession not in row.accessions:
+        return None
+    return GenomeCard.model_validate(row.payload)
 
-def taxonomy_species_cluster_stats(species, db_gtdb: Session):
-    res_rep_qry = (
-        sm.select(
-            DbMetadataNcbi.ncbi_genbank_assembly_accession.label('name'),
-            DbMetadataTaxonomy.gtdb_representative
-        )
-        .join(DbGenomes, DbGenomes.id == DbMetadataNcbi.id)
-        .join(DbMetadataTaxonomy, DbMetadataTaxonomy.id == DbGenomes.id)
-        .where(DbMetadataTaxonomy.gtdb_species == species)
-        .where(DbMetadataTaxonomy.gtdb_genome_representative != None)
+
+async def genome_card(accession: str, db_gtdb: AsyncSession, db_web: AsyncSession) -> GenomeCard:
+    card = await get_precomputed_genome_card(accession, db_web)
+    if card is not None:
+        return card
+    return await build_genome_card(accession, db_gtdb, db_web)
+
+
+async def build_genome_card(accession: str, db_gtdb: AsyncSession, db_web: AsyncSession) -> GenomeCard:
+    # All per-genome metadata is a 1:1 join on the genome id
+    query = (
+        sm.select(DbGenomes, DbMetadataGenes, DbMetadataNcbi, DbMetadataNucleotide, DbMetadataTaxonomy,
+                  DbMetadataTypeMaterial, DbGtdbTypeView, DbMvGenomeCanonicalMarkers)
+        .outerjoin(DbMetadataGenes, DbMetadataGenes.id == DbGenomes.id)
+        .outerjoin(DbMetadataNcbi, DbMetadataNcbi.id == DbGenomes.id)
+        .outerjoin(DbMetadataNucleotide, DbMetadataNucleotide.id == DbGenomes.id)
+        .outerjoin(DbMetadataTaxonomy, DbMetadataTaxonomy.id == DbGenomes.id)
+        .outerjoin(DbMetadataTypeMaterial, DbMetadataTypeMaterial.id == DbGenomes.id)
+        .outerjoin(DbGtdbTypeView, DbGtdbTypeView.id == DbGenomes.id)
+        .outerjoin(DbMvGenomeCanonicalMarkers, DbMvGenomeCanonicalMarkers.genome_id == DbGenomes.id)
     )
-    qry_out = db_gtdb.exec(res_rep_qry).all()
-    rows = [row._asdict() for row in qry_out]
-    cluster_size = len(rows)
-
-    rep = [x for x in rows if x['gtdb_representative']]
-    if len(rep) != 1:
-        raise HttpBadRequest('More than one representative genome found.')
-
-    rep_gid = rep[0]['name']
-    return {'representative': rep_gid, 'cluster_size': cluster_size}
-
-
-def genome_card(accession: str, db_gtdb: Session, db_web: Session) -> GenomeCard:
-    # Look through multiple tables to try find a matching record
-    genome = db_gtdb.exec(sm.select(DbGenomes).where(DbGenomes.id_at_source == accession)).first()
-    if genome is None:
-        metadata_ncbi_gca = db_gtdb.exec(
-            sm.select(DbMetadataNcbi).where(DbMetadataNcbi.ncbi_genbank_assembly_accession == accession)).first()
-        if metadata_ncbi_gca is not None:
-            genome = db_gtdb.exec(sm.select(DbGenomes).where(DbGenomes.id == metadata_ncbi_gca.id)).first()
-            genome = db_gtdb.exec(sm.select(DbGenomes).where(DbGenomes.id_at_source == genome.id_at_source)).first()
-    if genome is None:
-        genome = db_gtdb.exec(sm.select(DbGenomes).where(DbGenomes.name.ilike(f'%({accession})%'))).first()
-    if genome is None:
+
+    # Match either the GTDB accession or the NCBI GenBank accession, preferring the former
+    gca_genome_ids = (
+        sm.select(DbMetadataNcbi.id)
+        .where(DbMetadataNcbi.ncbi_genbank_assembly_accession == accession)
+        .scalar_subquery()
+    )
+    hit = (await db_gtdb.exec(
+        query.where(sm.or_(DbGenomes.id_at_source == accession, DbGenomes.id.in_(gca_genome_ids)))
+        .order_by((DbGenomes.id_at_source == accession).desc())
+        .limit(1)
+    )).first()
+
+    # Otherwise, look for the accession as part of the genome name (e.g. UBA genomes)
+    if hit is None:
+        hit = (await db_gtdb.exec(query.where(DbGenomes.name.ilike(f'%({accession})%')).limit(1))).first()
+    if hit is None:
         raise HttpNotFound('Genome not found')
+    (genome, metadata_gene, metadata_ncbi, metadata_nucleotide, metadata_taxonomy,
+     metadata_type_material, gtdb_type_view, canonical_markers) = hit
 
-    metadata_gene = db_gtdb.exec(sm.select(DbMetadataGenes).where(DbMetadataGenes.id == genome.id)).first()
-    metadata_ncbi = db_gtdb.exec(sm.select(DbMetadataNcbi).where(DbMetadataNcbi.id == genome.id)).first()
-    metadata_nucleotide = db_gtdb.exec(
-        sm.select(DbMetadataNucleotide).where(DbMetadataNucleotide.id == genome.id)).first()
-    metadata_taxonomy = db_gtdb.exec(sm.select(DbMetadataTaxonomy).where(DbMetadataTaxonomy.id == genome.id)).first()
-    metadata_type_material = db_gtdb.exec(
-        sm.select(DbMetadataTypeMaterial).where(DbMetadataTypeMaterial.id == genome.id)).first()
-    gtdb_type_view = db_gtdb.exec(sm.select(DbGtdbTypeView).where(DbGtdbTypeView.id == genome.id)).first()
+    # The species cluster (gtdb) and external links (gtdb_web) are independent, run them concurrently
+    (species_cluster_count, species_rep), (lpsn_url, ranks_ncbi) = await asyncio.gather(
+        get_species_cluster_summary(metadata_taxonomy.gtdb_species, db_gtdb),
+        get_genome_web_links(metadata_taxonomy.gtdb_species, genome.id_at_source, db_web)
+    )
 
     m = re.search(r'\((UBA\d+)\)', genome.name)
     subunit_summary_list = []
@@ -215,28 +217,10 @@ def genome_card(accession: str, db_gtdb: Session, db_web: Session) -> GenomeCard
         ubanumber = m.group(1)
     else:
         ubanumber = ''
-    try:
-        species_cluster_count = rank_count(metadata_taxonomy.gtdb_species, db_gtdb)['count']
-    except Exception as e:
-        species_cluster_count = None
-
-    # Get the species representative.
-    try:
-        species_cluster_info = taxonomy_species_cluster_stats(metadata_taxonomy.gtdb_species, db_gtdb)
-        species_rep = species_cluster_info['representative']
-    except Exception:
-        species_rep = 'Error'
-
-    # Load the LSPN URL if it exists
-    lpsn_url = maybe_get_lspn_url(metadata_taxonomy.gtdb_species, db_web)
-
-    taxid_resp = db_web.exec(sm.select(DbGenomeTaxId).where(DbGenomeTaxId.genome_id == genome.id_at_source)).all()
-
     ncbi_taxonomy_filtered = list()
     ncbi_taxonomy_unfiltered = list()
 
-    if len(taxid_resp) == 1:
-        ranks_ncbi = taxid_resp[0].payload
+    if ranks_ncbi is not None:
         rank_list = []
         for idv_rank in metadata_taxonomy.ncbi_taxonomy.split(';'):
             if idv_rank in ranks_ncbi:
@@ -282,7 +266,7 @@ def genome_card(accession: str, db_gtdb: Session, db_web: Session) -> GenomeCard
         out_accession = genome.id_at_source
 
     # Load marker summary
-    marker_summary = maybe_get_canonical_markers_by_id(genome.id, db_gtdb)
+    marker_summary = canonical_markers_to_summary(canonical_markers) if canonical_markers else None
 
     out_metadata_gene = GenomeMetadataGene(
         checkm_completeness=metadata_gene.checkm_completeness,
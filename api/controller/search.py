@@ -1,46 +1,92 @@
 import re
 import shlex
-from typing import List
-
 import sqlmodel as sm
-from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from api.db.gtdb import DbGtdbSearchMtView
 from api.exceptions import HttpBadRequest
 from api.model.search import SearchGtdbRequest, SearchGtdbResponse, SearchColumnEnum, SearchGtdbRow
 from api.util.accession import canonical_gid
+from api.util.pagination import count_rows, paginate_keyset, STREAM_YIELD_PER
+
+
+# The columns searched for each search field
+SEARCH_FIELDS = {
+    SearchColumnEnum.ALL: (DbGtdbSearchMtView.gtdb_taxonomy,
+                           DbGtdbSearchMtView.id_at_source,
+                           DbGtdbSearchMtView.ncbi_organism_name,
+                           DbGtdbSearchMtView.ncbi_taxonomy,
+                           DbGtdbSearchMtView.ncbi_genbank_assembly_accession,
+                           DbGtdbSearchMtView.formatted_source_id),
+    SearchColumnEnum.NCBI_GENOME_ID: (DbGtdbSearchMtView.id_at_source,
+                                      DbGtdbSearchMtView.ncbi_genbank_assembly_accession,
+                                      DbGtdbSearchMtView.formatted_source_id),
+    SearchColumnEnum.NCBI_ORG_NAME: (DbGtdbSearchMtView.ncbi_organism_name,),
+    SearchColumnEnum.NCBI_TAX: (DbGtdbSearchMtView.ncbi_taxonomy,),
+    SearchColumnEnum.GTDB_TAX: (DbGtdbSearchMtView.gtdb_taxonomy,),
+}
+
+
+def search_document_sql(list_fields) -> str:
+    """The SQL expression that is searched for a group of columns.
+
+    A pg_trgm GIN index exists on this expression for each group of columns in
+    SEARCH_FIELDS (see scripts/release/create_search_indexes.py), so it must be
+    generated identically here and there. Columns are joined by the unit separator,
+    so a keyword cannot match across two columns.
+    """
+    return " || chr(31) || ".join(f"coalesce({field.key}, '')" for field in list_fields)
 
 
 def generate_search_query_2(list_fields, list_keywords):
+    """Legacy predicate (one ILIKE per column and keyword), kept for benchmarking."""
     where = list()
     for field in list_fields:
         where.extend([field.ilike(f'%{x}%') for x in list_keywords])
     return where
 
 
-def search_gtdb_to_rows(response: SearchGtdbResponse) -> List:
-    out = list()
-    out.append([
-        'accession',
-        'ncbi_organism_name',
-        'ncbi_taxonomy',
-        'gtdb_taxonomy',
-        'gtdb_species_representative',
-        'ncbi_type_material'
-    ])
-    for row in response.rows:
-        out.append([
-            row.accession,
-            row.ncbiOrgName,
-            row.ncbiTaxonomy,
-            row.gtdbTaxonomy,
-            row.isGtdbSpeciesRep,
-            row.isNcbiTypeMaterial
-        ])
-    return out
-
-
-def search_gtdb(request: SearchGtdbRequest, db: Session) -> SearchGtdbResponse:
+def generate_search_query_trgm(list_fields, list_keywords):
+    """One ILIKE per keyword against the trigram-indexed search document.
+
+    Keywords of three or more characters are resolved by the index, shorter
+    keywords have no trigrams and fall back to a scan of the view.
+    """
+    document = sm.literal_column(search_document_sql(list_fields), type_=sm.String)
+    return [document.ilike(f'%{x}%') for x in list_keywords]
+
+
+NCBI_TYPE_MATERIAL_CATEGORIES = frozenset({
+    'assembly from type material',
+    'assembly designated as neotype',
+    'assembly designated as reftype',
+    'assembly designated as neotype',
+})
+
+SEARCH_GTDB_DOWNLOAD_HEADER = (
+    'accession',
+    'ncbi_organism_name',
+    'ncbi_taxonomy',
+    'gtdb_taxonomy',
+    'gtdb_species_representative',
+    'ncbi_type_material'
+)
+
+
+def search_gtdb_hit_to_row(hit) -> SearchGtdbRow:
+    return SearchGtdbRow(
+        gid=hit.id_at_source,
+        accession=hit.id_at_source,
+        ncbiOrgName=hit.ncbi_organism_name,
+        ncbiTaxonomy=hit.ncbi_taxonomy,
+        gtdbTaxonomy=hit.gtdb_taxonomy,
+        isGtdbSpeciesRep=hit.gtdb_representative is True,
+        isNcbiTypeMaterial=hit.ncbi_type_material_designation in NCBI_TYPE_MATERIAL_CATEGORIES
+    )
+
+
+def search_gtdb_query(request: SearchGtdbRequest):
+    """Returns the search query (unordered), and the (column, descending) pairs it should be sorted by."""
     # If the search string matches an accession, convert it to the canonical gid
     keywrd = request.search.strip()
     if re.match(r'^(?:GB_|RS_)?(?:GCA|GCF)+_\d{9}\.\d$', keywrd):
@@ -53,27 +99,12 @@ def search_gtdb(request: SearchGtdbRequest, db: Session) -> SearchGtdbResponse:
         # Unclosed parenthesis
         keywords = [x for x in keywrd.split(' ') if len(x) > 0]
 
-    if request.searchField is SearchColumnEnum.ALL:
-        list_fields = (DbGtdbSearchMtView.gtdb_taxonomy,
-                       DbGtdbSearchMtView.id_at_source,
-                       DbGtdbSearchMtView.ncbi_organism_name,
-                       DbGtdbSearchMtView.ncbi_taxonomy,
-                       DbGtdbSearchMtView.ncbi_genbank_assembly_accession,
-                       DbGtdbSearchMtView.formatted_source_id)
-    elif request.searchField is SearchColumnEnum.NCBI_GENOME_ID and len(keywrd) > 1:
-        list_fields = (DbGtdbSearchMtView.id_at_source,
-                       DbGtdbSearchMtView.ncbi_genbank_assembly_accession,
-                       DbGtdbSearchMtView.formatted_source_id)
-    elif request.searchField is SearchColumnEnum.NCBI_ORG_NAME and len(keywrd) > 1:
-        list_fields = [DbGtdbSearchMtView.ncbi_organism_name]
-    elif request.searchField is SearchColumnEnum.NCBI_TAX and len(keywrd) > 1:
-        list_fields = [DbGtdbSearchMtView.ncbi_taxonomy]
-    elif request.searchField is SearchColumnEnum.GTDB_TAX and len(keywrd) > 1:
-        list_fields = [DbGtdbSearchMtView.gtdb_taxonomy]
+    if request.searchField is SearchColumnEnum.ALL or (request.searchField in SEARCH_FIELDS and len(keywrd) > 1):
+        list_fields = SEARCH_FIELDS[request.searchField]
     else:
         raise HttpBadRequest(f"Method must be one of: {list(SearchColumnEnum)}")
 
-    where_clause = generate_search_query_2(list_fields, keywords)
+    where_clause = generate_search_query_trgm(list_fields, keywords)
 
     query = (
         sm.select(
@@ -104,50 +135,64 @@ def search_gtdb(request: SearchGtdbRequest, db: Session) -> SearchGtdbResponse:
         ))
 
     # Determine the order_by clause
+    sort_columns = list()
     if request.sortBy:
-        order_by = list()
         for i, sort_by in enumerate(request.sortBy):
             # Attempt to get the sorting value, default to asc if not present
             try:
                 sort_desc = request.sortDesc[i]
-            except IndexError:
+            except (IndexError, TypeError):
                 sort_desc = False
 
             # Match the column
             if sort_by == 'accession':
-                order_by.append(
-                    DbGtdbSearchMtView.id_at_source.desc() if sort_desc else DbGtdbSearchMtView.id_at_source)
+                sort_columns.append((DbGtdbSearchMtView.id_at_source, sort_desc))
             elif sort_by == 'ncbiOrgName':
-                order_by.append(
-                    DbGtdbSearchMtView.ncbi_organism_name.desc() if sort_desc else DbGtdbSearchMtView.ncbi_organism_name)
+                sort_columns.append((DbGtdbSearchMtView.ncbi_organism_name, sort_desc))
             elif sort_by == 'ncbiTaxonomy':
-                order_by.append(
-                    DbGtdbSearchMtView.ncbi_taxonomy.desc() if sort_desc else DbGtdbSearchMtView.ncbi_taxonomy)
+                sort_columns.append((DbGtdbSearchMtView.ncbi_taxonomy, sort_desc))
             elif sort_by == 'gtdbTaxonomy':
-                order_by.append(
-                    DbGtdbSearchMtView.gtdb_taxonomy.desc() if sort_desc else DbGtdbSearchMtView.gtdb_taxonomy)
+                sort_columns.append((DbGtdbSearchMtView.gtdb_taxonomy, sort_desc))
             elif sort_by == 'isGtdbSpeciesRep':
-                order_by.append(
-                    DbGtdbSearchMtView.gtdb_representative.desc() if sort_desc else DbGtdbSearchMtView.gtdb_representative)
+                sort_columns.append((DbGtdbSearchMtView.gtdb_representative, sort_desc))
             elif sort_by == 'isNcbiTypeMaterial':
-                order_by.append(
-                    DbGtdbSearchMtView.ncbi_type_material_designation.desc() if sort_desc else DbGtdbSearchMtView.ncbi_type_material_designation)
+                sort_columns.append((DbGtdbSearchMtView.ncbi_type_material_designation, sort_desc))
             else:
                 raise HttpBadRequest(f'Unknown sortBy: {sort_by}')
-        query = query.order_by(*order_by)
+    return query, sort_columns
 
-    # Get the total number of rows in the table before pagination
-    total_rows = db.exec(sm.select(sm.func.count()).select_from(query)).first()
 
-    # Add pagination
-    if request.itemsPerPage and request.page:
-        query = query.limit(request.itemsPerPage)
-        query = query.offset(request.itemsPerPage * (request.page - 1))
+async def search_gtdb(request: SearchGtdbRequest, db: AsyncSession) -> SearchGtdbResponse:
+    query, sort_columns = search_gtdb_query(request)
 
-    # Execute the query
-    search_results = db.exec(query)
-    all_rows = list()
-    all_rows.extend(list(search_results))
+    # Cursor pagination, the accession is unique so it breaks any ties
+    next_cursor = None
+    if request.cursor is not None:
+        if not request.itemsPerPage:
+            raise HttpBadRequest('You must specify itemsPerPage when using a cursor.')
+        if not any(col is DbGtdbSearchMtView.id_at_source for col, _ in sort_columns):
+            sort_columns.append((DbGtdbSearchMtView.id_at_source, False))
+        all_rows, total_rows, next_cursor = await paginate_keyset(
+            query, sort_columns, request.cursor, request.itemsPerPage, db
+        )
+
+    # Offset pagination
+    else:
+        if sort_columns:
+            query = query.order_by(*[col.desc() if desc else col for col, desc in sort_columns])
+
+        # Get the total number of rows in the table before pagination
+        total_rows = await count_rows(query, db)
+
+        # Add pagination
+        if request.itemsPerPage and request.page:
+            query = query.limit(request.itemsPerPage)
+            query = query.offset(request.itemsPerPage * (request.page - 1))
+
+        # Execute the query
+        search_results = await db.exec(query)
+        all_rows = list()
+        all_rows.extend(list(search_results))
 
     # if the genome is a surveillance genome, we need to check in a separate table
     # out_survey = None
@@ -157,26 +202,26 @@ def search_gtdb(request: SearchGtdbRequest, db: Session) -> SearchGtdbResponse:
     #     if len(list(survey_hits)) > 0:
     #         out_survey = request.search  # TODO: ??
 
-    ncbi_type_material_categories = frozenset({
-        'assembly from type material',
-        'assembly designated as neotype',
-        'assembly designated as reftype',
-        'assembly designated as neotype',
-    })
-
     # Apply filters and create objects
-    out_rows = list()
-    for hit in all_rows:
-        out_rows.append(
-            SearchGtdbRow(
-                gid=hit.id_at_source,
-                accession=hit.id_at_source,
-                ncbiOrgName=hit.ncbi_organism_name,
-                ncbiTaxonomy=hit.ncbi_taxonomy,
-                gtdbTaxonomy=hit.gtdb_taxonomy,
-                isGtdbSpeciesRep=hit.gtdb_representative is True,
-                isNcbiTypeMaterial=hit.ncbi_type_material_designation in ncbi_type_material_categories
+    out_rows = [search_gtdb_hit_to_row(hit) for hit in all_rows]
+    return SearchGtdbResponse(rows=out_rows, totalRows=total_rows, nextCursor=next_cursor)
+
+
+async def iter_search_gtdb_download_rows(request: SearchGtdbRequest, db: AsyncSession):
+    """Yields the header and every row of the search, read from a server-side cursor."""
+    query, sort_columns = search_gtdb_query(request)
+    if sort_columns:
+        query = query.order_by(*[col.desc() if desc else col for col, desc in sort_columns])
+
+    yield SEARCH_GTDB_DOWNLOAD_HEADER
+    result = await db.stream(query.execution_options(yield_per=STREAM_YIELD_PER))
+    async for partition in result.partitions():
+        for hit in partition:
+            yield (
+                hit.id_at_source,
+                hit.ncbi_organism_name,
+                hit.ncbi_taxonomy,
+                hit.gtdb_taxonomy,
+                hit.gtdb_representative is True,
+                hit.ncbi_type_material_designation in NCBI_TYPE_MATERIAL_CATEGORIES
             )
-        )
-
-    return SearchGtdbResponse(rows=out_rows, totalRows=total_rows)
@@ -1,33 +1,41 @@
+import bisect
 import random
-from typing import Collection
+from datetime import datetime, timezone
+from typing import Any, Collection, Iterator
 
 import numpy as np
 import sqlmodel as sm
 from fastapi import UploadFile
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session
+from starlette.concurrency import run_in_threadpool
 
 from api.config import (
-    ANI_JOB_ID_MAX_VALUE, ANI_MAX_PAIRWISE, ANI_QUEUE_MAX_PENDING_JOBS, ANI_USER_MAX_FILE_COUNT,
-    ANI_USER_MAX_FILE_NAME_LENGTH, ANI_USER_MAX_FILE_SIZE_MB_EACH
+    ANI_JOB_ID_MAX_VALUE, ANI_JOB_SNAPSHOT_CACHE_MAX_ITEMS, ANI_MAX_PAIRWISE, ANI_QUEUE_MAX_PENDING_JOBS,
+    ANI_QUEUE_POSITION_CACHE_SECONDS, ANI_USER_GENOME_DIR, ANI_USER_MAX_FILE_COUNT, ANI_USER_MAX_FILE_NAME_LENGTH,
+    ANI_USER_MAX_FILE_SIZE_MB_EACH
 )
 from api.db.common import (
-    DbGenomesOnDisk, DbSkaniGenome, DbSkaniJob, DbSkaniJobQuery, DbSkaniJobReference, DbSkaniJobResult, DbSkaniParam,
-    DbSkaniUserGenome
+    DbGenomesOnDisk, DbSkaniGenome, DbSkaniJob, DbSkaniJobQuery, DbSkaniJobReference, DbSkaniJobResult,
+    DbSkaniJobResultLeaves, DbSkaniParam, DbSkaniResult, DbSkaniUserGenome
 )
 from api.db.gtdb import DbGenomes, DbMetadataNcbi, DbMetadataTaxonomy
 from api.exceptions import HttpBadRequest, HttpInternalServerError, HttpNotFound
 from api.model.skani import (
     SkaniCalculationMode, SkaniCreatedJobResponse, SkaniJobDataHeatmapResponse, SkaniJobDataIndexResponse,
-    SkaniJobDataTableResponse,
     SkaniJobRequest, SkaniJobStatusResponse, SkaniJobUploadMetadata, SkaniParameters,
-    SkaniResultTableRow,
     SkaniValidateGenomesRequest,
-    SkaniValidateGenomesResponse, SkaniVersion, UtilSkaniJobResults
+    SkaniValidateGenomesResponse, SkaniVersion, UtilSkaniJobResults, UtilSkaniJobSnapshot
 )
 from api.util.accession import canonical_gid
-from api.util.io import read_upload_file_bytes_limit
-from api.util.matrix import cluster_matrix
+from api.util.cache_store import ExpiringValue, LruCache
+from api.util.io import (
+    add_to_content_addressed_store, arrays_to_npz, read_upload_file_bytes_limit, scale_to_int16,
+    spool_upload_file_gzip
+)
+from api.util.matrix import CLUSTER_LEAVES_METHOD, cluster_leaves
 
 
 # HELPER METHODS
@@ -129,81 +137,111 @@ async def skani_create_job(
                     )
 
     # After validation has completed, read the content of the files (not trusting file size metadata!)
+    # Files stored on disk (by hash) are spooled to a temporary file until the job has been created
     d_file_content = dict()
-    if uploaded_files is not None and len(uploaded_files) > 0:
-        for cur_file in uploaded_files:
-
-            # Attempt to read the file
-            try:
-                d_file_content[cur_file.filename] = await read_upload_file_bytes_limit(
-                    cur_file,
-                    ani_user_max_file_size_bytes
+    d_spooled = dict()
+    try:
+        if uploaded_files is not None and len(uploaded_files) > 0:
+            for cur_file in uploaded_files:
+
+                # Attempt to read the file, it is either stored on disk (by hash) or in the database
+                try:
+                    if ANI_USER_GENOME_DIR:
+                        sha256_hex, tmp_path = await spool_upload_file_gzip(
+                            cur_file,
+                            ani_user_max_file_size_bytes,
+                            ANI_USER_GENOME_DIR
+                        )
+
+                        # As with files stored in the database, the last file with the same name is used
+                        if cur_file.filename in d_spooled:
+                            d_spooled[cur_file.filename].unlink(missing_ok=True)
+                        d_spooled[cur_file.filename] = tmp_path
+                        d_file_content[cur_file.filename] = None, sha256_hex
+                    else:
+                        d_file_content[cur_file.filename] = await read_upload_file_bytes_limit(
+                            cur_file,
+                            ani_user_max_file_size_bytes
+                        )
+                except UnicodeDecodeError:
+                    raise HttpBadRequest(f'Unable to read {cur_file.filename}, not a text file.')
+                except HttpBadRequest:
+                    raise
+                except Exception:
+                    raise HttpInternalServerError(f'Unable to read {cur_file.filename}, please try again.')
+
+        # If user genomes have been supplied, then extract their names
+        user_genome_ids = set(d_file_content.keys())
+
+        # Deduplicate input genomes
+        all_ncbi_genomes = (q_genomes.union(r_genomes)) - user_genome_ids
+
+        # Try and add those genomes into the "genome" mapping table and return their IDs
+        genomes_in_db = get_genome_ids_from_ncbi_names(all_ncbi_genomes, db)
+
+        # Remove any NCBI query+reference genomes that aren't in the database
+        q_genome_ids = {genomes_in_db[x] for x in q_genomes if genomes_in_db.get(x) is not None}
+        r_genome_ids = {genomes_in_db[x] for x in r_genomes if genomes_in_db.get(x) is not None}
+
+        # Validate that there are still results after removing the accessions that dont exist in the db
+        n_query_genomes_total = len(q_genome_ids) + len(q_genomes.intersection(user_genome_ids))
+        n_ref_genomes_total = len(r_genome_ids) + len(r_genomes.intersection(user_genome_ids))
+        if request.calcMode is SkaniCalculationMode.QVR:
+            if n_query_genomes_total == 0 or n_ref_genomes_total == 0:
+                raise HttpBadRequest(
+                    'No comparisons could be made as either all genomes in the query or reference list are not in the database. Uploaded genomes will need to be uploaded again.'
                 )
-            except UnicodeDecodeError:
-                raise HttpBadRequest(f'Unable to read {cur_file.filename}, not a text file.')
-            except Exception:
-                raise HttpInternalServerError(f'Unable to read {cur_file.filename}, please try again.')
-
-    # If user genomes have been supplied, then extract their names
-    user_genome_ids = set(d_file_content.keys())
-
-    # Deduplicate input genomes
-    all_ncbi_genomes = (q_genomes.union(r_genomes)) - user_genome_ids
-
-    # Try and add those genomes into the "genome" mapping table and return their IDs
-    genomes_in_db = get_genome_ids_from_ncbi_names(all_ncbi_genomes, db)
-
-    # Remove any NCBI query+reference genomes that aren't in the database
-    q_genome_ids = {genomes_in_db[x] for x in q_genomes if genomes_in_db.get(x) is not None}
-    r_genome_ids = {genomes_in_db[x] for x in r_genomes if genomes_in_db.get(x) is not None}
-
-    # Validate that there are still results after removing the accessions that dont exist in the db
-    n_query_genomes_total = len(q_genome_ids) + len(q_genomes.intersection(user_genome_ids))
-    n_ref_genomes_total = len(r_genome_ids) + len(r_genomes.intersection(user_genome_ids))
-    if request.calcMode is SkaniCalculationMode.QVR:
-        if n_query_genomes_total == 0 or n_ref_genomes_total == 0:
-            raise HttpBadRequest(
-                'No comparisons could be made as either all genomes in the query or reference list are not in the database. Uploaded genomes will need to be uploaded again.'
-            )
-    elif request.calcMode is SkaniCalculationMode.TRIANGLE:
-        if n_query_genomes_total == 0:
-            raise HttpBadRequest(
-                'No comparisons could be made as all genomes in the query list are not in the database. Uploaded genomes will need to be uploaded again.'
-            )
-    else:
-        raise HttpBadRequest(f'Unknown calculation mode.')
-
-    # Create the parameter id, or retrieve it from the database
-    param_id = get_or_set_db_param_id(db, request.version, request.params)
-
-    # Set delete after only if it's a user upload job
-    delete_after = None
-    if len(user_genome_ids) > 0:
-        if upload_metadata is not None:
-            if upload_metadata.deleteAfter is not None:
-                delete_after = upload_metadata.deleteAfter.name
-
-    # Create the job with a unique name
-    job = util_create_new_job(param_id, request, delete_after, db)
+        elif request.calcMode is SkaniCalculationMode.TRIANGLE:
+            if n_query_genomes_total == 0:
+                raise HttpBadRequest(
+                    'No comparisons could be made as all genomes in the query list are not in the database. Uploaded genomes will need to be uploaded again.'
+                )
+        else:
+            raise HttpBadRequest(f'Unknown calculation mode.')
 
-    # Upload the user genomes if they are provided
-    d_file_name_to_genome_id = create_user_genomes(job.id, d_file_content, db)
+        # Create the parameter id, or retrieve it from the database
+        param_id = get_or_set_db_param_id(db, request.version, request.params)
 
-    # Create the query / reference data for NCBI genomes
-    [db.add(DbSkaniJobQuery(job_id=job.id, genome_id=x)) for x in q_genome_ids]
-    [db.add(DbSkaniJobReference(job_id=job.id, genome_id=x)) for x in r_genome_ids]
+        # Set delete after only if it's a user upload job
+        delete_after = None
+        if len(user_genome_ids) > 0:
+            if upload_metadata is not None:
+                if upload_metadata.deleteAfter is not None:
+                    delete_after = upload_metadata.deleteAfter.name
 
-    # Create the query / reference data for user genomes
-    for user_file_name, user_genome_id in d_file_name_to_genome_id.items():
-        if user_file_name in q_genomes:
-            db.add(DbSkaniJobQuery(job_id=job.id, genome_id=user_genome_id))
-        if user_file_name in r_genomes:
-            db.add(DbSkaniJobReference(job_id=job.id, genome_id=user_genome_id))
-    db.commit()
+        # Nothing is committed until every row has been written, so the job can be
+        # created as ready (the workers cannot see it before then)
+        try:
+            # Create the job with a unique name
+            job = util_create_new_job(param_id, request, delete_after, db)
+
+            # Upload the user genomes if they are provided
+            d_file_name_to_genome_id = create_user_genomes(job.id, d_file_content, db)
+
+            # Create the query / reference data for NCBI and user genomes
+            q_genome_ids.update(v for k, v in d_file_name_to_genome_id.items() if k in q_genomes)
+            r_genome_ids.update(v for k, v in d_file_name_to_genome_id.items() if k in r_genomes)
+            insert_job_genomes(DbSkaniJobQuery, job.id, q_genome_ids, db)
+            insert_job_genomes(DbSkaniJobReference, job.id, r_genome_ids, db)
+
+            # The job never enters the queue if every comparison has been made by a previous job,
+            # unless an email was given (the notification is only sent by the worker)
+            if len(d_file_name_to_genome_id) == 0 and not request.email:
+                await run_in_threadpool(
+                    util_complete_job_from_result_store,
+                    job.id, param_id, q_genome_ids, r_genome_ids, request.calcMode, db
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
 
-    # Set the job to ready status
-    db.exec(sm.update(DbSkaniJob).where(DbSkaniJob.id == job.id).values(ready=True))
-    db.commit()
+        # The job references the uploaded genomes, so they can now be added to the store
+        for file_name, tmp_path in d_spooled.items():
+            add_to_content_addressed_store(tmp_path, ANI_USER_GENOME_DIR, d_file_content[file_name][1])
+    finally:
+        for tmp_path in d_spooled.values():
+            tmp_path.unlink(missing_ok=True)
 
     # Done
     return SkaniCreatedJobResponse(
@@ -351,7 +389,6 @@ def get_or_set_db_param_id(db: Session, version: SkaniVersion, params: SkaniPara
             's': params.screen
         }
     result = db.exec(query, params=parameters).first()
-    db.commit()
 
     if result is None or result[0] is None:
         raise HttpInternalServerError("Unable to retrieve or set the skani parameters.")
@@ -359,50 +396,11 @@ def get_or_set_db_param_id(db: Session, version: SkaniVersion, params: SkaniPara
 
 
 def get_job_data_index_page(job_name: str, db_gtdb: Session, db_common: Session):
-    query = (
-        sm.select(
-            DbSkaniJob.id,
-            DbSkaniJob.mode,
-            DbSkaniJob.completed,
-            DbSkaniJob.error,
-            DbSkaniParam.version,
-            DbSkaniParam.min_af,
-            DbSkaniParam.both_min_af,
-            DbSkaniParam.preset,
-            DbSkaniParam.c,
-            DbSkaniParam.faster_small,
-            DbSkaniParam.m,
-            DbSkaniParam.median,
-            DbSkaniParam.no_learned_ani,
-            DbSkaniParam.no_marker_index,
-            DbSkaniParam.robust,
-            DbSkaniParam.s
-        )
-        .join(DbSkaniParam, DbSkaniParam.id == DbSkaniJob.param_id)
-        .where(DbSkaniJob.name == job_name)
-        .where(DbSkaniJob.deleted == False)
-    )
-    job_result = db_common.exec(query).first()
-    if job_result is None:
-        raise HttpNotFound(f'No job with this ID exists.')
-
-    # Create the parameter output
-    params = SkaniParameters(
-        minAf=job_result.min_af,
-        bothMinAf=job_result.both_min_af,
-        skaniPreset=job_result.preset,
-        cFactor=job_result.c,
-        fasterSmall=job_result.faster_small,
-        mFactor=job_result.m,
-        useMedian=job_result.median,
-        noLearnedAni=job_result.no_learned_ani,
-        noMarkerIndex=job_result.no_marker_index,
-        robust=job_result.robust,
-        screen=job_result.s
-    )
+    job = util_get_job_snapshot(job_name, db_common)
+    params = job.params
 
     # Load the genome lists
-    d_genome_lists = util_get_job_query_reference_genomes(job_result.id, db_common)
+    d_genome_lists = job.genomes
 
     # Extract into a useful format
     ncbi_reference_genome_names = set()
@@ -517,110 +515,282 @@ def get_job_data_index_page(job_name: str, db_gtdb: Session, db_common: Session)
     return SkaniJobDataIndexResponse(
         jobId=job_name,
         params=params,
-        mode=job_result.mode,
-        version=job_result.version,
+        mode=job.mode,
+        version=job.version,
         query=query,
         reference=reference
     )
 
 
+# The job, its parameters, genomes (as a JSON array), and results (if completed without error) by name
+JOB_SNAPSHOT_QUERY = sm.text(
+    """
+    SELECT j.id,
+           j.name,
+           j.created,
+           j.completed,
+           j.error,
+           j.mode,
+           j.delete_after_ts,
+           p.version,
+           p.min_af,
+           p.both_min_af,
+           p.preset,
+           p.c,
+           p.faster_small,
+           p.m,
+           p.median,
+           p.no_learned_ani,
+           p.no_marker_index,
+           p.robust,
+           p.s,
+           jg.genomes,
+           r.ani,
+           r.af_qry,
+           r.af_ref
+    FROM skani.job j
+             INNER JOIN skani.param p ON p.id = j.param_id
+             LEFT JOIN skani.job_result r ON r.job_id = j.id AND j.completed IS NOT NULL AND j.error IS NOT TRUE
+             LEFT JOIN LATERAL (
+        SELECT json_agg(json_build_object(
+                'id', g.id,
+                'name', CASE
+                            WHEN g.ncbi_id IS NOT NULL THEN god.name
+                            WHEN g.user_id IS NOT NULL THEN ug.file_name
+                    END,
+                'origin', CASE
+                              WHEN g.ncbi_id IS NOT NULL THEN 'ncbi'
+                              WHEN g.user_id IS NOT NULL THEN 'user'
+                    END,
+                'source', src.source
+                        )) AS genomes
+        FROM (SELECT jq.genome_id, 'query' AS source
+              FROM skani.job_query jq
+              WHERE jq.job_id = j.id
+              UNION ALL
+              SELECT jr.genome_id, 'reference' AS source
+              FROM skani.job_reference jr
+              WHERE jr.job_id = j.id) src
+                 INNER JOIN skani.genome g ON g.id = src.genome_id
+                 LEFT JOIN skani.user_genome ug ON ug.id = g.user_id
+                 LEFT JOIN genomes_on_disk god ON god.id = g.ncbi_id
+        ) jg ON TRUE
+    WHERE j.name = :job_name
+      AND j.deleted = FALSE;
+    """
+).columns(
+    mode=DbSkaniJob.__table__.c.mode.type,
+    version=DbSkaniParam.__table__.c.version.type,
+    preset=DbSkaniParam.__table__.c.preset.type
+)
+
+# Completed jobs never change, so the frontend polling the job endpoints is served from memory
+JOB_SNAPSHOT_CACHE = LruCache(ANI_JOB_SNAPSHOT_CACHE_MAX_ITEMS)
+
+
+def util_get_job_snapshot(job_name: str, db_common: Session) -> UtilSkaniJobSnapshot:
+    """Returns the job, its parameters, genomes, and results from a single query.
+
+    Snapshots of completed jobs are cached until the job is due to be deleted,
+    a cached snapshot is only returned if the job has not since been deleted.
+    """
+    snapshot = JOB_SNAPSHOT_CACHE.get(job_name)
+    if snapshot is not None:
+        if snapshot.delete_after_ts is None or snapshot.delete_after_ts > datetime.now(timezone.utc):
+            deleted = db_common.exec(sm.select(DbSkaniJob.deleted).where(DbSkaniJob.id == snapshot.id)).first()
+            if deleted is False:
+                return snapshot
+        JOB_SNAPSHOT_CACHE.pop(job_name)
+
+    row = db_common.exec(JOB_SNAPSHOT_QUERY, params={'job_name': job_name}).first()
+    if row is None:
+        raise HttpNotFound(f'No job with this ID exists.')
+
+    genomes = row.genomes or list()
+    results = None
+    if row.ani is not None:
+        results = util_job_results_from_arrays(
+            {x['id'] for x in genomes if x['source'] == 'query'},
+            {x['id'] for x in genomes if x['source'] == 'reference'},
+            row.mode, row.ani, row.af_qry, row.af_ref
+        )
+
+    snapshot = UtilSkaniJobSnapshot(
+        id=row.id,
+        name=row.name,
+        created=row.created,
+        completed=row.completed,
+        error=row.error,
+        mode=row.mode,
+        delete_after_ts=row.delete_after_ts,
+        version=row.version,
+        params=SkaniParameters(
+            minAf=row.min_af,
+            bothMinAf=row.both_min_af,
+            skaniPreset=row.preset,
+            cFactor=row.c,
+            fasterSmall=row.faster_small,
+            mFactor=row.m,
+            useMedian=row.median,
+            noLearnedAni=row.no_learned_ani,
+            noMarkerIndex=row.no_marker_index,
+            robust=row.robust,
+            screen=row.s
+        ),
+        genomes=genomes,
+        results=results
+    )
+    if snapshot.completed is not None:
+        JOB_SNAPSHOT_CACHE.set(job_name, snapshot)
+    return snapshot
+
+
+def util_get_job_table(job_id_str: str, db_common: Session) -> tuple[Any, UtilSkaniJobResults | None, dict[int, str]]:
+    """Returns the job, its results, and a mapping of genome id to name. Results are only loaded for completed jobs."""
+    job = util_get_job_snapshot(job_id_str, db_common)
+
+    # If the job is not complete or in an error state, there are no results
+    if job.completed is None or job.error is True:
+        return job, None, dict()
+
+    # Otherwise, get the genome ids and names
+    if len(job.genomes) == 0:
+        raise HttpInternalServerError('The job has no genomes assigned to it. Please report this issue.')
+    if job.results is None:
+        raise HttpInternalServerError('The job has no results. Please report this issue.')
+    d_genome_id_to_name = {x['id']: x['name'] for x in job.genomes}
+    return job, job.results, d_genome_id_to_name
+
+
+def util_job_table_arrays(
+        job_results: UtilSkaniJobResults,
+        d_genome_id_to_name: dict[int, str],
+        get_nulls: bool,
+        get_self: bool
+) -> dict[str, np.ndarray]:
+    """Returns the query, reference, ani, af_query, and af_reference columns for each pair in the job.
+
+    Pairs are in row-major (query, then reference) order.
+    """
+    ani = np.round(job_results.ani, 2)
+    af_qry = np.round(job_results.af_qry, 2)
+    af_ref = np.round(job_results.af_ref, 2)
+    qry_ids = np.asarray(job_results.qry_ids)
+    ref_ids = np.asarray(job_results.ref_ids)
+
+    # Skip self matches if the user doesn't want them, and distant values if the user doesn't want them
+    mask = np.ones(ani.shape, dtype=bool)
+    if not get_self:
+        mask &= qry_ids[:, np.newaxis] != ref_ids[np.newaxis, :]
+    if not get_nulls:
+        mask &= (ani != 0) | (af_ref != 0) | (af_qry != 0)
+    qry_idx, ref_idx = np.nonzero(mask)
+
+    qry_names = np.array([d_genome_id_to_name[x] for x in job_results.qry_ids], dtype=object)
+    ref_names = np.array([d_genome_id_to_name[x] for x in job_results.ref_ids], dtype=object)
+    return {
+        'qry': qry_names[qry_idx],
+        'ref': ref_names[ref_idx],
+        'ani': ani[qry_idx, ref_idx],
+        'afQry': af_qry[qry_idx, ref_idx],
+        'afRef': af_ref[qry_idx, ref_idx],
+    }
+
+
+def util_job_table_columns(
+        job_results: UtilSkaniJobResults,
+        d_genome_id_to_name: dict[int, str],
+        get_nulls: bool,
+        get_self: bool
+) -> dict[str, list]:
+    """Returns the columns from util_job_table_arrays as lists."""
+    arrays = util_job_table_arrays(job_results, d_genome_id_to_name, get_nulls, get_self)
+    return {k: v.tolist() for k, v in arrays.items()}
+
+
+def iter_job_table_rows(
+        job_results: UtilSkaniJobResults,
+        d_genome_id_to_name: dict[int, str],
+        get_nulls: bool,
+        get_self: bool
+) -> Iterator[tuple[str, str, float, float, float]]:
+    """Yields (query, reference, ani, af_query, af_reference) for each pair in the job."""
+    columns = util_job_table_columns(job_results, d_genome_id_to_name, get_nulls, get_self)
+    yield from zip(columns['qry'], columns['ref'], columns['ani'], columns['afQry'], columns['afRef'])
+
+
 def get_job_data_table_page(
         job_id_str: str,
         get_nulls: bool,
         get_self: bool,
-        db_common: Session
-) -> SkaniJobDataTableResponse:
-    query = (
-        sm.select(
-            DbSkaniJob.id,
-            DbSkaniJob.created,
-            DbSkaniJob.param_id,
-            DbSkaniJob.completed,
-            DbSkaniJob.error,
-            DbSkaniJob.mode,
-        )
-        .where(DbSkaniJob.name == job_id_str)
-        .where(DbSkaniJob.deleted == False)
-    )
-    result = db_common.exec(query).first()
-    if result is None:
-        raise HttpNotFound(f'No job with this ID exists.')
+        db_common: Session,
+        columnar: bool = False
+) -> dict:
+    """Returns the SkaniJobDataTableResponse payload.
+
+    This is a dict rather than a model, as validating a model for each of the
+    (up to ANI_MAX_PAIRWISE) rows dominates the response time.
+    """
+    result, job_results, d_genome_id_to_name = util_get_job_table(job_id_str, db_common)
 
     # If the job is not complete or in an error state, do not return any results
     if result.completed is None:
-        return SkaniJobDataTableResponse(
-            jobId=job_id_str,
-            completed=False,
-            error=result.error,
-            rows=list()
-        )
+        return {'jobId': job_id_str, 'completed': False, 'error': result.error, 'rows': list()}
     if result.error is True:
-        return SkaniJobDataTableResponse(
-            jobId=job_id_str,
-            completed=True,
-            error=result.error,
-            rows=list()
+        return {'jobId': job_id_str, 'completed': True, 'error': result.error, 'rows': list()}
+
+    columns = util_job_table_columns(job_results, d_genome_id_to_name, get_nulls, get_self)
+    if columnar:
+        return {'jobId': job_id_str, 'completed': True, 'error': result.error, 'rows': list(), 'columns': columns}
+
+    rows = [
+        {'qry': qry, 'ref': ref, 'ani': ani, 'afQry': af_qry, 'afRef': af_ref}
+        for qry, ref, ani, af_qry, af_ref in zip(
+            columns['qry'], columns['ref'], columns['ani'], columns['afQry'], columns['afRef']
         )
+    ]
+    return {'jobId': job_id_str, 'completed': True, 'error': result.error, 'rows': rows}
 
-    # Otherwise, get the genome ids and names
-    qvr_list = util_get_job_query_reference_genomes(result.id, db_common)
-    if len(qvr_list) == 0:
-        raise HttpInternalServerError('The job has no genomes assigned to it. Please report this issue.')
 
-    # Extract the genome ids
-    query_genome_ids, reference_genome_ids = set(), set()
-    d_genome_id_to_name = dict()
-    for info in qvr_list:
-        d_genome_id_to_name[info['id']] = info['name']
-        if info['source'] == 'query':
-            query_genome_ids.add(info['id'])
-        elif info['source'] == 'reference':
-            reference_genome_ids.add(info['id'])
-    query_genome_ids, reference_genome_ids = list(query_genome_ids), list(reference_genome_ids)
-
-    # Get the results from the database
-    job_results = util_get_job_results(
-        result.id, query_genome_ids, reference_genome_ids, result.mode, db_common
-    )
+def get_job_data_table_npz(
+        job_id_str: str,
+        get_nulls: bool,
+        get_self: bool,
+        db_common: Session
+) -> tuple[bool, bytes]:
+    """Returns if the job is completed, and the table as an .npz archive.
 
-    # Iterate over each pair
-    out_rows = list()
-    for qry_idx, qry_gid in enumerate(job_results.qry_ids):
-        qry_name = d_genome_id_to_name[qry_gid]
-        for ref_idx, ref_gid in enumerate(job_results.ref_ids):
-            ref_name = d_genome_id_to_name[ref_gid]
-
-            # Skip self matches if the user doesn't want them
-            if not get_self and qry_gid == ref_gid:
-                continue
-
-            # Collect the values
-            cur_ani = round(float(job_results.ani[qry_idx, ref_idx]), 2)
-            cur_af_ref = round(float(job_results.af_ref[qry_idx, ref_idx]), 2)
-            cur_af_qry = round(float(job_results.af_qry[qry_idx, ref_idx]), 2)
-
-            # Skip if the user doesn't want distant values
-            if cur_ani == 0 and cur_af_ref == 0 and cur_af_qry == 0 and not get_nulls:
-                continue
-
-            # Otherwise, save the row
-            out_rows.append(
-                SkaniResultTableRow(
-                    qry=qry_name,
-                    ref=ref_name,
-                    ani=cur_ani,
-                    afRef=cur_af_ref,
-                    afQry=cur_af_qry,
-                )
-            )
+    The ani, afQry, and afRef columns are int16 (i.e. multiplied by 100).
+    """
+    result, job_results, d_genome_id_to_name = util_get_job_table(job_id_str, db_common)
+    completed = result.completed is not None
+    data = dict(jobId=job_id_str, completed=completed, error=result.error is True)
+    if completed and result.error is not True:
+        arrays = util_job_table_arrays(job_results, d_genome_id_to_name, get_nulls, get_self)
+    else:
+        arrays = dict(qry=list(), ref=list(), ani=np.zeros(0), afQry=np.zeros(0), afRef=np.zeros(0))
+    data['qry'] = arrays['qry']
+    data['ref'] = arrays['ref']
+    data['ani'] = scale_to_int16(arrays['ani'])
+    data['afQry'] = scale_to_int16(arrays['afQry'])
+    data['afRef'] = scale_to_int16(arrays['afRef'])
+    return completed, arrays_to_npz(data)
 
-    # Return the payload
-    return SkaniJobDataTableResponse(
-        jobId=job_id_str,
-        completed=True,
-        error=result.error,
-        rows=out_rows
+
+# The queue is shared by every status poll in this process for a short time
+QUEUED_JOBS = ExpiringValue(ANI_QUEUE_POSITION_CACHE_SECONDS)
+
+
+def util_get_queued_jobs(db_common: Session) -> list[tuple[datetime, int]]:
+    """Returns the (created, id) of every queued job, in the order they will be processed."""
+    query = (
+        sm.select(DbSkaniJob.created, DbSkaniJob.id)
+        .where(DbSkaniJob.completed == None)
+        .where(DbSkaniJob.deleted == False)
+        .where(DbSkaniJob.ready == True)
+        .order_by(DbSkaniJob.created, DbSkaniJob.id)
     )
+    return [(row.created, row.id) for row in db_common.exec(query).all()]
 
 
 def get_job_id_status(job_id_str: str, db_common: Session) -> SkaniJobStatusResponse:
@@ -644,22 +814,9 @@ def get_job_id_status(job_id_str: str, db_common: Session) -> SkaniJobStatusResp
     # If the job hasn't completed, get the queue position
     pos_in_queue, pending_jobs = None, None
     if result.completed is None:
-        subquery = (
-            sm.select(
-                DbSkaniJob.id,
-                sm.func.row_number().over(order_by=DbSkaniJob.created).label('position'),
-                sm.func.count().over().label('total')
-            )
-            .where(DbSkaniJob.completed == None)
-            .where(DbSkaniJob.deleted == False)
-            .where(DbSkaniJob.ready == True)
-            .subquery('queued')
-        )
-        stmt = sm.select(subquery.c.id, subquery.c.position, subquery.c.total).where(subquery.c.id == result.id)
-        row = db_common.exec(stmt).first()
-
-        pos_in_queue = row.position
-        pending_jobs = row.total
+        queue = QUEUED_JOBS.get(lambda: util_get_queued_jobs(db_common))
+        pos_in_queue = bisect.bisect_left(queue, (result.created, result.id)) + 1
+        pending_jobs = max(len(queue), pos_in_queue)
 
     return SkaniJobStatusResponse(
         jobId=job_id_str,
@@ -694,7 +851,6 @@ def get_genome_ids_from_ncbi_names(names: Collection[str], db: Session) -> dict[
     )
     try:
         db.exec(insert_stmt)
-        db.commit()
     except Exception as e:
         db.rollback()
         raise HttpInternalServerError('There was an error mapping NCBI ids, please report this issue.')
@@ -713,55 +869,63 @@ def get_genome_ids_from_ncbi_names(names: Collection[str], db: Session) -> dict[
     return {row.name: row.id for row in results}
 
 
-def create_user_genomes(job_id: int, d_file_content: dict[str, tuple[str, str]], db: Session) -> dict[str, int]:
+def int_array_param(name: str, values: Collection[int]):
+    """Bind a collection of integers as a single array parameter (e.g. to be unnested)."""
+    return sm.bindparam(name, value=list(values), type_=postgresql.ARRAY(sm.Integer))
+
+
+def create_user_genomes(job_id: int, d_file_content: dict[str, tuple[str | None, str]], db: Session) -> dict[str, int]:
+    """Insert the uploaded genomes and their genome records, returning a mapping of file name to genome ID.
+
+    The content is the FASTA file, or None if it is in ANI_USER_GENOME_DIR, and its sha256 hash.
+    """
     if len(d_file_content) == 0:
         return dict()
 
-    # Create the rows in the user_genome table
+    # Create the rows in the user_genome table, the sha256 column is only required
+    # once genomes are stored on disk (scripts/skani/update_user_genome_sha256.py)
     rows = list()
-    for cur_file_name, cur_file_content in d_file_content.items():
-        rows.append(
-            DbSkaniUserGenome(
-                job_id=job_id,
-                file_name=cur_file_name,
-                fna=cur_file_content,
-            )
-        )
-    [db.add(x) for x in rows]
-    db.commit()
-
-    user_ids = [x.id for x in rows]
+    for file_name, (fna, sha256_hex) in d_file_content.items():
+        row = {'job_id': job_id, 'file_name': file_name, 'fna': fna}
+        if ANI_USER_GENOME_DIR:
+            row['sha256'] = sha256_hex
+        rows.append(row)
+    insert_user_stmt = (
+        sm.insert(DbSkaniUserGenome)
+        .values(rows)
+        .returning(DbSkaniUserGenome.id, DbSkaniUserGenome.file_name)
+    )
+    d_user_id_to_file_name = {row.id: row.file_name for row in db.exec(insert_user_stmt).all()}
 
     # Create a genome record for those genomes
-    insert_stmt = (
+    insert_genome_stmt = (
         sm.insert(DbSkaniGenome)
         .from_select(
             names=[DbSkaniGenome.user_id],
-            select=sm.select(DbSkaniUserGenome.id)
-            .select_from(DbSkaniUserGenome)
-            .outerjoin(DbSkaniGenome, DbSkaniGenome.user_id == DbSkaniUserGenome.id)
-            .where(DbSkaniUserGenome.id.in_(user_ids))
-            .where(DbSkaniGenome.user_id == None)
+            select=sm.select(sm.func.unnest(int_array_param('user_ids', d_user_id_to_file_name.keys())))
         )
+        .returning(DbSkaniGenome.id, DbSkaniGenome.user_id)
     )
-    db.exec(insert_stmt)
-    db.commit()
+    return {d_user_id_to_file_name[row.user_id]: row.id for row in db.exec(insert_genome_stmt).all()}
 
-    # Query mapping to genome ID
-    return_stmt = (
-        sm.select(
-            DbSkaniGenome.id,
-            DbSkaniUserGenome.file_name,
+
+def insert_job_genomes(table: type[DbSkaniJobQuery] | type[DbSkaniJobReference], job_id: int,
+                       genome_ids: Collection[int], db: Session):
+    """Insert the query or reference genomes of a job in a single statement."""
+    if len(genome_ids) == 0:
+        return
+    stmt = (
+        sm.insert(table)
+        .from_select(
+            names=[table.job_id, table.genome_id],
+            select=sm.select(sm.literal(job_id, sm.Integer), sm.func.unnest(int_array_param('genome_ids', genome_ids)))
         )
-        .select_from(DbSkaniGenome)
-        .join(DbSkaniUserGenome, DbSkaniUserGenome.id == DbSkaniGenome.user_id)
-        .where(DbSkaniUserGenome.id.in_(user_ids))
     )
-    results = db.exec(return_stmt).all()
-    return {row.file_name: row.id for row in results}
+    db.exec(stmt)
 
 
-def util_create_new_job(param_id: int, request, delete_after, db: Session, retries: int = 3) -> DbSkaniJob:
+def util_create_new_job(param_id: int, request, delete_after, db: Session, retries: int = 3):
+    """Create the job record, returning its id and name. The job is not visible until the transaction is committed."""
     # Create the job record (with retries in case of job id collision)
     for _ in range(retries):
 
@@ -769,22 +933,24 @@ def util_create_new_job(param_id: int, request, delete_after, db: Session, retri
         new_job_id = generate_random_job_name()
 
         try:
-            # Create the job record
-            job = DbSkaniJob(
-                name=new_job_id,
-                param_id=param_id,
-                email=request.email,
-                delete_after=delete_after,
-                mode=request.calcMode.name,
-                ready=False
-            )
-            db.add(job)
-            db.commit()
-            return job
+            # Create the job record, a collision only rolls back to the savepoint
+            with db.begin_nested():
+                stmt = (
+                    sm.insert(DbSkaniJob)
+                    .values(
+                        name=new_job_id,
+                        param_id=param_id,
+                        email=request.email,
+                        delete_after=delete_after,
+                        mode=request.calcMode.name,
+                        ready=True
+                    )
+                    .returning(DbSkaniJob.id, DbSkaniJob.name)
+                )
+                return db.exec(stmt).one()
 
         # Unlikely, but try again if this happens
         except IntegrityError:
-            db.rollback()
             continue
 
         # Unrecoverable error, stop
@@ -796,6 +962,63 @@ def util_create_new_job(param_id: int, request, delete_after, db: Session, retri
     raise HttpInternalServerError('There was an error creating the job. Please report this issue.')
 
 
+def util_complete_job_from_result_store(
+        job_id: int,
+        param_id: int,
+        qry_ids: Collection[int],
+        ref_ids: Collection[int],
+        mode: SkaniCalculationMode,
+        db: Session
+) -> bool:
+    """Complete the job from the pairwise result store (skani.result), returns False if any pair is missing.
+
+    The store is populated from completed jobs by scripts/skani/update_result_store.py.
+    """
+    qry_ids_sorted = sorted(qry_ids)
+    ref_ids_sorted = qry_ids_sorted if mode is SkaniCalculationMode.TRIANGLE else sorted(ref_ids)
+    n_pairs = len(qry_ids_sorted) * len(ref_ids_sorted)
+    if n_pairs == 0:
+        return False
+
+    # Check that every pair is present before loading them
+    where = (
+        (DbSkaniResult.param_id == param_id),
+        (DbSkaniResult.qry_id == sm.any_(int_array_param('qry_ids', qry_ids_sorted))),
+        (DbSkaniResult.ref_id == sm.any_(int_array_param('ref_ids', ref_ids_sorted))),
+    )
+    n_known = db.exec(sm.select(sm.func.count()).select_from(DbSkaniResult).where(*where)).one()
+    if n_known < n_pairs:
+        return False
+
+    # Lay out the results as they are stored for a job (see util_job_results_from_arrays)
+    rows = db.exec(
+        sm.select(DbSkaniResult.qry_id, DbSkaniResult.ref_id, DbSkaniResult.ani, DbSkaniResult.af_qry,
+                  DbSkaniResult.af_ref).where(*where)
+    ).all()
+    d_qry_index = {x: i for i, x in enumerate(qry_ids_sorted)}
+    d_ref_index = {x: i for i, x in enumerate(ref_ids_sorted)}
+    idx = np.fromiter((d_qry_index[r.qry_id] * len(ref_ids_sorted) + d_ref_index[r.ref_id] for r in rows),
+                      dtype=np.int64, count=len(rows))
+    filled = np.zeros(n_pairs, dtype=bool)
+    filled[idx] = True
+    if not filled.all():
+        return False
+
+    arrays = dict()
+    for key in ('ani', 'af_qry', 'af_ref'):
+        arr = np.zeros(n_pairs, dtype=np.int16)
+        arr[idx] = scale_to_int16([getattr(r, key) or 0 for r in rows])
+        arrays[key] = arr.tolist()
+
+    db.exec(sm.insert(DbSkaniJobResult).values(job_id=job_id, **arrays))
+    db.exec(
+        sm.update(DbSkaniJob)
+        .where(DbSkaniJob.id == job_id)
+        .values(completed=sm.func.now(), error=False, stdout='Loaded from the results of previous jobs.')
+    )
+    return True
+
+
 def util_get_job_query_reference_genomes(job_id: int, db: Session):
     query = sm.text(
         """
@@ -855,12 +1078,7 @@ def util_get_job_results(
         mode: SkaniCalculationMode,
         db: Session
 ) -> UtilSkaniJobResults:
-    """
-    Get the result rows for the given query and reference genome IDs.
-    - ANI and AF values are saved as smallints and need to be divided by 100 to get the real value.
-    - The query -> reference values are stored in a flat array, so need to be reshaped.
-    - The reference -> query values are not stored, but can be extracted (i.e. not symmetric!)
-    """
+    """Get the result rows for the given query and reference genome IDs (see util_job_results_from_arrays)."""
     query = (
         sm.select(
             DbSkaniJobResult.ani,
@@ -870,7 +1088,25 @@ def util_get_job_results(
         .where(DbSkaniJobResult.job_id == job_id)
     )
     result_row = db.exec(query).first()
+    return util_job_results_from_arrays(
+        qry_ids, ref_ids, mode, result_row.ani, result_row.af_qry, result_row.af_ref
+    )
 
+
+def util_job_results_from_arrays(
+        qry_ids: Collection[int],
+        ref_ids: Collection[int],
+        mode: SkaniCalculationMode,
+        ani: list[int],
+        af_qry: list[int],
+        af_ref: list[int]
+) -> UtilSkaniJobResults:
+    """
+    Convert the result arrays of a job into matrices.
+    - ANI and AF values are saved as smallints and need to be divided by 100 to get the real value.
+    - The query -> reference values are stored in a flat array, so need to be reshaped.
+    - The reference -> query values are not stored, but can be extracted (i.e. not symmetric!)
+    """
     # Transform the ids into the rows and columns
     qry_gids_sorted = sorted(qry_ids)
     ref_gids_sorted = sorted(ref_ids)
@@ -878,9 +1114,9 @@ def util_get_job_results(
         ref_gids_sorted = qry_gids_sorted
 
     shape = (len(qry_gids_sorted), len(ref_gids_sorted))
-    arr_ani = np.array(result_row.ani).reshape(shape) / 100
-    arr_af_qry = np.array(result_row.af_qry).reshape(shape) / 100
-    arr_af_ref = np.array(result_row.af_ref).reshape(shape) / 100
+    arr_ani = np.array(ani).reshape(shape) / 100
+    arr_af_qry = np.array(af_qry).reshape(shape) / 100
+    arr_af_ref = np.array(af_ref).reshape(shape) / 100
 
     return UtilSkaniJobResults(
         qry_ids=qry_gids_sorted,
@@ -891,52 +1127,120 @@ def util_get_job_results(
     )
 
 
-def skani_get_heatmap(
+def util_merge_job_results(job_results: UtilSkaniJobResults) -> tuple[np.ndarray, np.ndarray]:
+    """Merge the query -> reference results into a single ANI and AF matrix (query rows, reference columns).
+
+    Where both genomes of a pair are in the query and reference sets, the pair
+    appears twice: the AF of the query is used for one, and the AF of the
+    reference is used for the mirrored pair. When both are present, the mirrored
+    value is used if it comes at or after the pair (in row-major order). Otherwise,
+    the larger of the two AF values is used.
+    """
+    qry_ids = np.asarray(job_results.qry_ids)
+    ref_ids = np.asarray(job_results.ref_ids)
+    n_qry, n_ref = len(qry_ids), len(ref_ids)
+
+    # The index of each query genome in the references (and vice-versa), or -1 if absent
+    d_gid_to_ref_index = {x: idx for idx, x in enumerate(job_results.ref_ids)}
+    d_gid_to_qry_index = {x: idx for idx, x in enumerate(job_results.qry_ids)}
+    qry_in_ref = np.fromiter((d_gid_to_ref_index.get(x, -1) for x in job_results.qry_ids), dtype=np.int64, count=n_qry)
+    ref_in_qry = np.fromiter((d_gid_to_qry_index.get(x, -1) for x in job_results.ref_ids), dtype=np.int64, count=n_ref)
+
+    # The position of the mirrored pair for each pair, and if it exists
+    mirror_row = np.broadcast_to(ref_in_qry[np.newaxis, :], (n_qry, n_ref))
+    mirror_col = np.broadcast_to(qry_in_ref[:, np.newaxis], (n_qry, n_ref))
+    is_symmetric = (mirror_row >= 0) & (mirror_col >= 0)
+
+    rows = np.arange(n_qry)[:, np.newaxis]
+    cols = np.arange(n_ref)[np.newaxis, :]
+    use_mirror = is_symmetric & ((mirror_row > rows) | ((mirror_row == rows) & (mirror_col >= cols)))
+
+    mirror_row, mirror_col = np.maximum(mirror_row, 0), np.maximum(mirror_col, 0)
+    arr_ani = np.where(use_mirror, job_results.ani[mirror_row, mirror_col], job_results.ani)
+    arr_af = np.where(
+        use_mirror,
+        job_results.af_ref[mirror_row, mirror_col],
+        np.where(is_symmetric, job_results.af_qry, np.maximum(job_results.af_qry, job_results.af_ref))
+    )
+    return arr_ani.astype(float), arr_af.astype(float)
+
+
+# Whether skani.job_result_leaves exists, only a positive result is kept (the table may be created later)
+HEATMAP_LEAVES_TABLE_EXISTS = False
+
+
+def util_heatmap_leaves_table_exists(db_common: Session) -> bool:
+    """True if the leaf order can be stored (see scripts/skani/update_job_result_leaves.py)."""
+    global HEATMAP_LEAVES_TABLE_EXISTS
+    if not HEATMAP_LEAVES_TABLE_EXISTS:
+        query = sm.text("SELECT to_regclass('skani.job_result_leaves') IS NOT NULL;")
+        HEATMAP_LEAVES_TABLE_EXISTS = bool(db_common.exec(query).scalar())
+    return HEATMAP_LEAVES_TABLE_EXISTS
+
+
+def util_get_heatmap_leaves(
+        job_id: int,
+        cluster_by: str,
+        arr: np.ndarray,
+        symmetric: bool,
+        db_common: Session
+) -> tuple[list[int], list[int]]:
+    """Returns the dendrogram leaf order of the columns (x) and rows (y) of the matrix.
+
+    The results of a completed job never change, so the order is computed on the
+    first request and stored in skani.job_result_leaves for all later requests
+    that use the same clustering method (CLUSTER_LEAVES_METHOD).
+    """
+    table_exists = util_heatmap_leaves_table_exists(db_common)
+    if table_exists:
+        query = (
+            sm.select(DbSkaniJobResultLeaves.x_leaves, DbSkaniJobResultLeaves.y_leaves)
+            .where(DbSkaniJobResultLeaves.job_id == job_id)
+            .where(DbSkaniJobResultLeaves.cluster_by == cluster_by)
+            .where(DbSkaniJobResultLeaves.method == CLUSTER_LEAVES_METHOD)
+        )
+        row = db_common.exec(query).first()
+        if row is not None:
+            return list(row.x_leaves), list(row.y_leaves)
+
+    try:
+        x_leaves, y_leaves = cluster_leaves(arr, symmetric=symmetric)
+    except ValueError:
+        # This can happen if there are empty values in the matrix, keep the original order
+        print('sparse matrix')
+        x_leaves, y_leaves = list(range(arr.shape[1])), list(range(arr.shape[0]))
+
+    # Concurrent requests may have already stored the same order
+    if table_exists:
+        stmt = insert(DbSkaniJobResultLeaves).values(
+            job_id=job_id, cluster_by=cluster_by, method=CLUSTER_LEAVES_METHOD, x_leaves=x_leaves, y_leaves=y_leaves
+        ).on_conflict_do_nothing()
+        try:
+            db_common.exec(stmt)
+            db_common.commit()
+        except IntegrityError:
+            db_common.rollback()
+    return x_leaves, y_leaves
+
+
+def util_get_heatmap_arrays(
         job_name: str,
         cluster_by: str,
         db_gtdb: Session,
         db_common: Session
-) -> SkaniJobDataHeatmapResponse:
+) -> dict[str, Any]:
+    """Returns the heatmap for a job, with the ANI and AF matrices as arrays (re-ordered by the clustering)."""
     # method = af or ani
-    query = (
-        sm.select(
-            DbSkaniJob.id,
-            DbSkaniJob.created,
-            DbSkaniJob.param_id,
-            DbSkaniJob.completed,
-            DbSkaniJob.error,
-            DbSkaniJob.mode,
-        )
-        .where(DbSkaniJob.name == job_name)
-        .where(DbSkaniJob.deleted == False)
-    )
-    job = db_common.exec(query).first()
-    if job is None:
-        raise HttpNotFound(f'No job with this ID exists.')
+    job = util_get_job_snapshot(job_name, db_common)
 
     # Exit early if the job isn't completed
-    if job.completed is None:
-        return SkaniJobDataHeatmapResponse(
-            jobId=job_name,
-            completed=False,
-            error=False,
-            ani=list(),
-            af=list(),
-            xLabels=list(),
-            yLabels=list(),
-            xSpecies=list(),
-            ySpecies=list(),
-            method='ani',
-            spReps=list()
-        )
-
-    if job.error is True:
-        return SkaniJobDataHeatmapResponse(
+    if job.completed is None or job.error is True:
+        return dict(
             jobId=job_name,
             completed=False,
-            error=True,
-            ani=list(),
-            af=list(),
+            error=job.error is True,
+            ani=np.zeros((0, 0)),
+            af=np.zeros((0, 0)),
             xLabels=list(),
             yLabels=list(),
             xSpecies=list(),
@@ -946,15 +1250,8 @@ def skani_get_heatmap(
         )
 
     # Get the genomes for this job
-    genome_list = util_get_job_query_reference_genomes(job.id, db_common)
-    query_list, reference_list = list(), list()
-    genome_id_to_name = dict()
-    for g in genome_list:
-        if g['source'] == 'query':
-            query_list.append(g['id'])
-        elif g['source'] == 'reference':
-            reference_list.append(g['id'])
-        genome_id_to_name[g['id']] = g['name']
+    genome_list = job.genomes
+    genome_id_to_name = {g['id']: g['name'] for g in genome_list}
 
     # Get the taxonomy of any genomes that may be within the GTDB
     canonical_ncbi_names = {canonical_gid(x['name']) for x in genome_list if x['origin'] == 'ncbi'}
@@ -971,106 +1268,29 @@ def skani_get_heatmap(
             gid_is_sp_rep.add(cur_gid)
 
     # Get the results for this job
-    job_results = util_get_job_results(
-        job.id, qry_ids=query_list, ref_ids=reference_list, mode=job.mode, db=db_common
-    )
-
-    # Map the genome ids to the index in the original matrix
-    d_gid_to_ref_index = {x: idx for idx, x in enumerate(job_results.ref_ids)}
-    d_gid_to_qry_index = {x: idx for idx, x in enumerate(job_results.qry_ids)}
+    job_results = job.results
+    if job_results is None:
+        raise HttpInternalServerError('The job has no results. Please report this issue.')
 
     # Restructure the matrix into a symmetrical matrix
-    shape = (len(job_results.qry_ids), len(job_results.ref_ids))
-    arr_ani = np.zeros(shape=shape, dtype=float)
-    arr_af = np.zeros(shape=shape, dtype=float)
-
-    # Iterate over each pair
-    for qry_idx, qry_gid in enumerate(job_results.qry_ids):
-        for ref_idx, ref_gid in enumerate(job_results.ref_ids):
-
-            # A non-symmetric matrix means we need to use the max AF
-            is_symmetric = qry_gid in d_gid_to_ref_index and ref_gid in d_gid_to_qry_index
-
-            # Collect the values
-            ani = job_results.ani[qry_idx, ref_idx]
-            af_qry = job_results.af_qry[qry_idx, ref_idx]
-            af_ref = job_results.af_ref[qry_idx, ref_idx]
-
-            # Store the values
-            arr_ani[qry_idx, ref_idx] = ani
-
-            # Store the values
-            if is_symmetric:
-                arr_af[qry_idx, ref_idx] = af_qry
-
-                # Load the reverse
-                ref_idx_rev = d_gid_to_ref_index[qry_gid]
-                qry_idx_rev = d_gid_to_qry_index[ref_gid]
-                arr_ani[qry_idx_rev, ref_idx_rev] = ani
-                arr_af[qry_idx_rev, ref_idx_rev] = af_ref
-            else:
-                arr_af[qry_idx, ref_idx] = max(af_qry, af_ref)
+    arr_ani, arr_af = util_merge_job_results(job_results)
 
-    # Cluster the matrix depending on the clustering method
-    try:
-        if cluster_by == 'af':
-            matrix, dendro_x, dendro_y = cluster_matrix(arr_af)
-        else:
-            matrix, dendro_x, dendro_y = cluster_matrix(arr_ani)
-
-        # Create the output and re-order according to the clustering
-        x_labels, y_labels = list(), list()
-        x_gids, y_gids = list(), list()
-        for x in dendro_x['leaves']:
-            x_gids.append(job_results.ref_ids[x])
-            x_labels.append(genome_id_to_name[job_results.ref_ids[x]])
-        for y in dendro_y['leaves']:
-            y_gids.append(job_results.qry_ids[y])
-            y_labels.append(genome_id_to_name[job_results.qry_ids[y]])
-        x_species = [gid_to_species.get(x, 'n/a') for x in x_labels]
-        y_species = [gid_to_species.get(x, 'n/a') for x in y_labels]
-
-        # Re-format the clustered matrix into the output
-        out_ani, out_af = list(), list()
-        for y_idx, (y_label, y_gid) in enumerate(zip(y_labels, y_gids)):
-            qry_idx_original = d_gid_to_qry_index[y_gid]
-            cur_ani_row, cur_af_row = list(), list()
-            for x_idx, (x_label, x_gid) in enumerate(zip(x_labels, x_gids)):
-                ref_idx_original = d_gid_to_ref_index[x_gid]
-                if cluster_by == 'af':
-                    ani = round(float(arr_ani[qry_idx_original, ref_idx_original]), 2)  # remove np floating decimals
-                    af = round(float(matrix[y_idx, x_idx]), 2)
-                else:
-                    ani = round(float(matrix[y_idx, x_idx]), 2)
-                    af = round(float(arr_af[qry_idx_original, ref_idx_original]), 2)
-                cur_ani_row.append(ani)
-                cur_af_row.append(af)
-            out_ani.append(cur_ani_row)
-            out_af.append(cur_af_row)
-
-    except ValueError:
-        # This can happen if there are empty values in the matrix
-        print('sparse matrix')
-
-        x_labels, y_labels = list(), list()
-        x_species, y_species = list(), list()
-        for qry_idx, qry_id in enumerate(job_results.qry_ids):
-            qry_name = genome_id_to_name[qry_id]
-            y_labels.append(qry_name)
-            y_species.append(gid_to_species.get(qry_name, 'n/a'))
-        for ref_idx, ref_id in enumerate(job_results.ref_ids):
-            ref_name = genome_id_to_name[ref_id]
-            x_labels.append(ref_name)
-            x_species.append(gid_to_species.get(ref_name, 'n/a'))
-
-        out_ani, out_af = list(), list()
-        for y_idx in range(len(job_results.qry_ids)):
-            out_ani.append([round(float(x), 2) for x in arr_ani[y_idx, :]])
-            out_af.append([round(float(x), 2) for x in arr_af[y_idx, :]])
-
-    return SkaniJobDataHeatmapResponse(
+    # Re-order the matrices by the clustering (the leaf order is only computed once per job)
+    x_leaves, y_leaves = util_get_heatmap_leaves(
+        job.id, cluster_by, arr_af if cluster_by == 'af' else arr_ani,
+        symmetric=job_results.qry_ids == job_results.ref_ids, db_common=db_common
+    )
+    x_labels = [genome_id_to_name[job_results.ref_ids[x]] for x in x_leaves]
+    y_labels = [genome_id_to_name[job_results.qry_ids[y]] for y in y_leaves]
+    x_species = [gid_to_species.get(x, 'n/a') for x in x_labels]
+    y_species = [gid_to_species.get(x, 'n/a') for x in y_labels]
+    out_ani = arr_ani[np.ix_(y_leaves, x_leaves)]
+    out_af = arr_af[np.ix_(y_leaves, x_leaves)]
+
+    return dict(
         jobId=job_name,
-        completed=job.completed is not None,
+        completed=True,
+        error=False,
         ani=out_ani,
         af=out_af,
         xLabels=x_labels,
@@ -1082,6 +1302,36 @@ def skani_get_heatmap(
     )
 
 
+def skani_get_heatmap(
+        job_name: str,
+        cluster_by: str,
+        db_gtdb: Session,
+        db_common: Session
+) -> SkaniJobDataHeatmapResponse:
+    data = util_get_heatmap_arrays(job_name, cluster_by, db_gtdb, db_common)
+
+    # Rounding removes np floating decimals
+    data['ani'] = np.round(data['ani'], 2).tolist()
+    data['af'] = np.round(data['af'], 2).tolist()
+    return SkaniJobDataHeatmapResponse(**data)
+
+
+def skani_get_heatmap_npz(
+        job_name: str,
+        cluster_by: str,
+        db_gtdb: Session,
+        db_common: Session
+) -> tuple[bool, bytes]:
+    """Returns if the job is completed, and the heatmap as an .npz archive.
+
+    The ANI and AF matrices are int16 (i.e. multiplied by 100).
+    """
+    data = util_get_heatmap_arrays(job_name, cluster_by, db_gtdb, db_common)
+    data['ani'] = scale_to_int16(data['ani'])
+    data['af'] = scale_to_int16(data['af'])
+    return data['completed'], arrays_to_npz(data)
+
+
 def get_taxonomy_for_canonical_genome_names(names: Collection[str], db_gtdb: Session) -> dict[str, str]:
     if not names:
         return dict()
@@ -3,7 +3,10 @@ from time import time
 import sqlmodel as sm
 from sqlmodel import Session
 
-from api.model.status import StatusDbResponse
+from api.controller.taxon import get_taxon_history_index, get_taxon_search_index, get_taxon_tree_index
+from api.model.status import StatusDbResponse, StatusAnalyticsResponse, StatusCacheResponse, StatusIndexesResponse
+from api.util.analytics import analytics
+from api.util.cache import CACHE_STATS, MEMORY_CACHE, SINGLE_FLIGHT
 
 
 def get_status(db: Session) -> StatusDbResponse:
@@ -15,3 +18,46 @@ def get_status(db: Session) -> StatusDbResponse:
         is_ok = False
     end = time()
     return StatusDbResponse(timeMs=round((end - start) * 1000, 4), online=is_ok)
+
+
+def get_analytics_status() -> StatusAnalyticsResponse:
+    return StatusAnalyticsResponse(
+        running=analytics.is_running,
+        queued=analytics.queue_size,
+        sent=analytics.n_sent,
+        dropped=analytics.n_dropped,
+        failed=analytics.n_failed
+    )
+
+
+def get_cache_status() -> StatusCacheResponse:
+    return StatusCacheResponse(
+        memoryItems=len(MEMORY_CACHE),
+        memoryBytes=MEMORY_CACHE.n_bytes,
+        memoryHits=CACHE_STATS.memory_hits,
+        diskHits=CACHE_STATS.disk_hits,
+        misses=CACHE_STATS.misses,
+        writes=CACHE_STATS.writes,
+        memoryEvictions=CACHE_STATS.memory_evictions,
+        diskEvictions=CACHE_STATS.disk_evictions,
+        inFlight=len(SINGLE_FLIGHT),
+        coalescedExecuted=SINGLE_FLIGHT.n_executed,
+        coalescedShared=SINGLE_FLIGHT.n_shared
+    )
+
+
+def get_indexes_status() -> StatusIndexesResponse:
+    tree_index = get_taxon_tree_index()
+    search_index = get_taxon_search_index()
+    history_index = get_taxon_history_index()
+    return StatusIndexesResponse(
+        taxonTreeNodes=len(tree_index) if tree_index is not None else None,
+        taxonTreeLoadedEpoch=int(tree_index.created) if tree_index is not None else None,
+        taxonTreeBuildMs=round(tree_index.build_ms, 2) if tree_index is not None else None,
+        taxonSearchTaxa=len(search_index) if search_index is not None else None,
+        taxonSearchLoadedEpoch=int(search_index.created) if search_index is not None else None,
+        taxonSearchBuildMs=round(search_index.build_ms, 2) if search_index is not None else None,
+        taxonHistoryTaxa=len(history_index) if history_index is not None else None,
+        taxonHistoryLoadedEpoch=int(history_index.created) if history_index is not None else None,
+        taxonHistoryBuildMs=round(history_index.build_ms, 2) if history_index is not None else None
+    )
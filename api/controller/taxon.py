@@ -1,26 +1,102 @@
+import asyncio
 from typing import List
 
 import numpy as np
 import sqlmodel as sm
 from sqlalchemy import func, union_all
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from api.config import GTDB_RELEASES, CURRENT_RELEASE
 from api.db.gtdb import DbGtdbSpeciesClusterCount, DbMetadataTaxonomy, DbGenomes, DbMetadataNucleotide, DbMetadataNcbi
 from api.db.gtdb_web import DbGtdbTree, DbGtdbTreeUrlBergeys, DbGtdbTreeUrlSeqCode, DbGtdbTreeUrlNcbi, DbGtdbTreeUrlLpsn, \
-    DbGtdbTreeUrlSandpiper, DbGtdbTreeChildren, DbTaxonHist
+    DbGtdbTreeUrlSandpiper, DbGtdbTreeChildren, DbTaxonHist, DbTaxonHistSummary, \
+    DbTaxonStats
 from api.exceptions import HttpBadRequest, HttpNotFound, HttpInternalServerError
 from api.model.graph import GraphHistogramBin
 from api.model.taxon import TaxonDescendants, TaxonSearchResponse, TaxonPreviousReleases, TaxonCard, \
     TaxonPreviousReleasesPaginated, TaxonGenomesDetailResponse, TaxonGenomesDetailRow
+from api.util.autocomplete import TaxonAutocompleteIndex
+from api.util.histogram import rebin_fixed_histogram
+from api.util.taxon_history import TaxonHistoryIndex, summarise_taxon_history
+from api.util.tree_index import TaxonTreeIndex
 
 
-def get_taxon_descendants(taxon: str, db: Session) -> List[TaxonDescendants]:
+# The GTDB tree held in memory (if enabled), this is replaced as a whole when reloaded
+TREE_INDEX: TaxonTreeIndex | None = None
+
+
+async def load_taxon_tree_index(db: AsyncSession) -> TaxonTreeIndex:
+    """Read the GTDB tree into memory, the current index is used until the new one is built."""
+    global TREE_INDEX
+    query_nodes = (
+        sm.select(
+            DbGtdbTree.id,
+            DbGtdbTree.taxon,
+            DbGtdbTree.total,
+            DbGtdbTree.type,
+            DbGtdbTree.is_rep,
+            DbGtdbTree.type_material,
+            DbGtdbTree.n_desc_children,
+            DbGtdbTreeUrlBergeys.url.label('bergeys_url'),
+            DbGtdbTreeUrlSeqCode.url.label('seqcode_url'),
+            DbGtdbTreeUrlLpsn.url.label('lpsn_url'),
+            DbGtdbTreeUrlNcbi.taxid.label('ncbi_taxid'),
+            DbGtdbTreeUrlSandpiper.url.label('sandpiper_url')
+        )
+        .outerjoin(DbGtdbTreeUrlBergeys, DbGtdbTreeUrlBergeys.id == DbGtdbTree.id)
+        .outerjoin(DbGtdbTreeUrlSeqCode, DbGtdbTreeUrlSeqCode.id == DbGtdbTree.id)
+        .outerjoin(DbGtdbTreeUrlLpsn, DbGtdbTreeUrlLpsn.id == DbGtdbTree.id)
+        .outerjoin(DbGtdbTreeUrlNcbi, DbGtdbTreeUrlNcbi.id == DbGtdbTree.id)
+        .outerjoin(DbGtdbTreeUrlSandpiper, DbGtdbTreeUrlSandpiper.id == DbGtdbTree.id)
+    )
+    query_edges = sm.select(DbGtdbTreeChildren.parent_id, DbGtdbTreeChildren.child_id, DbGtdbTreeChildren.order_id)
+    nodes = (await db.exec(query_nodes)).all()
+    edges = (await db.exec(query_edges)).all()
+
+    # Building the index is CPU bound, so it is done off the event loop
+    TREE_INDEX = await asyncio.to_thread(TaxonTreeIndex, nodes, edges)
+    return TREE_INDEX
+
+
+def get_taxon_tree_index() -> TaxonTreeIndex | None:
+    return TREE_INDEX
+
+
+def taxon_descendants_from_node(node) -> TaxonDescendants:
+    """Convert a TreeNode (or a row with the same columns) to the response model."""
+    return TaxonDescendants(
+        taxon=node.taxon,
+        total=node.total,
+        isGenome=node.type == 'genome',
+        isRep=node.is_rep,
+        typeMaterial=node.type_material,
+        nDescChildren=node.n_desc_children,
+        bergeysUrl=node.bergeys_url,
+        seqcodeUrl=node.seqcode_url,
+        lpsnUrl=node.lpsn_url,
+        ncbiTaxId=node.ncbi_taxid,
+        sandpiperUrl=node.sandpiper_url
+    )
+
+
+async def get_taxon_descendants(taxon: str, db: AsyncSession) -> List[TaxonDescendants]:
     """Returns the direct descendants below this taxon."""
 
+    # Use the in-memory tree if it has been loaded
+    index = TREE_INDEX
+    if index is not None:
+        if taxon in index.duplicate_taxa:
+            raise HttpInternalServerError(f'The taxon {taxon} exists multiple times, please report this issue.')
+        try:
+            children = index.children_of(taxon)
+        except KeyError:
+            raise HttpBadRequest(f'The taxon {taxon} does not exist.')
+        return [taxon_descendants_from_node(x) for x in children]
+
     # Get parent info
     taxon_query = sm.select(DbGtdbTree).where(DbGtdbTree.taxon == taxon)
-    taxon_results = db.exec(taxon_query).all()
+    taxon_results = (await db.exec(taxon_query)).all()
 
     if len(taxon_results) == 0:
         raise HttpBadRequest(f'The taxon {taxon} does not exist.')
@@ -52,35 +128,53 @@ def get_taxon_descendants(taxon: str, db: Session) -> List[TaxonDescendants]:
         .order_by(DbGtdbTreeChildren.order_id)
     )
 
-    results = db.exec(query).all()
+    results = (await db.exec(query)).all()
+    return [taxon_descendants_from_node(x) for x in results]
+
+
+# The rank columns (and their prefix) searched by the taxon autocomplete
+SEARCH_RANK_COLUMNS = (
+    (DbGtdbSpeciesClusterCount.gtdb_domain, 'd__'),
+    (DbGtdbSpeciesClusterCount.gtdb_phylum, 'p__'),
+    (DbGtdbSpeciesClusterCount.gtdb_class, 'c__'),
+    (DbGtdbSpeciesClusterCount.gtdb_order, 'o__'),
+    (DbGtdbSpeciesClusterCount.gtdb_family, 'f__'),
+    (DbGtdbSpeciesClusterCount.gtdb_genus, 'g__'),
+    (DbGtdbSpeciesClusterCount.gtdb_species, 's__')
+)
+
+# The distinct taxa of each rank held in memory (if enabled), this is replaced as a whole when reloaded
+SEARCH_INDEX: TaxonAutocompleteIndex | None = None
 
-    out = list()
-    for result in results:
-        out.append(
-            TaxonDescendants(
-                taxon=result.taxon,
-                total=result.total,
-                isGenome=result.type == 'genome',
-                isRep=result.is_rep,
-                typeMaterial=result.type_material,
-                nDescChildren=result.n_desc_children,
-                bergeysUrl=result.bergeys_url,
-                seqcodeUrl=result.seqcode_url,
-                lpsnUrl=result.lpsn_url,
-                ncbiTaxId=result.ncbi_taxid,
-                sandpiperUrl=result.sandpiper_url
-            )
-        )
-    return out
 
+async def load_taxon_search_index(db: AsyncSession) -> TaxonAutocompleteIndex:
+    """Read the distinct taxa of each rank into memory, the current index is used until the new one is built."""
+    global SEARCH_INDEX
+    d_prefix_to_names = dict()
+    for col, prefix in SEARCH_RANK_COLUMNS:
+        d_prefix_to_names[prefix] = (await db.exec(sm.select(col).distinct())).all()
+    SEARCH_INDEX = await asyncio.to_thread(TaxonAutocompleteIndex, d_prefix_to_names)
+    return SEARCH_INDEX
 
-def search_for_taxon(taxon: str, limit: int | None, db: Session) -> TaxonSearchResponse:
+
+def get_taxon_search_index() -> TaxonAutocompleteIndex | None:
+    return SEARCH_INDEX
+
+
+async def search_for_taxon(taxon: str, limit: int | None, db: AsyncSession) -> TaxonSearchResponse:
     # Maximum number of results to be returned
     if limit is not None:
         limit = min(limit, 100)
     else:
         limit = 100
 
+    # Use the in-memory index if it has been loaded
+    index = SEARCH_INDEX
+    if index is not None:
+        if taxon[0:3] in index.ranks:
+            return TaxonSearchResponse(matches=index.search_rank(taxon[0:3], taxon[3:], limit))
+        return TaxonSearchResponse(matches=index.search_all(taxon, limit))
+
     if taxon.startswith('d__'):
         col = DbGtdbSpeciesClusterCount.gtdb_domain
         prefix = 'd__'
@@ -109,22 +203,14 @@ def search_for_taxon(taxon: str, limit: int | None, db: Session) -> TaxonSearchR
     # If a prefix has been supplied, then we can just search that rank only
     if col:
         query = sm.select(func.concat(prefix, col)).where(col.ilike(f'{taxon[3:]}%')).distinct().limit(limit)
-        results = db.exec(query).all()
+        results = (await db.exec(query)).all()
         return TaxonSearchResponse(matches=list(results))
 
     # Run against all columns
     else:
         # Create a subquery for each rank
         subqueries = list()
-        for col, prefix in (
-                (DbGtdbSpeciesClusterCount.gtdb_domain, 'd__'),
-                (DbGtdbSpeciesClusterCount.gtdb_phylum, 'p__'),
-                (DbGtdbSpeciesClusterCount.gtdb_class, 'c__'),
-                (DbGtdbSpeciesClusterCount.gtdb_order, 'o__'),
-                (DbGtdbSpeciesClusterCount.gtdb_family, 'f__'),
-                (DbGtdbSpeciesClusterCount.gtdb_genus, 'g__'),
-                (DbGtdbSpeciesClusterCount.gtdb_species, 's__')
-        ):
+        for col, prefix in SEARCH_RANK_COLUMNS:
             subquery = (
                 sm.select(func.concat(prefix, col))
                 .where(col.ilike(f'%{taxon}%'))
@@ -135,7 +221,7 @@ def search_for_taxon(taxon: str, limit: int | None, db: Session) -> TaxonSearchR
 
         # Union the subqueries and run them
         query = union_all(*subqueries)
-        results = db.exec(query).all()
+        results = (await db.exec(query)).all()
         return TaxonSearchResponse(matches=[x[0] for x in results])
 
 
@@ -220,19 +306,33 @@ def search_for_taxon_all_releases(taxon: str, limit: int | None, db: Session) ->
         return TaxonSearchResponse(matches=[x[0] for x in results])
 
 
-def results_from_previous_releases(
-        search: str,
-        db: Session,
-        page: int | None = None,
-        items_per_page: int | None = None
-) -> TaxonPreviousReleasesPaginated:
-    # Validate the input.
-    search = search.strip()
-    if len(search) == 0:
-        raise HttpBadRequest('The taxon cannot be empty.')
-    search = '%{}%'.format(search)
+# The taxa seen in previous releases held in memory (if enabled), this is replaced as a whole when reloaded
+HISTORY_INDEX: TaxonHistoryIndex | None = None
+
+
+async def load_taxon_history_index(db: AsyncSession) -> TaxonHistoryIndex:
+    """Read the taxa not in the current release (from taxon_hist_summary) into memory, sorted by the index."""
+    global HISTORY_INDEX
+    query = (
+        sm.select(
+            DbTaxonHistSummary.taxon,
+            DbTaxonHistSummary.first_seen,
+            DbTaxonHistSummary.last_seen,
+            DbTaxonHistSummary.present_in_current
+        )
+        .where(DbTaxonHistSummary.present_in_current == False)
+    )
+    rows = (await db.exec(query)).all()
+    HISTORY_INDEX = await asyncio.to_thread(TaxonHistoryIndex, rows)
+    return HISTORY_INDEX
+
 
-    # Create the subqueries for each rank
+def get_taxon_history_index() -> TaxonHistoryIndex | None:
+    return HISTORY_INDEX
+
+
+def read_taxon_history_rows(db: Session, search: str | None = None) -> list[tuple[str, str]]:
+    """Returns the distinct (taxon, release) pairs of each rank in taxon_hist, optionally containing search."""
     subqueries = list()
     for rank in (
             DbTaxonHist.rank_domain,
@@ -243,75 +343,65 @@ def results_from_previous_releases(
             DbTaxonHist.rank_genus,
             DbTaxonHist.rank_species
     ):
-        subqueries.append(sm.select(rank, DbTaxonHist.release_ver).where(rank.ilike(f'%{search}%')).distinct())
-
-    # Execute the query
-    results = db.exec(union_all(*subqueries)).all()
-    rank_order_dict = {x: i for (i, x) in enumerate(GTDB_RELEASES)}
-
-    # There's a case that exists where the case is slightly different for previous releases.
-    # Therefore, if all the keys are the same (ignoring case), and the current release is present
-    # then use the most recent releases capitalisation
-    results = [(x.strip(), y.strip()) for (x, y) in results]
-
-    d_oldest_taxon_name = dict()
-    for cur_taxon, release_ver in results:
-        cur_release = rank_order_dict[release_ver]
-        if cur_release == rank_order_dict['NCBI']:
-            continue
-        if cur_taxon.lower() not in d_oldest_taxon_name:
-            d_oldest_taxon_name[cur_taxon.lower()] = (cur_taxon, cur_release)
-        elif cur_release > d_oldest_taxon_name[cur_taxon.lower()][1]:
-            d_oldest_taxon_name[cur_taxon.lower()] = (cur_taxon, cur_release)
-
-    all_hits = dict()
-    for rank_name, release_ver in results:
-        if rank_name.lower() in d_oldest_taxon_name:
-            cur_rank_name = d_oldest_taxon_name[rank_name.lower()][0]
-        else:
-            cur_rank_name = rank_name
+        subquery = sm.select(rank, DbTaxonHist.release_ver).distinct()
+        if search is not None:
+            subquery = subquery.where(rank.ilike(f'%{search}%'))
+        subqueries.append(subquery)
+    return [(x[0], x[1]) for x in db.exec(union_all(*subqueries)).all()]
 
-        # Store this release version for this rank.
-        if cur_rank_name not in all_hits:
-            all_hits[cur_rank_name] = set()
-        all_hits[cur_rank_name].add(release_ver)
 
-    out = dict()
-    for rank_name, rank_set in all_hits.items():
-
-        # Only interested in previous GTDB releases
-        if CURRENT_RELEASE in rank_set:
-            continue
-
-        # Ignore those which only appear in NCBI
-        if len(rank_set - {'NCBI', CURRENT_RELEASE}) == 0:
-            continue
-
-        if rank_name not in out:
-            out[rank_name] = list()
-        for cur_rank in sorted(rank_set, key=lambda x: rank_order_dict[x]):
-            if cur_rank != 'NCBI':
-                out[rank_name].append(cur_rank)
+def results_from_previous_releases(
+        search: str,
+        db: Session,
+        page: int | None = None,
+        items_per_page: int | None = None
+) -> TaxonPreviousReleasesPaginated:
+    # Validate the input.
+    search = search.strip()
+    if len(search) == 0:
+        raise HttpBadRequest('The taxon cannot be empty.')
 
-    out_list = list()
-    for rank_name, rank_set in sorted(out.items()):
-        sorted_taxa = sorted(rank_set, key=lambda x: rank_order_dict[x])
-        out_list.append(TaxonPreviousReleases(taxon=rank_name,
-                                              firstSeen=sorted_taxa[0],
-                                              lastSeen=sorted_taxa[-1]))
+    # Use the in-memory index if it has been loaded, otherwise summarise the matching rows
+    index = HISTORY_INDEX
+    if index is not None:
+        entries = index.search(search)
+    else:
+        rows = read_taxon_history_rows(db, search)
+        entries = summarise_taxon_history(rows, GTDB_RELEASES, CURRENT_RELEASE)
+        entries = [x for x in entries if not x.present_in_current]
 
     # Do pagination
-    total_rows = len(out_list)
+    total_rows = len(entries)
     if page and items_per_page:
-        out_list = out_list[items_per_page * (page - 1): items_per_page * page]
+        entries = entries[items_per_page * (page - 1): items_per_page * page]
 
     return TaxonPreviousReleasesPaginated(
         totalRows=total_rows,
-        rows=out_list
+        rows=[TaxonPreviousReleases(taxon=x.taxon, firstSeen=x.first_seen, lastSeen=x.last_seen) for x in entries]
     )
 
 
-def get_gc_content_histogram_bins(taxon: str, db: Session) -> List[GraphHistogramBin]:
+# Whether taxon_stats exists, only a positive result is kept (the table may be created later)
+TAXON_STATS_TABLE_EXISTS = False
+
+
+def util_taxon_stats_table_exists(db_web: Session) -> bool:
+    """True if the statistics have been computed for this release (see scripts/release/update_taxon_stats.py)."""
+    global TAXON_STATS_TABLE_EXISTS
+    if not TAXON_STATS_TABLE_EXISTS:
+        query = sm.text(f"SELECT to_regclass('{DbTaxonStats.__tablename__}') IS NOT NULL;")
+        TAXON_STATS_TABLE_EXISTS = bool(db_web.exec(query).scalar())
+    return TAXON_STATS_TABLE_EXISTS
+
+
+def get_taxon_stats(taxon: str, db_web: Session) -> DbTaxonStats | None:
+    """Returns the statistics computed at release time (scripts/release/update_taxon_stats.py), if they exist."""
+    if not util_taxon_stats_table_exists(db_web):
+        return None
+    return db_web.exec(sm.select(DbTaxonStats).where(DbTaxonStats.taxon == taxon)).first()
+
+
+def get_gc_content_histogram_bins(taxon: str, db: Session, db_web: Session) -> List[GraphHistogramBin]:
     # Select the target column to search
     if taxon.startswith('d__'):
         target_col = DbMetadataTaxonomy.gtdb_domain
@@ -330,6 +420,14 @@ def get_gc_content_histogram_bins(taxon: str, db: Session) -> List[GraphHistogra
     else:
         raise HttpBadRequest(f'Invalid taxon {taxon}')
 
+    # Use the histogram computed at release time, if it exists
+    stats = get_taxon_stats(taxon, db_web)
+    if stats is not None:
+        if stats.gc_n == 0:
+            raise HttpBadRequest(f'Taxon {taxon} not found')
+        counts, bin_edges = rebin_fixed_histogram(stats.gc_counts, stats.gc_bin_start, stats.gc_bin_width)
+        return histogram_bins(counts, bin_edges)
+
     # Select the GC values
     query = (
         sm.select(DbMetadataNucleotide.gc_percentage)
@@ -344,14 +442,17 @@ def get_gc_content_histogram_bins(taxon: str, db: Session) -> List[GraphHistogra
 
     # Compute the histogram bins
     counts, bin_edges = np.histogram(results, bins='auto')
+    return histogram_bins(counts, bin_edges)
+
 
+def histogram_bins(counts, bin_edges) -> List[GraphHistogramBin]:
     out = list()
     for i, count in enumerate(counts):
         out.append(GraphHistogramBin(x0=bin_edges[i], x1=bin_edges[i + 1], height=count))
     return out
 
 
-def get_taxon_card(taxon: str, db_gtdb: Session) -> TaxonCard:
+def get_taxon_card(taxon: str, db_gtdb: Session, db_web: Session) -> TaxonCard:
     idx_to_tax_col = (
         DbMetadataTaxonomy.gtdb_domain,
         DbMetadataTaxonomy.gtdb_phylum,
@@ -385,6 +486,18 @@ def get_taxon_card(taxon: str, db_gtdb: Session) -> TaxonCard:
     cur_rank = idx_to_rank[rank_idx]
     higher_ranks = idx_to_tax_col[:rank_idx]
 
+    # Use the statistics computed at release time, if they exist
+    stats = get_taxon_stats(taxon, db_web)
+    if stats is not None:
+        if stats.higher_ranks is None:
+            raise HttpBadRequest(f'Taxon {taxon} not found')
+        return TaxonCard(
+            nGenomes=stats.n_genomes,
+            rank=cur_rank,
+            inReleases=[],
+            higherRanks=stats.higher_ranks
+        )
+
     # Make sure this taxon exists
     query_n_gids = sm.select(func.count('*')).where(target_col == taxon)
     n_genomes = db_gtdb.exec(query_n_gids).first()
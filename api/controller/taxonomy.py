@@ -2,6 +2,7 @@ from typing import List
 
 import sqlmodel as sm
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from api.config import GTDB_RELEASES
 from api.db.gtdb import DbGtdbSpeciesClusterCount
@@ -9,12 +10,13 @@ from api.db.gtdb_web import DbGtdbTaxaNotInLit, DbTaxonHist
 from api.exceptions import HttpBadRequest, HttpNotFound
 from api.model.taxonomy import TaxonomyCount, TaxonomyCountRequest, TaxonomyCountResponse, \
     TaxaNotInLiterature, TaxonomyOptional, TaxonomyOptionalRelease
+from api.util.pagination import count_rows, paginate_keyset, STREAM_YIELD_PER
 
 
-def add_gtdb_proposed_taxa_to_query(query, gtdb_web: Session):
+async def add_gtdb_proposed_taxa_to_query(query, gtdb_web: AsyncSession):
     """Take the lowest rank taxon and append that to the query."""
     d, p, c, o, f, g, s = [set() for _ in range(7)]
-    for taxon in taxa_not_in_lit(gtdb_web):
+    for taxon in await taxa_not_in_lit(gtdb_web):
         for cur_set, rank in (
                 (s, taxon.taxonomy.s), (g, taxon.taxonomy.g), (f, taxon.taxonomy.f),
                 (o, taxon.taxonomy.o), (c, taxon.taxonomy.c), (p, taxon.taxonomy.p),
@@ -40,8 +42,8 @@ def add_gtdb_proposed_taxa_to_query(query, gtdb_web: Session):
     return out
 
 
-def post_taxonomy_count(request: TaxonomyCountRequest, db_gtdb: Session, gtdb_web: Session) -> TaxonomyCountResponse:
-    """Returns the number of genomes in each species cluster."""
+async def taxonomy_count_query(request: TaxonomyCountRequest, gtdb_web: AsyncSession):
+    """Returns the species cluster query (unordered), and the (column, descending) pairs it should be sorted by."""
     query = sm.select(
         DbGtdbSpeciesClusterCount.gtdb_domain,
         DbGtdbSpeciesClusterCount.gtdb_phylum,
@@ -55,38 +57,30 @@ def post_taxonomy_count(request: TaxonomyCountRequest, db_gtdb: Session, gtdb_we
 
     # If the user is requesting only GTDB proposed names, create a filter for these
     if request.proposed:
-        query = add_gtdb_proposed_taxa_to_query(query, gtdb_web)
+        query = await add_gtdb_proposed_taxa_to_query(query, gtdb_web)
 
     # Determine the order_by clause
+    sort_columns = list()
     if request.sortBy and request.sortDesc and 0 < len(request.sortBy) == len(request.sortDesc):
-        order_by = list()
         for sort_by, sort_desc in zip(request.sortBy, request.sortDesc):
             if sort_by == 'd':
-                order_by.append(
-                    DbGtdbSpeciesClusterCount.gtdb_domain.desc() if sort_desc else DbGtdbSpeciesClusterCount.gtdb_domain.asc())
+                sort_columns.append((DbGtdbSpeciesClusterCount.gtdb_domain, sort_desc))
             elif sort_by == 'p':
-                order_by.append(
-                    DbGtdbSpeciesClusterCount.gtdb_phylum.desc() if sort_desc else DbGtdbSpeciesClusterCount.gtdb_phylum)
+                sort_columns.append((DbGtdbSpeciesClusterCount.gtdb_phylum, sort_desc))
             elif sort_by == 'c':
-                order_by.append(
-                    DbGtdbSpeciesClusterCount.gtdb_class.desc() if sort_desc else DbGtdbSpeciesClusterCount.gtdb_class)
+                sort_columns.append((DbGtdbSpeciesClusterCount.gtdb_class, sort_desc))
             elif sort_by == 'o':
-                order_by.append(
-                    DbGtdbSpeciesClusterCount.gtdb_order.desc() if sort_desc else DbGtdbSpeciesClusterCount.gtdb_order)
+                sort_columns.append((DbGtdbSpeciesClusterCount.gtdb_order, sort_desc))
             elif sort_by == 'f':
-                order_by.append(
-                    DbGtdbSpeciesClusterCount.gtdb_family.desc() if sort_desc else DbGtdbSpeciesClusterCount.gtdb_family)
+                sort_columns.append((DbGtdbSpeciesClusterCount.gtdb_family, sort_desc))
             elif sort_by == 'g':
-                order_by.append(
-                    DbGtdbSpeciesClusterCount.gtdb_genus.desc() if sort_desc else DbGtdbSpeciesClusterCount.gtdb_genus)
+                sort_columns.append((DbGtdbSpeciesClusterCount.gtdb_genus, sort_desc))
             elif sort_by == 's':
-                order_by.append(
-                    DbGtdbSpeciesClusterCount.gtdb_species.desc() if sort_desc else DbGtdbSpeciesClusterCount.gtdb_species)
+                sort_columns.append((DbGtdbSpeciesClusterCount.gtdb_species, sort_desc))
             elif sort_by == 'count':
-                order_by.append(DbGtdbSpeciesClusterCount.cnt.desc() if sort_desc else DbGtdbSpeciesClusterCount.cnt)
+                sort_columns.append((DbGtdbSpeciesClusterCount.cnt, sort_desc))
             else:
                 raise HttpBadRequest(f'Unknown sortBy: {sort_by}')
-        query = query.order_by(*order_by)
 
     # Add search
     if request.search:
@@ -117,18 +111,42 @@ def post_taxonomy_count(request: TaxonomyCountRequest, db_gtdb: Session, gtdb_we
         query = query.where(DbGtdbSpeciesClusterCount.gtdb_genus.ilike(f'%{request.filterGenus}%'))
     if request.filterSpecies:
         query = query.where(DbGtdbSpeciesClusterCount.gtdb_species.ilike(f'%{request.filterSpecies}%'))
+    return query, sort_columns
+
+
+async def post_taxonomy_count(request: TaxonomyCountRequest, db_gtdb: AsyncSession,
+                              gtdb_web: AsyncSession) -> TaxonomyCountResponse:
+    """Returns the number of genomes in each species cluster."""
+    query, sort_columns = await taxonomy_count_query(request, gtdb_web)
+
+    # Cursor pagination, there is one row per species so it breaks any ties
+    next_cursor = None
+    if request.cursor is not None:
+        if not request.itemsPerPage:
+            raise HttpBadRequest('You must specify itemsPerPage when using a cursor.')
+        if not any(col is DbGtdbSpeciesClusterCount.gtdb_species for col, _ in sort_columns):
+            sort_columns.append((DbGtdbSpeciesClusterCount.gtdb_species, False))
+        results, total_rows, next_cursor = await paginate_keyset(
+            query, sort_columns, request.cursor, request.itemsPerPage, db_gtdb
+        )
 
-    # Get the total number of rows in the table before pagination
-    total_rows = db_gtdb.exec(sm.select(sm.func.count()).select_from(query)).first()
+    # Offset pagination
+    else:
+        if sort_columns:
+            query = query.order_by(*[col.desc() if desc else col for col, desc in sort_columns])
 
-    # Add pagination
-    if request.itemsPerPage and request.page:
-        query = query.limit(request.itemsPerPage)
-        query = query.offset(request.itemsPerPage * (request.page - 1))
+        # Get the total number of rows in the table before pagination
+        total_rows = await count_rows(query, db_gtdb)
+
+        # Add pagination
+        if request.itemsPerPage and request.page:
+            query = query.limit(request.itemsPerPage)
+            query = query.offset(request.itemsPerPage * (request.page - 1))
+        results = await db_gtdb.exec(query)
 
     # Run the query and return the results
     rows = list()
-    for row in db_gtdb.exec(query):
+    for row in results:
         rows.append(TaxonomyCount(d=row.gtdb_domain,
                                   p=row.gtdb_phylum,
                                   c=row.gtdb_class,
@@ -137,21 +155,24 @@ def post_taxonomy_count(request: TaxonomyCountRequest, db_gtdb: Session, gtdb_we
                                   g=row.gtdb_genus,
                                   s=row.gtdb_species,
                                   count=row.cnt))
-    return TaxonomyCountResponse(totalRows=total_rows, rows=rows)
-
+    return TaxonomyCountResponse(totalRows=total_rows, rows=rows, nextCursor=next_cursor)
 
-def taxonomy_count_rows_to_sv(data: TaxonomyCountResponse) -> List[List[str]]:
-    out = list()
 
-    # Exit early if no data
-    rows = data.rows
-    if len(rows) == 0:
-        return out
+async def iter_taxonomy_count_download_rows(query, sort_columns, db_gtdb: AsyncSession):
+    """Yields the header and every species cluster, read from a server-side cursor."""
+    if sort_columns:
+        query = query.order_by(*[col.desc() if desc else col for col, desc in sort_columns])
 
-    out.append(['Domain', 'Phylum', 'Class', 'Order', 'Family', 'Genus', 'Species', 'No. genomes'])
-    for row in rows:
-        out.append([row.d, row.p, row.c, row.o, row.f, row.g, row.s, row.count])
-    return out
+    result = await db_gtdb.stream(query.execution_options(yield_per=STREAM_YIELD_PER))
+    has_rows = False
+    async for partition in result.partitions():
+        # The header is only written if there is data
+        if not has_rows:
+            yield 'Domain', 'Phylum', 'Class', 'Order', 'Family', 'Genus', 'Species', 'No. genomes'
+            has_rows = True
+        for row in partition:
+            yield (row.gtdb_domain, row.gtdb_phylum, row.gtdb_class, row.gtdb_order,
+                   row.gtdb_family, row.gtdb_genus, row.gtdb_species, row.cnt)
 
 
 def taxonomy_partial_search_all_releases(taxon: str, db: Session) -> List[TaxonomyOptionalRelease]:
@@ -290,9 +311,9 @@ def taxonomy_partial_search(taxon: str, db: Session) -> TaxonomyOptional:
     )
 
 
-def taxa_not_in_lit(db: Session) -> List[TaxaNotInLiterature]:
+async def taxa_not_in_lit(db: AsyncSession) -> List[TaxaNotInLiterature]:
     query = sm.select(DbGtdbTaxaNotInLit)
-    rows = db.exec(query).all()
+    rows = (await db.exec(query)).all()
     out = list()
     for row in rows:
         out.append(TaxaNotInLiterature(taxon=row.taxon,
@@ -90,7 +90,7 @@ class DbSkaniResult(SQLModel, table=True):
     __table_args__ = {'schema': 'skani'}
 
     id: int = Field(sa_column=Column(sa.Integer, sa.Identity(), primary_key=True, autoincrement=True))
-    param_id: int = Field(foreign_key='skani.program.id', nullable=False)
+    param_id: int = Field(foreign_key='skani.param.id', nullable=False)
     qry_id: int | None = Field(foreign_key='skani.genome.id', nullable=True)
     ref_id: int | None = Field(foreign_key='skani.genome.id', nullable=True)
     ani: float | None = Field(nullable=True)
@@ -106,6 +106,7 @@ class DbSkaniUserGenome(SQLModel, table=True):
     job_id: int = Field(foreign_key='skani.job.id', nullable=False)
     file_name: str = Field(nullable=False)
     fna: str | None = Field(nullable=True)
+    sha256: str | None = Field(sa_column=Column(CHAR(64), nullable=True))
 
 
 class DbSkaniJobResult(SQLModel, table=True):
@@ -116,3 +117,15 @@ class DbSkaniJobResult(SQLModel, table=True):
     ani: list[int] = Field(sa_column=Column(ARRAY(SMALLINT)))
     af_qry: list[int] = Field(sa_column=Column(ARRAY(SMALLINT)))
     af_ref: list[int] = Field(sa_column=Column(ARRAY(SMALLINT)))
+
+
+class DbSkaniJobResultLeaves(SQLModel, table=True):
+    """The dendrogram leaf order of the heatmap for a completed job, clustered by ANI or AF (using method)."""
+    __tablename__ = 'job_result_leaves'
+    __table_args__ = {'schema': 'skani'}
+
+    job_id: int = Field(primary_key=True, foreign_key='skani.job.id', nullable=False)
+    cluster_by: str = Field(sa_column=Column(sa.String(3), primary_key=True, nullable=False))
+    method: str = Field(sa_column=Column(sa.String(64), primary_key=True, nullable=False))
+    x_leaves: list[int] = Field(sa_column=Column(ARRAY(sa.Integer), nullable=False))
+    y_leaves: list[int] = Field(sa_column=Column(ARRAY(sa.Integer), nullable=False))
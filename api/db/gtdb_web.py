@@ -1,10 +1,21 @@
-from sqlmodel import Field, SQLModel, Column, CHAR, JSON
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlmodel import ARRAY, Field, SQLModel, Column, CHAR, JSON
 
 """
 Tables below.
 """
 
 
+class DbGenomeCard(SQLModel, table=True):
+    __tablename__ = 'genome_card'
+
+    gid: str = Field(primary_key=True)
+    # The accessions that the card is returned for (i.e. those matched by build_genome_card)
+    accessions: list[str] = Field(sa_column=Column(ARRAY(sa.Text), nullable=False, server_default='{}'))
+    payload: dict = Field(sa_column=Column(JSONB, nullable=False))
+
+
 class DbGenomeTaxId(SQLModel, table=True):
     __tablename__ = 'genome_taxid'
 
@@ -104,6 +115,34 @@ class DbTaxonHist(SQLModel, table=True):
     rank_species: str = Field()
 
 
+class DbTaxonHistSummary(SQLModel, table=True):
+    __tablename__ = 'taxon_hist_summary'
+
+    taxon: str = Field(primary_key=True)
+    first_seen: str = Field()
+    last_seen: str = Field()
+    present_in_current: bool = Field()
+
+
+class DbTaxonStats(SQLModel, table=True):
+    """Summary statistics of each taxon in the release (scripts/release/update_taxon_stats.py)."""
+    __tablename__ = 'taxon_stats'
+
+    taxon: str = Field(primary_key=True)
+    n_genomes: int = Field()
+    n_sp_reps: int = Field()
+    # None if the genomes in this taxon do not share the same higher ranks
+    higher_ranks: list[str] | None = Field(sa_column=Column(ARRAY(sa.Text)))
+    gc_n: int = Field()
+    gc_min: float | None = Field()
+    gc_max: float | None = Field()
+    gc_mean: float | None = Field()
+    # The GC% histogram, gc_counts[i] is the count of [(gc_bin_start + i) * gc_bin_width, ... + gc_bin_width)
+    gc_bin_width: float = Field()
+    gc_bin_start: int = Field()
+    gc_counts: list[int] = Field(sa_column=Column(ARRAY(sa.Integer), nullable=False))
+
+
 class DbUbaAlias(SQLModel, table=True):
     __tablename__ = 'uba_alias'
 
@@ -239,3 +239,5 @@ class AdvancedSearchHeader(BaseModel):
 class AdvancedSearchResult(BaseModel):
     headers: List[AdvancedSearchHeader] = Field(...)
     rows: List[Dict[str, Any]] = Field(...)
+    totalRows: Optional[int] = Field(None, description='total number of rows, if paging by cursor')
+    nextCursor: Optional[str] = Field(None, description='cursor for the next page, if paging by cursor')
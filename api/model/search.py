@@ -15,6 +15,7 @@ class SearchColumnEnum(Enum):
 class SearchGtdbRequest(BaseModel):
     page: Optional[int] = Field(None, description='page number', example=1)
     itemsPerPage: Optional[int] = Field(None, description='number of items per page', example=10)
+    cursor: Optional[str] = Field(None, description='cursor from the previous page, or * for the first page (replaces page)')
     sortBy: Optional[List[str]] = Field(None, description='sort by', example=['d', 'p'])
     sortDesc: Optional[List[bool]] = Field(None, description='sort descending', example=[True, False])
     search: Optional[str] = Field(None, description='main search query', example='Escherichia')
@@ -38,3 +39,4 @@ class SearchGtdbRow(BaseModel):
 class SearchGtdbResponse(BaseModel):
     rows: List[SearchGtdbRow]
     totalRows: int
+    nextCursor: Optional[str] = Field(None, description='cursor for the next page, if paging by cursor')
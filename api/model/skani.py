@@ -1,3 +1,4 @@
+from datetime import datetime
 from enum import Enum
 from typing import List, Literal, Optional
 
@@ -261,6 +262,13 @@ class SkaniResultTableRow(BaseModel):
         return [self.qry, self.ref, self.ani, self.afQry, self.afRef]
 
 
+class SkaniResultTableColumns(BaseModel):
+    qry: List[str] = Field(...)
+    ref: List[str] = Field(...)
+    ani: List[float] = Field(...)
+    afQry: List[float] = Field(...)
+    afRef: List[float] = Field(...)
+
 
 class SkaniJobDataTableResponse(BaseModel):
     jobId: str = Field(...)
@@ -269,6 +277,7 @@ class SkaniJobDataTableResponse(BaseModel):
     # totalResults: int = Field(...)
     # totalPages: int = Field(...)
     rows: List[SkaniResultTableRow] = Field(...)
+    columns: SkaniResultTableColumns | None = Field(None, description='The rows in columnar form, if requested.')
 
 
 class SkaniJobStatusResponse(BaseModel):
@@ -313,3 +322,18 @@ class UtilSkaniJobResults(BaseModel):
 
     class Config:
         arbitrary_types_allowed = True
+
+
+class UtilSkaniJobSnapshot(BaseModel):
+    """A job, its parameters, genomes, and results (only if completed without error)."""
+    id: int
+    name: str
+    created: datetime
+    completed: datetime | None
+    error: bool | None
+    mode: SkaniCalculationMode | None
+    delete_after_ts: datetime | None
+    version: SkaniVersion
+    params: SkaniParameters
+    genomes: list[dict]
+    results: UtilSkaniJobResults | None
@@ -4,3 +4,37 @@ from pydantic import BaseModel, Field
 class StatusDbResponse(BaseModel):
     timeMs: float = Field(...)
     online: bool = Field(...)
+
+
+class StatusAnalyticsResponse(BaseModel):
+    running: bool = Field(...)
+    queued: int = Field(...)
+    sent: int = Field(...)
+    dropped: int = Field(...)
+    failed: int = Field(...)
+
+
+class StatusCacheResponse(BaseModel):
+    memoryItems: int = Field(...)
+    memoryBytes: int = Field(...)
+    memoryHits: int = Field(...)
+    diskHits: int = Field(...)
+    misses: int = Field(...)
+    writes: int = Field(...)
+    memoryEvictions: int = Field(...)
+    diskEvictions: int = Field(...)
+    inFlight: int = Field(...)
+    coalescedExecuted: int = Field(...)
+    coalescedShared: int = Field(...)
+
+
+class StatusIndexesResponse(BaseModel):
+    taxonTreeNodes: int | None = Field(..., description='number of nodes in the GTDB tree index, if loaded')
+    taxonTreeLoadedEpoch: int | None = Field(..., description='when the GTDB tree index was loaded')
+    taxonTreeBuildMs: float | None = Field(..., description='time taken to build the GTDB tree index')
+    taxonSearchTaxa: int | None = Field(..., description='number of taxa in the taxon search index, if loaded')
+    taxonSearchLoadedEpoch: int | None = Field(..., description='when the taxon search index was loaded')
+    taxonSearchBuildMs: float | None = Field(..., description='time taken to build the taxon search index')
+    taxonHistoryTaxa: int | None = Field(..., description='number of taxa in the taxon history index, if loaded')
+    taxonHistoryLoadedEpoch: int | None = Field(..., description='when the taxon history index was loaded')
+    taxonHistoryBuildMs: float | None = Field(..., description='time taken to build the taxon history index')
@@ -19,12 +19,14 @@ class TaxonomyCountResponse(BaseModel):
     """The response returned from the species cluster endpoint."""
     totalRows: int = Field(..., description='total number of rows in the query', example=1000)
     rows: List[TaxonomyCount] = Field(..., description='list of taxonomy counts')
+    nextCursor: Optional[str] = Field(None, description='cursor for the next page, if paging by cursor')
 
 
 class TaxonomyCountRequest(BaseModel):
     """The request send to the species cluster endpoint."""
     page: Optional[int] = Field(None, description='page number', example=1)
     itemsPerPage: Optional[int] = Field(None, description='number of items per page', example=10)
+    cursor: Optional[str] = Field(None, description='cursor from the previous page, or * for the first page (replaces page)')
     sortBy: Optional[List[str]] = Field(None, description='sort by', example=['d', 'p'])
     sortDesc: Optional[List[bool]] = Field(None, description='sort descending', example=[True, False])
     search: Optional[str] = Field(None, description='search string across all columns and rows', example='Escherichia')
@@ -0,0 +1,157 @@
+import asyncio
+
+import httpx
+from fastapi import Request
+
+from api.config import ENV_NAME, Env, ANALYTICS_URL, ANALYTICS_QUEUE_SIZE, ANALYTICS_BATCH_SIZE, \
+    ANALYTICS_FLUSH_INTERVAL, ANALYTICS_TIMEOUT
+
+
+def build_plausible_event(request: Request) -> tuple[dict, dict] | None:
+    """Create the headers and payload for a Plausible pageview event, or None if it should not be sent.
+    https://plausible.io/docs/events-api
+    """
+    if ENV_NAME is Env.PROD:
+        domain = 'gtdb-api.ecogenomic.org'
+    elif ENV_NAME is Env.DEV:
+        domain = 'gtdb-api-dev.ecogenomic.org'
+    else:
+        return None
+
+    x_forwarded_for = request.headers.get('x-forwarded-for')
+    if x_forwarded_for is None:
+        print('Unable to determine IP address for plausible analytics.')
+        return None
+
+    headers = {
+        'User-Agent': request.headers.get('user-agent') or '',
+        'X-Forwarded-For': x_forwarded_for,
+        'Content-Type': 'application/json'
+    }
+    data = {
+        'name': 'pageview',
+        'url': f'https://{domain}{request.get("path", "")}',
+        'domain': domain,
+        'props': {
+            'method': request.method
+        }
+    }
+    return headers, data
+
+
+class AnalyticsDispatcher:
+    """Sends analytics events in the background so that requests never wait on them.
+
+    Events are placed on a bounded queue and are dropped if the queue is full.
+    A single worker drains the queue in batches, sending each batch concurrently
+    over a shared connection pool.
+    """
+
+    def __init__(self, url: str, max_queue_size: int, batch_size: int, flush_interval: float, timeout: float):
+        self.url = url
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+
+        self.n_sent = 0
+        self.n_dropped = 0
+        self.n_failed = 0
+
+        self._queue: asyncio.Queue | None = None
+        self._client: httpx.AsyncClient | None = None
+        self._worker: asyncio.Task | None = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def enqueue(self, event: tuple[dict, dict] | None) -> bool:
+        """Add an event to the queue without blocking, returns False if it was dropped."""
+        if event is None:
+            return False
+        if not self.is_running:
+            self.n_dropped += 1
+            return False
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            self.n_dropped += 1
+            return False
+
+    async def start(self):
+        if self.is_running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.batch_size, max_keepalive_connections=self.batch_size)
+        )
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the worker, attempting to send any events that remain in the queue."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._queue is not None:
+            remaining = list()
+            while not self._queue.empty():
+                remaining.append(self._queue.get_nowait())
+            if remaining:
+                await self._send_batch(remaining)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _next_batch(self) -> list[tuple[dict, dict]]:
+        """Wait for at least one event, then collect up to the batch size within the flush interval."""
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _send_one(self, headers: dict, data: dict):
+        try:
+            r = await self._client.post(self.url, headers=headers, json=data)
+            r.raise_for_status()
+            self.n_sent += 1
+        except Exception as e:
+            self.n_failed += 1
+            print(f'Unable to send to plausible: {e}')
+
+    async def _send_batch(self, batch: list[tuple[dict, dict]]):
+        # The Plausible events API accepts a single event per request, so a
+        # batch is sent as concurrent requests over the pooled client.
+        await asyncio.gather(*[self._send_one(headers, data) for headers, data in batch])
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            await self._send_batch(batch)
+
+
+analytics = AnalyticsDispatcher(
+    url=ANALYTICS_URL,
+    max_queue_size=ANALYTICS_QUEUE_SIZE,
+    batch_size=ANALYTICS_BATCH_SIZE,
+    flush_interval=ANALYTICS_FLUSH_INTERVAL,
+    timeout=ANALYTICS_TIMEOUT
+)
@@ -0,0 +1,89 @@
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Iterable
+
+# Separates names in the substring search blob, this cannot appear in a search
+BLOB_SEPARATOR = '\0'
+
+
+class SubstringIndex:
+    """Finds the keys containing a substring, by scanning a single string of all keys (using str.find).
+
+    Each hit is mapped back to the index of its key using the offset of each key,
+    and the scan continues from the next key, so keys are returned once and in order.
+    """
+
+    def __init__(self, keys: list[str]):
+        self.blob = BLOB_SEPARATOR.join(keys)
+        self.offsets = array('Q')
+        offset = 0
+        for key in keys:
+            self.offsets.append(offset)
+            offset += len(key) + len(BLOB_SEPARATOR)
+
+    def find(self, query: str, limit: int | None = None) -> list[int]:
+        """Returns the indices of the keys containing the query (up to limit, if set)."""
+        if BLOB_SEPARATOR in query:
+            return list()
+        out = list()
+        pos = self.blob.find(query)
+        while pos != -1 and (limit is None or len(out) < limit):
+            idx = bisect_right(self.offsets, pos) - 1
+            out.append(idx)
+            if idx + 1 == len(self.offsets):
+                break
+            pos = self.blob.find(query, self.offsets[idx + 1])
+        return out
+
+
+class RankAutocomplete:
+    """Case-insensitive prefix and substring search over the distinct names of a single rank.
+
+    Names are sorted by their lowercase form, prefix searches bisect the sorted keys.
+    """
+
+    def __init__(self, names: Iterable[str]):
+        pairs = sorted((x.lower(), x) for x in set(names) if x)
+        self.keys = [x[0] for x in pairs]
+        self.names = [x[1] for x in pairs]
+        self.substrings = SubstringIndex(self.keys)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def prefix(self, query: str, limit: int) -> list[str]:
+        query = query.lower()
+        out = list()
+        idx = bisect_left(self.keys, query)
+        while idx < len(self.keys) and len(out) < limit and self.keys[idx].startswith(query):
+            out.append(self.names[idx])
+            idx += 1
+        return out
+
+    def substring(self, query: str, limit: int) -> list[str]:
+        return [self.names[x] for x in self.substrings.find(query.lower(), limit)]
+
+
+class TaxonAutocompleteIndex:
+    """Autocomplete over the taxa of each rank, names are stored without the rank prefix (e.g. d__)."""
+
+    def __init__(self, d_prefix_to_names: dict[str, Iterable[str]]):
+        start = time.monotonic()
+        self.ranks = {prefix: RankAutocomplete(names) for prefix, names in d_prefix_to_names.items()}
+        self.created = time.time()
+        self.build_ms = (time.monotonic() - start) * 1000
+
+    def __len__(self) -> int:
+        return sum(len(x) for x in self.ranks.values())
+
+    def search_rank(self, prefix: str, query: str, limit: int) -> list[str]:
+        """Taxa of this rank starting with the query (case-insensitive), e.g. ('g__', 'esch')."""
+        return [f'{prefix}{x}' for x in self.ranks[prefix].prefix(query, limit)]
+
+    def search_all(self, query: str, limit: int) -> list[str]:
+        """Taxa of any rank containing the query (case-insensitive), limited to this many per rank."""
+        out = list()
+        for prefix, rank in self.ranks.items():
+            out.extend(f'{prefix}{x}' for x in rank.substring(query, limit))
+        return out
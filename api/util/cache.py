@@ -1,15 +1,27 @@
+import asyncio
+import contextlib
 import functools
 import hashlib
-import pickle
+import io
+import json
 import re
-import time
+import struct
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Callable, Tuple
-import io
-from fastapi import Request
+from typing import Any, Awaitable, Callable, Tuple
 
-from api.config import CACHE_DIR
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from api.config import CACHE_DIR, CACHE_MEMORY_MAX_MB, CACHE_MEMORY_MAX_ITEM_MB, CACHE_DISK_MAX_GB, CURRENT_RELEASE, \
+    GTDB_DB_NAME, GTDB_WEB_DB_NAME
 from api.exceptions import HttpBaseException
+from api.util.cache_store import CacheStats, MemoryCache, DiskCache
+from api.util.singleflight import SingleFlight
 
 RE_UNSAFE_CHARACTERS = re.compile(r'[\\/*?:"<>|]')
 
@@ -25,6 +37,11 @@ def md5_string(s: str, buffer_size: int = 8192) -> str:
         hash_object.update(chunk)
     return hash_object.hexdigest()
 
+
+# Cached entries are only valid for the release (and databases) they were generated from
+CACHE_NAMESPACE = escape_for_disk(f'{CURRENT_RELEASE}__{GTDB_DB_NAME}__{GTDB_WEB_DB_NAME}')
+
+
 def get_cache_key_from_request(request: Request) -> Tuple[str, str, str | None]:
     """
     Generate a unique cache key for the request based on the request.
@@ -39,21 +56,157 @@ def get_cache_key_from_request(request: Request) -> Tuple[str, str, str | None]:
     return method, path, query
 
 
+def get_cache_key_str_from_request(request: Request) -> str:
+    method, path, query = get_cache_key_from_request(request)
+    return f'{CACHE_NAMESPACE}__{method}__{path}__{query}'
+
+
 def get_cache_path_from_request(request: Request) -> Path | None:
     if not CACHE_DIR:
         return None
-    method, path, query = get_cache_key_from_request(request)
+    key = get_cache_key_str_from_request(request)
 
     # Generate the hash for the full request
-    key = f'{method}__{path}__{query}'
     md5 = md5_string(key)
 
     # Get the parent directory to store the cached file
-    root_dir = CACHE_DIR / md5[0:2] / md5[2:4] / md5[4:6]
-    file_path = root_dir / f'{escape_for_disk(key)}__{md5}.pkl'
+    root_dir = CACHE_DIR / CACHE_NAMESPACE / md5[0:2] / md5[2:4] / md5[4:6]
+    file_path = root_dir / f'{escape_for_disk(key)}__{md5}.cache'
     return file_path
 
 
+# Shared cache state for this process
+CACHE_STATS = CacheStats()
+MEMORY_CACHE = MemoryCache(
+    max_bytes=CACHE_MEMORY_MAX_MB * 1024 * 1024,
+    max_item_bytes=CACHE_MEMORY_MAX_ITEM_MB * 1024 * 1024,
+    stats=CACHE_STATS
+)
+DISK_CACHE = DiskCache(
+    root=CACHE_DIR,
+    max_bytes=int(CACHE_DISK_MAX_GB * 1024 * 1024 * 1024),
+    stats=CACHE_STATS
+) if CACHE_DIR else None
+
+# Concurrent identical requests share a single computation
+SINGLE_FLIGHT = SingleFlight()
+
+# Entries are stored as a 2-byte status code, followed by the JSON body
+ENTRY_HEADER = struct.Struct('>H')
+
+
+def encode_cache_entry(result: Any) -> bytes:
+    """Serialise an endpoint result (or client error) into the bytes stored in the cache."""
+    if isinstance(result, HttpBaseException):
+        status_code, content = result.status_code, result.detail
+    else:
+        status_code, content = 200, result
+    body = json.dumps(jsonable_encoder(content), separators=(',', ':')).encode('utf-8')
+    return ENTRY_HEADER.pack(status_code) + body
+
+
+def decode_cache_entry(entry: bytes) -> tuple[int, bytes]:
+    """Returns the status code and the JSON body of a cached entry."""
+    status_code, = ENTRY_HEADER.unpack_from(entry)
+    return status_code, entry[ENTRY_HEADER.size:]
+
+
+def cache_entry_to_response(entry: bytes, ttl: int, age: int) -> Response:
+    """Return the cached entry as a response, or raise it if it was an error."""
+    status_code, body = decode_cache_entry(entry)
+    if status_code != 200:
+        exc = HttpBaseException(status_code=status_code, detail=json.loads(body))
+        exc.headers = {
+            'Cache-Control': 'max-age=60, must-revalidate, proxy-revalidate',
+            'X-API-Cached': 'true',
+            'X-API-Age': str(age)
+        }
+        raise exc
+    return Response(
+        content=body,
+        media_type='application/json',
+        headers={
+            'Cache-Control': f'max-age={ttl}, must-revalidate, proxy-revalidate',
+            'X-API-Cached': 'true',
+            'X-API-Age': str(age)
+        }
+    )
+
+
+async def cache_get(key: str, path: Path, ttl: int) -> tuple[int, bytes] | None:
+    """Return the age and entry from the memory cache, falling back to disk."""
+    hit = MEMORY_CACHE.get(key, ttl)
+    if hit is not None:
+        CACHE_STATS.memory_hits += 1
+        return hit
+    hit = await asyncio.to_thread(DISK_CACHE.read, path, ttl)
+    if hit is not None:
+        age, mtime, entry = hit
+        CACHE_STATS.disk_hits += 1
+        MEMORY_CACHE.set(key, entry, created=mtime)
+        return age, entry
+    CACHE_STATS.misses += 1
+    return None
+
+
+async def cache_set(key: str, path: Path, entry: bytes):
+    MEMORY_CACHE.set(key, entry)
+    try:
+        await asyncio.to_thread(DISK_CACHE.write, path, entry)
+    except OSError as e:
+        print(f'Unable to write cache entry to disk: {e}')
+
+
+@dataclass(frozen=True)
+class SharedResponse:
+    """A response created by an endpoint, as plain data so each request is sent its own Response."""
+    status_code: int
+    raw_headers: tuple[tuple[bytes, bytes], ...]
+    body: bytes
+
+    @classmethod
+    def from_response(cls, response: Response) -> 'SharedResponse':
+        # The body of a stream is generated while it is sent, after the computation (and its sessions) have finished
+        if isinstance(response, StreamingResponse):
+            raise TypeError('Streamed responses cannot be shared between requests.')
+        return cls(response.status_code, tuple(response.raw_headers), bytes(response.body))
+
+    def to_response(self) -> Response:
+        response = Response(content=self.body, status_code=self.status_code)
+        response.raw_headers = list(self.raw_headers)
+        return response
+
+
+def with_own_sessions(func: Callable, args: tuple, kwargs: dict) -> Callable[[], Awaitable[Any]]:
+    """Returns a call to the endpoint that uses new database sessions, on the same engines as those passed to it.
+
+    The sessions passed to an endpoint are closed once its request is finished,
+    so they cannot be used by a computation that is shared with other requests
+    (which continues if the request that started it is cancelled).
+    """
+
+    def call_sync():
+        with contextlib.ExitStack() as stack:
+            own_kwargs = {k: stack.enter_context(type(v)(v.bind)) if isinstance(v, Session) else v
+                          for k, v in kwargs.items()}
+            return func(*args, **own_kwargs)
+
+    async def call():
+        if not asyncio.iscoroutinefunction(func):
+            return await run_in_threadpool(call_sync)
+        async with contextlib.AsyncExitStack() as stack:
+            own_kwargs = dict()
+            for k, v in kwargs.items():
+                if isinstance(v, AsyncSession):
+                    v = await stack.enter_async_context(type(v)(v.bind))
+                elif isinstance(v, Session):
+                    v = stack.enter_context(type(v)(v.bind))
+                own_kwargs[k] = v
+            return await func(*args, **own_kwargs)
+
+    return call
+
+
 def cached(ttl: int, disk: bool = False) -> Callable:
     # For ttl values less than 0, we want to use the maximum value (1 year)
     if ttl < 0:
@@ -85,63 +238,72 @@ def cached(ttl: int, disk: bool = False) -> Callable:
             if not cache_path:
                 print(f'Warning: CACHE_DIR not set in .env')
                 return await func(*args, **kwargs)
+            cache_key = get_cache_key_str_from_request(request)
+
+            # Check if the result already exists and is still valid
+            hit = await cache_get(cache_key, cache_path, ttl)
+            if hit is not None:
+                age, entry = hit
+                return cache_entry_to_response(entry, ttl, age)
+
+            # Otherwise, run the endpoint (once for all concurrent identical requests)
+            call = with_own_sessions(func, args, kwargs)
 
-            # Check if the result already exists
-            if cache_path.exists():
-
-                # Check the age
-                file_age = int(time.time() - cache_path.stat().st_ctime)
-
-                # The cache is still valid
-                if file_age < ttl:
-                    with cache_path.open('rb') as f:
-                        result = pickle.load(f)
-
-                    # Either raise or return based on the type of result
-                    if isinstance(result, HttpBaseException):
-                        result.headers = {
-                            'Cache-Control': 'max-age=60, must-revalidate, proxy-revalidate',
-                            'X-API-Cached': 'true',
-                            'X-API-Age': str(file_age)
-                        }
-                        raise result
+            async def compute() -> Any:
+                try:
+                    result = await call()
+                except Exception as e:
+                    if isinstance(e, HttpBaseException) and e.status_code < 500:
+                        result = e
                     else:
-                        # Update the response headers with the max-age cache control
-                        response.headers["Cache-Control"] = f'max-age={ttl}, must-revalidate, proxy-revalidate'
-                        response.headers["X-API-Cached"] = 'true'
-                        response.headers["X-API-Age"] = str(file_age)
-
-                        return result
-
-            # Otherwise, run the endpoint
-            try:
-                result = await func(*args, **kwargs)
-            except Exception as e:
-                if isinstance(e, HttpBaseException) and e.status_code < 500:
-                    result = e
-                else:
-                    raise
-
-            # Write the result to disk
-            cache_path.parent.mkdir(exist_ok=True, parents=True)
-            with cache_path.open('wb') as f:
-                pickle.dump(result, f)
-
-            # Either return or raise depending on the result status code
-            if isinstance(result, HttpBaseException):
-                result.headers = {
-                    'Cache-Control': 'max-age=60, must-revalidate, proxy-revalidate',
-                    'X-API-Cached': 'true',
-                    'X-API-Age': '0'
-                }
-                raise result
-            else:
-                # Update the response headers with the max-age cache control
-                response.headers["Cache-Control"] = f'max-age={ttl}, must-revalidate, proxy-revalidate'
-                response.headers["X-API-Cached"] = 'true'
-                response.headers["X-API-Age"] = '0'
-                return result
+                        raise
+
+                # Responses created by the endpoint are not cached
+                if isinstance(result, Response):
+                    return SharedResponse.from_response(result)
+
+                # Store the serialised result
+                computed_entry = encode_cache_entry(result)
+                await cache_set(cache_key, cache_path, computed_entry)
+                return computed_entry
+
+            entry = await SINGLE_FLIGHT.do(get_cache_key_from_request(request), compute)
+            if isinstance(entry, SharedResponse):
+                return entry.to_response()
+            return cache_entry_to_response(entry, ttl, 0)
 
         return func_wrapper
 
     return decorator
+
+
+def coalesced(func: Callable) -> Callable:
+    """Share the result of an endpoint between concurrent identical requests.
+
+    The endpoint must accept the request as a keyword argument, and must not
+    return a streamed response. The endpoint is run with its own database
+    sessions (see with_own_sessions), and only its JSON compatible result is
+    shared. Synchronous endpoints are run in the threadpool, as FastAPI would.
+    """
+
+    @functools.wraps(func)
+    async def func_wrapper(*args: tuple[Any], **kwargs: dict[str, Any]) -> Any:
+        call = with_own_sessions(func, args, kwargs)
+
+        async def compute() -> Any:
+            result = await call()
+            if isinstance(result, Response):
+                return SharedResponse.from_response(result)
+            return jsonable_encoder(result)
+
+        request = kwargs.get('request')
+        if not request:
+            print(f'Warning: Call made to a coalesced method without request being set.')
+            result = await compute()
+        else:
+            result = await SINGLE_FLIGHT.do(get_cache_key_from_request(request), compute)
+        if isinstance(result, SharedResponse):
+            return result.to_response()
+        return result
+
+    return func_wrapper
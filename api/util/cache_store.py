@@ -0,0 +1,218 @@
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+
+@dataclass
+class CacheStats:
+    """Counters describing the performance of the response cache."""
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    writes: int = 0
+    memory_evictions: int = 0
+    disk_evictions: int = 0
+
+
+class MemoryCache:
+    """A least-recently-used cache of serialised values, bounded by the total number of bytes stored.
+
+    This is not thread-safe and is expected to only be accessed from the event loop.
+    """
+
+    def __init__(self, max_bytes: int, max_item_bytes: int, stats: CacheStats | None = None):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.stats = stats or CacheStats()
+        self.n_bytes = 0
+        self._items: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._items
+
+    def get(self, key: str, ttl: int) -> tuple[int, bytes] | None:
+        """Return the age (seconds) and value if present and younger than ttl."""
+        item = self._items.get(key)
+        if item is None:
+            return None
+        created, value = item
+        age = int(time.time() - created)
+        if age >= ttl:
+            self.pop(key)
+            return None
+        self._items.move_to_end(key)
+        return age, value
+
+    def set(self, key: str, value: bytes, created: float | None = None) -> bool:
+        """Store a value, returns False if it is too large to be held in memory."""
+        if len(value) > self.max_item_bytes or len(value) > self.max_bytes:
+            return False
+        self.pop(key)
+        self._items[key] = (created if created is not None else time.time(), value)
+        self.n_bytes += len(value)
+        while self.n_bytes > self.max_bytes:
+            _, (_, evicted) = self._items.popitem(last=False)
+            self.n_bytes -= len(evicted)
+            self.stats.memory_evictions += 1
+        return True
+
+    def pop(self, key: str):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.n_bytes -= len(item[1])
+
+    def clear(self):
+        self._items.clear()
+        self.n_bytes = 0
+
+
+class LruCache:
+    """A least-recently-used cache of objects, bounded by the number of items stored.
+
+    Values are not copied, so they must not be modified once set. This is shared
+    between the event loop and threadpool (sync endpoints), so it is locked.
+    """
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._items: OrderedDict[str, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._items
+
+    def get(self, key: str) -> Any | None:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def pop(self, key: str):
+        with self._lock:
+            self._items.pop(key, None)
+
+
+class ExpiringValue:
+    """A single value that is recomputed once it is older than the ttl (seconds).
+
+    This is shared between threads, only one thread recomputes the value and any
+    others wait for it, rather than all recomputing it at the same time.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._value: Any = None
+        self._created: float | None = None
+        self._lock = threading.Lock()
+
+    def get(self, compute: Callable[[], Any]) -> Any:
+        with self._lock:
+            if self._created is None or time.monotonic() - self._created >= self.ttl:
+                self._value = compute()
+                self._created = time.monotonic()
+            return self._value
+
+    def clear(self):
+        with self._lock:
+            self._value, self._created = None, None
+
+
+class DiskCache:
+    """Stores serialised values on disk, bounded by the total size of the directory.
+
+    All methods perform blocking I/O and should be called from a worker thread.
+    Writes go to a temporary file that is renamed into place, so concurrent readers
+    (including other processes) never see a partially written file.
+    """
+
+    # Fraction of max_bytes to reduce the cache to once it is exceeded
+    LOW_WATER_MARK = 0.9
+
+    def __init__(self, root: Path, max_bytes: int, stats: CacheStats | None = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.stats = stats or CacheStats()
+        self._approx_bytes: int | None = None
+
+    def read(self, path: Path, ttl: int) -> tuple[int, float, bytes] | None:
+        """Return the age (seconds), modification time, and value if present and younger than ttl."""
+        try:
+            mtime = path.stat().st_mtime
+            age = int(time.time() - mtime)
+            if age >= ttl:
+                return None
+            with path.open('rb') as f:
+                return age, mtime, f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, path: Path, value: bytes):
+        path.parent.mkdir(exist_ok=True, parents=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp_')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        self.stats.writes += 1
+
+        # Track the approximate size and only walk the directory when it may be full
+        if self._approx_bytes is None:
+            self._approx_bytes = self.size()
+        else:
+            self._approx_bytes += len(value)
+        if self._approx_bytes > self.max_bytes:
+            self.evict()
+
+    def _iter_files(self):
+        for dir_path, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                file_path = os.path.join(dir_path, file_name)
+                try:
+                    st = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                yield file_path, st.st_mtime, st.st_size
+
+    def size(self) -> int:
+        return sum(x[2] for x in self._iter_files())
+
+    def evict(self):
+        """Remove the oldest files until the cache is below the low water mark."""
+        files = sorted(self._iter_files(), key=lambda x: x[1])
+        total = sum(x[2] for x in files)
+        target = int(self.max_bytes * self.LOW_WATER_MARK)
+        for file_path, _, file_size in files:
+            if total <= target:
+                break
+            try:
+                os.unlink(file_path)
+                self.stats.disk_evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= file_size
+        self._approx_bytes = total
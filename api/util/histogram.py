@@ -0,0 +1,39 @@
+import math
+
+import numpy as np
+
+# GC% histograms are precomputed at this resolution (percent), then merged into wider bins when requested
+GC_HISTOGRAM_RESOLUTION = 0.1
+
+
+def rebin_fixed_histogram(counts: list[int], start: int, resolution: float) -> tuple[np.ndarray, np.ndarray]:
+    """Merge a fixed-resolution histogram into wider bins, returning the counts and bin edges.
+
+    The value of counts[i] is the number of values in [(start + i) * resolution, (start + i + 1) * resolution).
+    The bin width approximates np.histogram(bins='auto'), i.e. the smaller of the Sturges and
+    Freedman-Diaconis estimates (with the interquartile range taken from the counts),
+    rounded up to a multiple of the resolution.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    non_zero = np.flatnonzero(counts)
+    if len(non_zero) == 0:
+        raise ValueError('The histogram is empty.')
+    start += int(non_zero[0])
+    counts = counts[non_zero[0]:non_zero[-1] + 1]
+    n = int(counts.sum())
+
+    # Estimate the bin width
+    width = len(counts) * resolution / (math.log2(n) + 1.0)
+    cumulative = np.cumsum(counts)
+    iqr = (np.searchsorted(cumulative, 0.75 * n) - np.searchsorted(cumulative, 0.25 * n)) * resolution
+    if iqr > 0:
+        width = min(width, 2.0 * iqr * n ** (-1 / 3))
+    step = max(1, math.ceil(round(width / resolution, 6)))
+
+    # Sum each group of step bins (padding the last)
+    n_bins = math.ceil(len(counts) / step)
+    padded = np.zeros(n_bins * step, dtype=np.int64)
+    padded[:len(counts)] = counts
+    out = padded.reshape(n_bins, step).sum(axis=1)
+    bin_edges = np.round((start + np.arange(n_bins + 1) * step) * resolution, 6)
+    return out, bin_edges
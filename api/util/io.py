@@ -1,11 +1,23 @@
+import asyncio
+import codecs
 import csv
 import hashlib
 import io
+import os
+import tempfile
+import zlib
+from pathlib import Path
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, Sequence
 
+import numpy as np
 from fastapi import UploadFile
+from fastapi.responses import Response, StreamingResponse
 
 from api.exceptions import HttpBadRequest
 
+# The media type of the binary (NumPy .npz) response format
+NPZ_MEDIA_TYPE = 'application/x-npz'
+
 
 def sizeof_fmt(num: float, suffix='B') -> str:
     """Convert bytes to human-readable units.
@@ -30,6 +42,121 @@ def rows_to_delim(rows: list, delim: str = ',') -> str:
     return output.getvalue()
 
 
+def iter_delim(rows: Iterable[Sequence], delim: str = ',', chunk_rows: int = 1000) -> Iterator[str]:
+    """Converts rows to delimited text, yielding a chunk every chunk_rows rows."""
+    output = io.StringIO()
+    writer = csv.writer(output, quoting=csv.QUOTE_MINIMAL, delimiter=delim)
+    n_rows = 0
+    for row in rows:
+        writer.writerow(row)
+        n_rows += 1
+        if n_rows == chunk_rows:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+            n_rows = 0
+    if n_rows > 0:
+        yield output.getvalue()
+
+
+async def aiter_delim(rows: AsyncIterable[Sequence], delim: str = ',', chunk_rows: int = 1000) -> AsyncIterator[str]:
+    """Converts rows to delimited text, yielding a chunk every chunk_rows rows."""
+    output = io.StringIO()
+    writer = csv.writer(output, quoting=csv.QUOTE_MINIMAL, delimiter=delim)
+    n_rows = 0
+    async for row in rows:
+        writer.writerow(row)
+        n_rows += 1
+        if n_rows == chunk_rows:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+            n_rows = 0
+    if n_rows > 0:
+        yield output.getvalue()
+
+
+def iter_gzip(chunks: Iterable[str]) -> Iterator[bytes]:
+    """Compresses text chunks into a gzip stream."""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def aiter_gzip(chunks: AsyncIterable[str]) -> AsyncIterator[bytes]:
+    """Compresses text chunks into a gzip stream."""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def delim_download_response(rows: Iterable[Sequence] | AsyncIterable[Sequence], delim: str, filename: str,
+                            gzip: bool = False) -> StreamingResponse:
+    """Streams rows as a delimited file attachment, optionally gzip compressed.
+
+    Rows are encoded as they are consumed, so the rows should be generated lazily
+    (e.g. from a server-side cursor) to keep memory usage constant.
+    """
+    if isinstance(rows, AsyncIterable):
+        content = aiter_delim(rows, delim=delim)
+        if gzip:
+            content = aiter_gzip(content)
+    else:
+        content = iter_delim(rows, delim=delim)
+        if gzip:
+            content = iter_gzip(content)
+
+    if gzip:
+        response = StreamingResponse(content, media_type='application/gzip')
+        filename = f'{filename}.gz'
+    else:
+        response = StreamingResponse(content, media_type='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+
+def scale_to_int16(arr, scale: int = 100) -> np.ndarray:
+    """Converts values with two decimal places (e.g. ANI/AF percentages) to int16, multiplied by the scale."""
+    return np.rint(np.asarray(arr, dtype=float) * scale).astype(np.int16)
+
+
+def arrays_to_npz(arrays: dict) -> bytes:
+    """Writes each value as an array in an (uncompressed) .npz archive, keyed by name.
+
+    Lists (and object arrays) are assumed to be strings, these are stored as
+    fixed-width unicode arrays so the archive can be read without enabling pickle.
+    """
+    out = dict()
+    for key, value in arrays.items():
+        if isinstance(value, list) or (isinstance(value, np.ndarray) and value.dtype == object):
+            value = np.asarray(value, dtype=str)
+        out[key] = np.asarray(value)
+    buffer = io.BytesIO()
+    np.savez(buffer, **out)
+    return buffer.getvalue()
+
+
+def npz_response(content: bytes, filename: str) -> Response:
+    """Returns an .npz archive created by arrays_to_npz."""
+    response = Response(content=content, media_type=NPZ_MEDIA_TYPE)
+    response.headers['Content-Disposition'] = f'inline; filename={filename}'
+    response.headers['Vary'] = 'Accept'
+    return response
+
+
+def accepts_npz(accept: str | None, fmt: str | None) -> bool:
+    """True if the client requested the .npz format, either by query parameter or the Accept header."""
+    if fmt is not None:
+        return fmt == 'npz'
+    return accept is not None and NPZ_MEDIA_TYPE in accept
+
+
 def string_size_in_mb(string: str) -> float:
     """Converts a string to a size in MB."""
     return len(string.encode('utf-8')) / (1024 * 1024)
@@ -40,20 +167,22 @@ def sha256(string: str) -> str:
     return hashlib.sha256(string.encode('utf-8')).hexdigest()
 
 
-async def read_upload_file_bytes_limit(uploaded_file: UploadFile, bytes_limit: int) -> str:
+async def read_upload_file_bytes_limit(uploaded_file: UploadFile, bytes_limit: int) -> tuple[str, str]:
     """Read an UploadFile and throw an error if it exceeds the byte limit. Also output the sha256 hash."""
     total_bytes = 0
     contents = bytearray()
+    hash_object = hashlib.sha256()
     chunk_size = 1024 * 1024  # 1 MB
     while True:
         chunk = await uploaded_file.read(chunk_size)
         if not chunk:
             break
         contents.extend(chunk)
+        hash_object.update(chunk)
         total_bytes += len(chunk)
         if total_bytes > bytes_limit:
             raise HttpBadRequest(f'File {uploaded_file.filename} exceeds the size limit of {sizeof_fmt(bytes_limit)}.')
-    return contents.decode('utf-8')
+    return contents.decode('utf-8'), hash_object.hexdigest()
 
 
 def iter_triangle(values: list, diagonal: bool = True):
@@ -63,3 +192,63 @@ def iter_triangle(values: list, diagonal: bool = True):
     for i in range(n):
         for j in range(i+offset, n):
             yield values[i], values[j]
+
+
+# Files in a content-addressed store that have not been added yet (see spool_upload_file_gzip)
+CONTENT_STORE_TMP_PREFIX = '.tmp_'
+
+
+def content_addressed_path(root: Path, sha256_hex: str, suffix: str = '.fna.gz') -> Path:
+    """The path of a file in a content-addressed store, nested by the hash to keep directories small."""
+    return root / sha256_hex[0:2] / sha256_hex[2:4] / f'{sha256_hex}{suffix}'
+
+
+async def spool_upload_file_gzip(uploaded_file: UploadFile, bytes_limit: int, root: Path) -> tuple[str, Path]:
+    """Stream an UploadFile (UTF-8 text) into a gzip compressed temporary file, returning its sha256 hash and path.
+
+    The hash is of the uncompressed content. The temporary file is in root, and
+    is either added to the store with add_to_content_addressed_store, or removed
+    by the caller. Throws an error if the content exceeds the byte limit, or is
+    not UTF-8 (UnicodeDecodeError).
+    """
+    total_bytes = 0
+    hash_object = hashlib.sha256()
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    chunk_size = 1024 * 1024  # 1 MB
+
+    # Compression and disk I/O are done in a worker thread
+    def write_chunk(f, chunk: bytes):
+        decoder.decode(chunk, final=not chunk)
+        f.write(compressor.compress(chunk) if chunk else compressor.flush())
+
+    root.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=root, prefix=CONTENT_STORE_TMP_PREFIX)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = await uploaded_file.read(chunk_size)
+                total_bytes += len(chunk)
+                if total_bytes > bytes_limit:
+                    raise HttpBadRequest(
+                        f'File {uploaded_file.filename} exceeds the size limit of {sizeof_fmt(bytes_limit)}.'
+                    )
+                hash_object.update(chunk)
+                await asyncio.to_thread(write_chunk, f, chunk)
+                if not chunk:
+                    break
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return hash_object.hexdigest(), Path(tmp_path)
+
+
+def add_to_content_addressed_store(tmp_path: Path, root: Path, sha256_hex: str) -> Path:
+    """Move a spooled file into the store, the file is only written once for identical content."""
+    path = content_addressed_path(root, sha256_hex)
+    if path.exists():
+        tmp_path.unlink()
+    else:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, path)
+    return path
@@ -1,4 +1,13 @@
-from scipy.cluster.hierarchy import linkage, dendrogram
+import numpy as np
+from scipy.cluster.hierarchy import dendrogram, leaves_list, linkage
+from scipy.spatial.distance import pdist, squareform
+
+from api.config import ANI_HEATMAP_OPTIMAL_ORDERING_MAX_GENOMES
+
+
+# Identifies the clustering done by cluster_leaves (with the default arguments), this must
+# be changed whenever the leaf order it returns would change, as the order is stored
+CLUSTER_LEAVES_METHOD = f'average-v2-optimal{ANI_HEATMAP_OPTIMAL_ORDERING_MAX_GENOMES}'
 
 
 def cluster_matrix(arr, method='average'):
@@ -14,3 +23,47 @@ def cluster_matrix(arr, method='average'):
     arr = arr[:, dendro_x['leaves']]
 
     return arr, dendro_x, dendro_y
+
+
+def similarity_to_condensed_distance(arr: np.ndarray, max_value: float = 100) -> np.ndarray:
+    """Converts a square similarity matrix (e.g. ANI or AF) to a condensed distance matrix (max_value - similarity).
+
+    Each pair is averaged with its mirror (AF is not symmetric), and the diagonal is ignored.
+    """
+    arr = np.asarray(arr, dtype=float)
+    distance = max_value - (arr + arr.T) / 2
+    np.clip(distance, 0, None, out=distance)
+    return squareform(distance, checks=False)
+
+
+def cluster_condensed_leaves(condensed: np.ndarray, n: int, method: str = 'average',
+                             optimal_ordering_max_size: int = ANI_HEATMAP_OPTIMAL_ORDERING_MAX_GENOMES) -> list[int]:
+    """Returns the dendrogram leaf order of the n observations in the condensed distance matrix.
+
+    Raises a ValueError if the distances are not finite.
+    """
+    # do not use  ‘centroid’, ‘median’, and ‘ward’
+    if n < 2:
+        return list(range(n))
+    linkage_arr = linkage(condensed, method, optimal_ordering=n <= optimal_ordering_max_size)
+    return leaves_list(linkage_arr).tolist()
+
+
+def cluster_leaves(arr: np.ndarray, symmetric: bool = False, method: str = 'average',
+                   optimal_ordering_max_size: int = ANI_HEATMAP_OPTIMAL_ORDERING_MAX_GENOMES
+                   ) -> tuple[list[int], list[int]]:
+    """Returns the dendrogram leaf order of the columns (x) and rows (y) of a matrix.
+
+    If the rows and columns are the same genomes (symmetric), the distance is taken
+    directly from the similarity values and one clustering is used for both axes.
+    Otherwise, each axis is clustered by the Euclidean distance between its vectors.
+    """
+    arr = np.asarray(arr, dtype=float)
+    if symmetric:
+        leaves = cluster_condensed_leaves(similarity_to_condensed_distance(arr), arr.shape[0], method,
+                                          optimal_ordering_max_size)
+        return leaves, leaves
+
+    y_leaves = cluster_condensed_leaves(pdist(arr), arr.shape[0], method, optimal_ordering_max_size)
+    x_leaves = cluster_condensed_leaves(pdist(arr.T), arr.shape[1], method, optimal_ordering_max_size)
+    return x_leaves, y_leaves
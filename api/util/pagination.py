@@ -0,0 +1,104 @@
+import base64
+import json
+from typing import Any, Sequence
+
+import sqlmodel as sm
+from sqlalchemy.dialects import postgresql
+
+from api.exceptions import HttpBadRequest
+from api.util.cache_store import LruCache
+
+# Clients start paging through results in cursor mode by requesting this cursor
+CURSOR_START = '*'
+
+# Number of rows fetched at a time from a server-side cursor when streaming all results
+STREAM_YIELD_PER = 2000
+
+# Maximum number of distinct queries to remember the total number of rows for
+COUNT_CACHE_MAX_ITEMS = 10000
+
+
+def encode_cursor(values: Sequence[Any], total_rows: int) -> str:
+    """Encode the sort key of the last row in a page as an opaque token.
+
+    The total number of rows is carried forward so that it is only computed for the first page.
+    """
+    payload = json.dumps({'k': list(values), 't': total_rows}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, n_values: int) -> tuple[list[Any], int]:
+    """Decode a cursor created by encode_cursor, returning the sort key and total number of rows."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        values, total_rows = payload['k'], int(payload['t'])
+    except Exception:
+        raise HttpBadRequest('Malformed cursor.')
+    if not isinstance(values, list) or len(values) != n_values:
+        raise HttpBadRequest('The cursor does not match the sort order of this query.')
+    return values, total_rows
+
+
+def keyset_after(columns: Sequence[tuple[Any, bool]], values: Sequence[Any]):
+    """Create a predicate that selects the rows that follow the sort key values.
+
+    The columns are (column, descending) pairs, in the same order as the ORDER BY
+    clause, and must end with a unique column. This follows the default PostgreSQL
+    NULL ordering (NULLS LAST when ascending, and NULLS FIRST when descending).
+    """
+    conditions = list()
+    for i, ((column, desc), value) in enumerate(zip(columns, values)):
+        if desc:
+            after = column != None if value is None else column < value
+        else:
+            after = sm.false() if value is None else sm.or_(column > value, column == None)
+        previous = [col.is_not_distinct_from(val) for (col, _), val in zip(columns[:i], values[:i])]
+        conditions.append(sm.and_(*previous, after))
+    return sm.or_(*conditions)
+
+
+# The total number of rows matched by a query, these only change between releases so never expire
+COUNT_CACHE = LruCache(COUNT_CACHE_MAX_ITEMS)
+
+
+def query_cache_key(query) -> str:
+    """A key that uniquely identifies a statement and its parameters."""
+    compiled = query.compile(dialect=postgresql.dialect())
+    return f'{compiled}|{sorted(compiled.params.items())!r}'
+
+
+async def count_rows(query, db) -> int:
+    """Returns the number of rows matched by the query (without pagination), cached by query."""
+    key = query_cache_key(query)
+    total_rows = COUNT_CACHE.get(key)
+    if total_rows is None:
+        total_rows = (await db.exec(sm.select(sm.func.count()).select_from(query.order_by(None).subquery()))).first()
+        COUNT_CACHE.set(key, total_rows)
+    return total_rows
+
+
+async def paginate_keyset(query, sort_columns: list[tuple[Any, bool]], cursor: str, items_per_page: int, db):
+    """Return a page of rows that follow the cursor, the total number of rows, and the cursor for the next page.
+
+    The sort columns are (column, descending) pairs that must end with a unique
+    column, and must be selected by the query. The next cursor is None on the last page.
+    """
+    if cursor == CURSOR_START:
+        total_rows = await count_rows(query, db)
+    else:
+        values, total_rows = decode_cursor(cursor, len(sort_columns))
+        query = query.where(keyset_after(sort_columns, values))
+
+    # Fetch one extra row to determine if there is another page
+    query = (
+        query.order_by(None)
+        .order_by(*[col.desc() if desc else col for col, desc in sort_columns])
+        .limit(items_per_page + 1)
+    )
+    rows = list(await db.exec(query))
+
+    next_cursor = None
+    if len(rows) > items_per_page:
+        rows = rows[:items_per_page]
+        next_cursor = encode_cursor([getattr(rows[-1], col.key) for col, _ in sort_columns], total_rows)
+    return rows, total_rows, next_cursor
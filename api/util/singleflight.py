@@ -0,0 +1,39 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    """Ensures only one computation runs per key, concurrent callers share its outcome.
+
+    The computation runs as its own task, so a caller being cancelled (e.g. the
+    client disconnecting) does not cancel the result for the other callers.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Task] = dict()
+        self.n_executed = 0
+        self.n_shared = 0
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def _on_done(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Retrieve the exception to avoid warnings if every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run fn for this key unless it is already running, in which case wait for that result."""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+            self.n_executed += 1
+        else:
+            self.n_shared += 1
+        return await asyncio.shield(task)
@@ -0,0 +1,79 @@
+import time
+from collections import defaultdict
+from typing import Iterable, NamedTuple, Sequence
+
+from api.util.autocomplete import SubstringIndex
+
+
+class TaxonHistoryEntry(NamedTuple):
+    """The first and last GTDB release a taxon was seen in."""
+    taxon: str
+    first_seen: str
+    last_seen: str
+    present_in_current: bool
+
+
+def summarise_taxon_history(
+        rows: Iterable[tuple[str, str]],
+        releases: Sequence[str],
+        current_release: str
+) -> list[TaxonHistoryEntry]:
+    """Summarise (taxon, release) rows into the releases each taxon was seen in, sorted by taxon.
+
+    The case of a taxon may differ between releases, these are merged under the
+    capitalisation of the most recent release. Taxa only seen in NCBI are excluded.
+
+    :param rows: The distinct (taxon, release) pairs, e.g. from taxon_hist.
+    :param releases: All releases (in order), including NCBI.
+    :param current_release: The current GTDB release.
+    """
+    d_release_to_idx = {x: i for i, x in enumerate(releases)}
+    rows = [(taxon.strip(), release.strip()) for taxon, release in rows]
+
+    # Use the capitalisation from the most recent GTDB release
+    d_key_to_name = dict()
+    for taxon, release in rows:
+        if release == 'NCBI':
+            continue
+        key = taxon.lower()
+        if key not in d_key_to_name or d_release_to_idx[release] > d_release_to_idx[d_key_to_name[key][1]]:
+            d_key_to_name[key] = (taxon, release)
+
+    d_taxon_to_releases = defaultdict(set)
+    for taxon, release in rows:
+        hit = d_key_to_name.get(taxon.lower())
+        d_taxon_to_releases[hit[0] if hit else taxon].add(release)
+
+    out = list()
+    for taxon, cur_releases in sorted(d_taxon_to_releases.items()):
+        gtdb_releases = sorted(cur_releases - {'NCBI'}, key=lambda x: d_release_to_idx[x])
+        if len(gtdb_releases) == 0:
+            continue
+        out.append(TaxonHistoryEntry(
+            taxon=taxon,
+            first_seen=gtdb_releases[0],
+            last_seen=gtdb_releases[-1],
+            present_in_current=current_release in cur_releases
+        ))
+    return out
+
+
+class TaxonHistoryIndex:
+    """Case-insensitive substring search over the taxa seen in previous releases.
+
+    Results are returned sorted by taxon, using the same (code point) order as
+    summarise_taxon_history rather than the order given (e.g. the database collation).
+    """
+
+    def __init__(self, entries: Iterable[TaxonHistoryEntry | tuple]):
+        start = time.monotonic()
+        self.entries = sorted((TaxonHistoryEntry(*x) for x in entries), key=lambda x: x.taxon)
+        self.substrings = SubstringIndex([x.taxon.lower() for x in self.entries])
+        self.created = time.time()
+        self.build_ms = (time.monotonic() - start) * 1000
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def search(self, query: str) -> list[TaxonHistoryEntry]:
+        return [self.entries[x] for x in self.substrings.find(query.lower())]
@@ -0,0 +1,114 @@
+import sys
+import time
+from array import array
+from typing import Iterable, NamedTuple
+
+
+class TreeNode(NamedTuple):
+    """A single node of the GTDB tree, and the links to external resources."""
+    taxon: str
+    total: int
+    type: str
+    is_rep: bool | None
+    type_material: str | None
+    n_desc_children: int | None
+    bergeys_url: str | None
+    seqcode_url: str | None
+    lpsn_url: str | None
+    ncbi_taxid: int | None
+    sandpiper_url: str | None
+
+
+def _intern(s: str | None) -> str | None:
+    return sys.intern(s) if s is not None else None
+
+
+class TaxonTreeIndex:
+    """An immutable, array-backed copy of the GTDB tree (gtdb_tree and gtdb_tree_children).
+
+    Nodes are stored by index in columns, the children of each node are stored
+    contiguously (in display order) in `children`, between `child_offsets[i]` and
+    `child_offsets[i + 1]`. Strings are interned, as many values (e.g. type) repeat.
+    """
+
+    def __init__(self, nodes: Iterable[TreeNode | tuple], edges: Iterable[tuple[int, int, int]]):
+        """Create the index from (id, *TreeNode) rows and (parent_id, child_id, order_id) rows."""
+        start = time.monotonic()
+        d_id_to_idx = dict()
+        self.taxa: list[str] = list()
+        self.total = array('q')
+        self.type: list[str] = list()
+        self.is_rep: list[bool | None] = list()
+        self.type_material: list[str | None] = list()
+        self.n_desc_children: list[int | None] = list()
+        self.bergeys_url: list[str | None] = list()
+        self.seqcode_url: list[str | None] = list()
+        self.lpsn_url: list[str | None] = list()
+        self.ncbi_taxid: list[int | None] = list()
+        self.sandpiper_url: list[str | None] = list()
+
+        # Taxa that appear more than once are kept so the caller can report them
+        self.d_taxon_to_idx: dict[str, int] = dict()
+        self.duplicate_taxa: set[str] = set()
+
+        for node_id, *values in nodes:
+            node = TreeNode(*values)
+            idx = len(self.taxa)
+            d_id_to_idx[node_id] = idx
+            taxon = sys.intern(node.taxon)
+            self.taxa.append(taxon)
+            self.total.append(node.total)
+            self.type.append(sys.intern(node.type))
+            self.is_rep.append(node.is_rep)
+            self.type_material.append(_intern(node.type_material))
+            self.n_desc_children.append(node.n_desc_children)
+            self.bergeys_url.append(node.bergeys_url)
+            self.seqcode_url.append(node.seqcode_url)
+            self.lpsn_url.append(node.lpsn_url)
+            self.ncbi_taxid.append(node.ncbi_taxid)
+            self.sandpiper_url.append(node.sandpiper_url)
+            if taxon in self.d_taxon_to_idx:
+                self.duplicate_taxa.add(taxon)
+            self.d_taxon_to_idx[taxon] = idx
+
+        # Group the children by parent, in display order
+        d_parent_to_children = dict()
+        for parent_id, child_id, order_id in edges:
+            d_parent_to_children.setdefault(d_id_to_idx[parent_id], list()).append((order_id, d_id_to_idx[child_id]))
+
+        self.child_offsets = array('I', [0])
+        self.children = array('I')
+        for idx in range(len(self.taxa)):
+            for _, child_idx in sorted(d_parent_to_children.get(idx, ())):
+                self.children.append(child_idx)
+            self.child_offsets.append(len(self.children))
+
+        self.created = time.time()
+        self.build_ms = (time.monotonic() - start) * 1000
+
+    def __len__(self) -> int:
+        return len(self.taxa)
+
+    def __contains__(self, taxon: str) -> bool:
+        return taxon in self.d_taxon_to_idx
+
+    def node(self, idx: int) -> TreeNode:
+        return TreeNode(
+            taxon=self.taxa[idx],
+            total=self.total[idx],
+            type=self.type[idx],
+            is_rep=self.is_rep[idx],
+            type_material=self.type_material[idx],
+            n_desc_children=self.n_desc_children[idx],
+            bergeys_url=self.bergeys_url[idx],
+            seqcode_url=self.seqcode_url[idx],
+            lpsn_url=self.lpsn_url[idx],
+            ncbi_taxid=self.ncbi_taxid[idx],
+            sandpiper_url=self.sandpiper_url[idx]
+        )
+
+    def children_of(self, taxon: str) -> list[TreeNode]:
+        """Returns the direct descendants of this taxon (in display order), raises KeyError if not present."""
+        idx = self.d_taxon_to_idx[taxon]
+        start, end = self.child_offsets[idx], self.child_offsets[idx + 1]
+        return [self.node(x) for x in self.children[start:end]]
@@ -1,15 +1,16 @@
-from typing import Literal
+from typing import Literal, Optional
 
 from fastapi import APIRouter
 from fastapi import Request
 from fastapi.responses import StreamingResponse
 
 from api.controller.advanced import get_advanced_search_options, get_advanced_search_operators, \
-    get_advanced_search_columns, get_advanced_search, adv_search_query_to_rows
+    get_advanced_search_columns, get_advanced_search, get_advanced_search_download_sql, \
+    iter_advanced_search_download_rows
 from api.db import GtdbDbDep
 from api.model.advanced import AdvancedSearchOptionsResponse, AdvancedSearchOperatorResponse, \
     AdvancedSearchColumnResponse, AdvancedSearchResult
-from api.util.io import rows_to_delim
+from api.util.io import delim_download_response
 
 router = APIRouter(prefix='/advanced', tags=['advanced'])
 
@@ -46,8 +47,13 @@ def v_advanced_get_columns():
     response_model=AdvancedSearchResult,
     summary='Return the result of an advanced search query.'
 )
-def v_advanced_get_search(request: Request, db: GtdbDbDep):
-    return get_advanced_search(query=dict(request.query_params), db=db)
+def v_advanced_get_search(
+        request: Request,
+        db: GtdbDbDep,
+        cursor: Optional[str] = None,
+        itemsPerPage: Optional[int] = None
+):
+    return get_advanced_search(query=dict(request.query_params), db=db, cursor=cursor, items_per_page=itemsPerPage)
 
 
 @router.get(
@@ -58,14 +64,13 @@ def v_advanced_get_search(request: Request, db: GtdbDbDep):
 def get_by_id_download(
         fmt: Literal['csv', 'tsv'],
         request: Request,
-        db: GtdbDbDep
+        db: GtdbDbDep,
+        gzip: bool = False
 ):
-    adv_result = get_advanced_search(query=dict(request.query_params), db=db)
-    rows = adv_search_query_to_rows(adv_result)
-    stream = rows_to_delim(rows, delim=',' if fmt == 'csv' else '\t')
-    response = StreamingResponse(iter([stream]), media_type="text/csv")
-    response.headers["Content-Disposition"] = f"attachment; filename=gtdb-adv-search.{fmt}"
-    return response
+    columns, statement, parameters = get_advanced_search_download_sql(query=dict(request.query_params))
+    rows = iter_advanced_search_download_rows(columns, statement, parameters, db)
+    return delim_download_response(rows, delim=',' if fmt == 'csv' else '\t',
+                                   filename=f'gtdb-adv-search.{fmt}', gzip=gzip)
 
 
 @router.get(
@@ -3,7 +3,7 @@ from typing import List, Annotated
 from fastapi import APIRouter, Path
 
 from api.controller.genome import genome_metadata, genome_taxon_history, genome_card, get_canonical_markers
-from api.db import GtdbDbDep, GtdbWebDbDep
+from api.db import GtdbDbDep, GtdbWebDbDep, GtdbAsyncDbDep, GtdbWebAsyncDbDep
 from api.model.genome import GenomeMarkersSummary, GenomeMetadata, GenomeTaxonHistory, GenomeCard
 
 router = APIRouter(prefix='/genome', tags=['genome'])
@@ -60,15 +60,15 @@ def v_get_genome_taxon_history(
     response_model=GenomeCard,
     summary='Return mostly all metadata associated with a genome for display on the genome page.'
 )
-def v_genome_card(
+async def v_genome_card(
         accession: Annotated[str, Path(
             ...,
             description='The NCBI accession to search.',
             example='GCA_123456789.1',
         )],
-        db_gtdb: GtdbDbDep,
-        db_web: GtdbWebDbDep):
-    return genome_card(accession, db_gtdb, db_web)
+        db_gtdb: GtdbAsyncDbDep,
+        db_web: GtdbWebAsyncDbDep):
+    return await genome_card(accession, db_gtdb, db_web)
 
 @router.get(
     '/{accession}/marker-summary',
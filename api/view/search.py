@@ -3,10 +3,10 @@ from typing import Optional, Literal
 from fastapi import APIRouter
 from fastapi.responses import StreamingResponse
 
-from api.controller.search import search_gtdb, search_gtdb_to_rows
-from api.db import GtdbDbDep
+from api.controller.search import search_gtdb, search_gtdb_query, iter_search_gtdb_download_rows
+from api.db import GtdbAsyncDbDep
 from api.model.search import SearchGtdbRequest, SearchGtdbResponse, SearchColumnEnum
-from api.util.io import rows_to_delim
+from api.util.io import delim_download_response
 
 router = APIRouter(prefix='/search', tags=['search'])
 
@@ -16,11 +16,12 @@ router = APIRouter(prefix='/search', tags=['search'])
     response_model=SearchGtdbResponse,
     summary='Search for a taxon by name.'
 )
-def get_search_gtdb(
+async def get_search_gtdb(
         search: str,
-        db: GtdbDbDep,
+        db: GtdbAsyncDbDep,
         page: Optional[int] = 1,
         itemsPerPage: Optional[int] = 100,
+        cursor: Optional[str] = None,
         sortBy: Optional[str] = None,
         sortDesc: Optional[str] = None,
         searchField: Optional[SearchColumnEnum] = SearchColumnEnum.ALL,
@@ -35,12 +36,13 @@ def get_search_gtdb(
         sortDesc=[x == 'true' for x in sortDesc.split(',')] if sortDesc else None,
         page=page,
         itemsPerPage=itemsPerPage,
+        cursor=cursor,
         searchField=searchField,
         filterText=filterText,
         gtdbSpeciesRepOnly=gtdbSpeciesRepOnly,
         ncbiTypeMaterialOnly=ncbiTypeMaterialOnly
     )
-    return search_gtdb(request, db)
+    return await search_gtdb(request, db)
 
 
 @router.get(
@@ -48,9 +50,9 @@ def get_search_gtdb(
     response_class=StreamingResponse,
     summary='Download the results of a GTDB search.'
 )
-def get_by_id_download(
+async def get_by_id_download(
         search: str,
-        db: GtdbDbDep,
+        db: GtdbAsyncDbDep,
         fmt: Literal['csv', 'tsv'],
         sortBy: Optional[str] = None,
         sortDesc: Optional[str] = None,
@@ -58,19 +60,21 @@ def get_by_id_download(
         filterText: Optional[str] = None,
         gtdbSpeciesRepOnly: Optional[bool] = False,
         ncbiTypeMaterialOnly: Optional[bool] = False,
+        gzip: bool = False,
 
 ):
-    rows = search_gtdb_to_rows(
-        get_search_gtdb(
-            search, page=None, itemsPerPage=None,
-            sortBy=sortBy, sortDesc=sortDesc,
-            searchField=searchField, filterText=filterText,
-            gtdbSpeciesRepOnly=gtdbSpeciesRepOnly,
-            ncbiTypeMaterialOnly=ncbiTypeMaterialOnly,
-            db=db
-        )
+    request = SearchGtdbRequest(
+        search=search,
+        sortBy=sortBy.split(',') if sortBy else None,
+        sortDesc=[x == 'true' for x in sortDesc.split(',')] if sortDesc else None,
+        searchField=searchField,
+        filterText=filterText,
+        gtdbSpeciesRepOnly=gtdbSpeciesRepOnly,
+        ncbiTypeMaterialOnly=ncbiTypeMaterialOnly
     )
-    stream = rows_to_delim(rows, delim=',' if fmt == 'csv' else '\t')
-    response = StreamingResponse(iter([stream]), media_type="text/csv")
-    response.headers["Content-Disposition"] = f"attachment; filename=gtdb-search.{fmt}"
-    return response
+
+    # Validate the request before the response starts
+    search_gtdb_query(request)
+
+    rows = iter_search_gtdb_download_rows(request, db)
+    return delim_download_response(rows, delim=',' if fmt == 'csv' else '\t', filename=f'gtdb-search.{fmt}', gzip=gzip)
@@ -1,9 +1,10 @@
 from urllib.parse import quote
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 
 from api.config import SITEMAP_PAGES
 from api.db import GtdbDbDep, GtdbWebDbDep
+from api.util.cache import coalesced
 from api.util.collection import iter_batches
 from api.view.genomes import v_get_genomes_all
 from api.view.species import v_species_all
@@ -18,7 +19,9 @@ MAX_ITEMS = 4000
     '',
     summary='Generate the sitemap content for the GTDB website.'
 )
-async def gtdb(
+@coalesced
+def gtdb(
+        request: Request,
         db: GtdbDbDep,
         db_web: GtdbWebDbDep
 ):
@@ -1,12 +1,14 @@
+import itertools
 import json
 from typing import Annotated, List, Literal
 
-from fastapi import APIRouter, File, Form, Path, Query, UploadFile
-from fastapi.responses import Response, StreamingResponse
+from fastapi import APIRouter, File, Form, Header, Path, Query, UploadFile
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 
 from api.controller.skani import (
-    ani_validate_genomes, get_job_data_index_page, get_job_data_table_page,
-    get_job_id_status, skani_create_job, skani_get_heatmap
+    ani_validate_genomes, get_job_data_index_page, get_job_data_table_npz, get_job_data_table_page,
+    get_job_id_status, skani_create_job, skani_get_heatmap, skani_get_heatmap_npz, util_get_job_table,
+    iter_job_table_rows
 )
 from api.db import GtdbCommonDbDep, GtdbDbDep
 from api.exceptions import HttpBadRequest
@@ -16,10 +18,13 @@ from api.model.skani import (
     SkaniJobStatusResponse, SkaniJobUploadMetadata, SkaniResultTableRow, SkaniServerConfig,
     SkaniValidateGenomesRequest, SkaniValidateGenomesResponse
 )
-from api.util.io import rows_to_delim
+from api.util.io import NPZ_MEDIA_TYPE, accepts_npz, delim_download_response, npz_response
 
 router = APIRouter(prefix='/skani', tags=['skani'])
 
+# Documents the alternate binary format of the heatmap and table endpoints
+NPZ_RESPONSES = {200: {'content': {NPZ_MEDIA_TYPE: {}}, 'description': 'JSON, or an .npz archive if requested.'}}
+
 
 @router.get(
     '/config',
@@ -92,6 +97,7 @@ def v_skani_get_job_id(
 @router.get(
     "/job/{jobId}/table",
     response_model=SkaniJobDataTableResponse,
+    responses=NPZ_RESPONSES,
     summary='Retrieve information about a specific job for the table page.'
 )
 def v_skani_get_job_id_table(
@@ -102,13 +108,20 @@ def v_skani_get_job_id_table(
             example='40faf0c0',
         )],
         db_common: GtdbCommonDbDep,
-        response: Response,
         showNa: Annotated[bool, Query(
             description='If no-hits (distant) should be shown.',
         )] = False,
         showSelf: Annotated[bool, Query(
             description='If self-hits should be shown.',
         )] = False,
+        columnar: Annotated[bool, Query(
+            description='Return the rows as columns (in "columns"), this is much faster for large jobs.',
+        )] = False,
+        fmt: Annotated[Literal['json', 'npz'] | None, Query(
+            description='The response format, npz returns the columns as NumPy arrays (ANI/AF as int16 * 100). '
+                        f'Defaults to npz if the Accept header contains {NPZ_MEDIA_TYPE}, otherwise json.',
+        )] = None,
+        accept: Annotated[str | None, Header(include_in_schema=False)] = None,
 ):
     # # Parse the sort_by and sort_desc parameters into lists
     # if sort_by is not None:
@@ -116,11 +129,20 @@ def v_skani_get_job_id_table(
     # if sort_desc is not None:
     #     sort_desc = [x.strip().lower() == 'true' for x in sort_desc.split(',')]
 
-    data = get_job_data_table_page(jobId, showNa, showSelf, db_common)
-    if data.completed is not True:
+    if accepts_npz(accept, fmt):
+        completed, content = get_job_data_table_npz(jobId, showNa, showSelf, db_common)
+        out = npz_response(content, filename=f'gtdb-skani-{jobId}-table.npz')
+        if not completed:
+            out.headers["Cache-Control"] = "no-cache, no-store, max-age=0"
+        return out
+
+    # The payload is returned directly, as validating each row against the response model is slow
+    data = get_job_data_table_page(jobId, showNa, showSelf, db_common, columnar=columnar)
+    out = JSONResponse(content=data, headers={'Vary': 'Accept'})
+    if data['completed'] is not True:
         # Add this header if the job is still processing
-        response.headers["Cache-Control"] = "no-cache, no-store, max-age=0"
-    return data
+        out.headers["Cache-Control"] = "no-cache, no-store, max-age=0"
+    return out
 
 
 @router.get(
@@ -148,6 +170,7 @@ def v_skani_get_job_id_status(
 @router.get(
     '/job/{job_id}/heatmap',
     response_model=SkaniJobDataHeatmapResponse,
+    responses=NPZ_RESPONSES,
     summary='Retrieve the heatmap data for a specific job.'
 )
 def v_get_job_id_heatmap(
@@ -164,8 +187,21 @@ def v_get_job_id_heatmap(
             description='Cluster the heatmap by either average nucleotide identity (ani) or alignment fraction (af).',
             example='ani',
         )] = 'ani',
+        fmt: Annotated[Literal['json', 'npz'] | None, Query(
+            description='The response format, npz returns the matrices as NumPy arrays (ANI/AF as int16 * 100). '
+                        f'Defaults to npz if the Accept header contains {NPZ_MEDIA_TYPE}, otherwise json.',
+        )] = None,
+        accept: Annotated[str | None, Header(include_in_schema=False)] = None,
 ):
+    if accepts_npz(accept, fmt):
+        completed, content = skani_get_heatmap_npz(job_id, clusterBy, db_gtdb, db_common)
+        out = npz_response(content, filename=f'gtdb-skani-{job_id}-heatmap.npz')
+        if not completed:
+            out.headers["Cache-Control"] = "no-cache, no-store, max-age=0"
+        return out
+
     data = skani_get_heatmap(job_id, clusterBy, db_gtdb, db_common)
+    response.headers["Vary"] = "Accept"
     if not data.completed:
         response.headers["Cache-Control"] = "no-cache, no-store, max-age=0"
     return data
@@ -195,6 +231,9 @@ def v_get_job_id_download(
             description='The format to download.',
             example='tsv',
         )] = 'tsv',
+        gzip: Annotated[bool, Query(
+            description='If the file should be gzip compressed.',
+        )] = False,
 ):
     # Convert to delimiter
     if fmt == 'tsv':
@@ -202,21 +241,15 @@ def v_get_job_id_download(
     else:
         delim = ','
 
-    # Get the rows
-    data = get_job_data_table_page(jobId, showNa, showSelf, db)
+    # Get the results
+    job, job_results, d_genome_id_to_name = util_get_job_table(jobId, db)
 
     # Early exit if not completed
-    if data.completed is not True:
+    if job.completed is None:
         raise HttpBadRequest(f'Job {jobId} is not yet completed.')
 
-    # Convert rows to expected format
-    rows = list()
-    rows.append(SkaniResultTableRow.get_column_names())
-    for row in data.rows:
-        rows.append(row.to_row())
-
-    # Create the output
-    stream = rows_to_delim(rows, delim=delim)
-    response = StreamingResponse(iter([stream]), media_type="text/csv")
-    response.headers["Content-Disposition"] = f"attachment; filename=gtdb-fastani-{jobId}.{fmt}"
-    return response
+    # Rows are generated as the response is written
+    rows = [SkaniResultTableRow.get_column_names()]
+    if job_results is not None:
+        rows = itertools.chain(rows, iter_job_table_rows(job_results, d_genome_id_to_name, showNa, showSelf))
+    return delim_download_response(rows, delim=delim, filename=f'gtdb-fastani-{jobId}.{fmt}', gzip=gzip)
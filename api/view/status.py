@@ -1,9 +1,9 @@
 from fastapi import APIRouter
 from fastapi.responses import Response
 
-from api.controller.status import get_status
+from api.controller.status import get_status, get_analytics_status, get_cache_status, get_indexes_status
 from api.db import GtdbWebDbDep
-from api.model.status import StatusDbResponse
+from api.model.status import StatusDbResponse, StatusAnalyticsResponse, StatusCacheResponse, StatusIndexesResponse
 
 router = APIRouter(prefix='/status', tags=['status'])
 
@@ -16,3 +16,36 @@ router = APIRouter(prefix='/status', tags=['status'])
 def v_get_status(response: Response, db: GtdbWebDbDep):
     response.headers["Cache-Control"] = "no-cache, no-store, max-age=0"
     return get_status(db)
+
+
+@router.get(
+    '/analytics',
+    summary='Return the state of the background analytics queue.',
+    response_model=StatusAnalyticsResponse,
+    include_in_schema=False
+)
+def v_get_status_analytics(response: Response):
+    response.headers["Cache-Control"] = "no-cache, no-store, max-age=0"
+    return get_analytics_status()
+
+
+@router.get(
+    '/cache',
+    summary='Return the response cache metrics for this process.',
+    response_model=StatusCacheResponse,
+    include_in_schema=False
+)
+def v_get_status_cache(response: Response):
+    response.headers["Cache-Control"] = "no-cache, no-store, max-age=0"
+    return get_cache_status()
+
+
+@router.get(
+    '/indexes',
+    summary='Return the state of the in-memory indexes for this process.',
+    response_model=StatusIndexesResponse,
+    include_in_schema=False
+)
+def v_get_status_indexes(response: Response):
+    response.headers["Cache-Control"] = "no-cache, no-store, max-age=0"
+    return get_indexes_status()
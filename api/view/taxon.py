@@ -1,15 +1,16 @@
 from typing import List, Annotated
 
-from fastapi import APIRouter, Path, Query
+from fastapi import APIRouter, Path, Query, Request
 
 from api.controller.taxon import get_taxon_descendants, search_for_taxon, results_from_previous_releases, \
     search_for_taxon_all_releases, get_taxon_genomes_in_taxon, get_gc_content_histogram_bins, get_taxon_card, \
     get_taxon_genomes_detail
-from api.db import GtdbWebDbDep, GtdbDbDep
+from api.db import GtdbWebDbDep, GtdbDbDep, GtdbAsyncDbDep, GtdbWebAsyncDbDep
 from api.exceptions import HttpBadRequest
 from api.model.graph import GraphHistogramBin
 from api.model.taxon import TaxonDescendants, TaxonSearchResponse, TaxonPreviousReleases, TaxonCard, \
     TaxonPreviousReleasesPaginated, TaxonGenomesDetailResponse
+from api.util.cache import coalesced
 
 router = APIRouter(prefix='/taxon', tags=['taxon'])
 
@@ -19,15 +20,17 @@ router = APIRouter(prefix='/taxon', tags=['taxon'])
     response_model=List[TaxonDescendants],
     summary='Return the direct descendants of this taxon.'
 )
-def v_get_taxon_name(
+@coalesced
+async def v_get_taxon_name(
+        request: Request,
         name: Annotated[str, Path(
             ...,
             description='The GTDB taxon to search.',
             example='d__Bacteria',
         )],
-        db: GtdbWebDbDep
+        db: GtdbWebAsyncDbDep
 ):
-    return get_taxon_descendants(name, db)
+    return await get_taxon_descendants(name, db)
 
 
 @router.get(
@@ -35,13 +38,13 @@ def v_get_taxon_name(
     response_model=TaxonSearchResponse,
     summary='Search for a taxon in the current release, returning partial matches.'
 )
-def v_get_search_taxon(
+async def v_get_search_taxon(
         taxon: Annotated[str, Path(
             ...,
             description='The partial GTDB taxon to search.',
             example='bac',
         )],
-        db: GtdbDbDep,
+        db: GtdbAsyncDbDep,
         limit: Annotated[int | None, Query(
             description='The maximum number of results to return for each rank.',
             example=100,
@@ -49,7 +52,7 @@ def v_get_search_taxon(
             le=100
         )] = 100,
 ):
-    return search_for_taxon(taxon, limit, db)
+    return await search_for_taxon(taxon, limit, db)
 
 
 @router.get(
@@ -148,9 +151,10 @@ def v_get_taxon_gc_histogram_bins(
             example='d__Archaea',
             regex=r'^[dpcofgs]__.+$'
         )],
-        db: GtdbDbDep
+        db: GtdbDbDep,
+        db_web: GtdbWebDbDep
 ):
-    return get_gc_content_histogram_bins(taxon, db)
+    return get_gc_content_histogram_bins(taxon, db, db_web)
 
 
 @router.get(
@@ -165,9 +169,10 @@ def v_get_taxon_card(
             example='d__Archaea',
             regex=r'^[dpcofgs]__.+$'
         )],
-        db_gtdb: GtdbDbDep
+        db_gtdb: GtdbDbDep,
+        db_web: GtdbWebDbDep
 ):
-    return get_taxon_card(taxon, db_gtdb)
+    return get_taxon_card(taxon, db_gtdb, db_web)
 
 
 @router.get(
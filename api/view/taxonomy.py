@@ -7,12 +7,12 @@ from fastapi import Request, Response
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
-from api.controller.taxonomy import post_taxonomy_count, taxonomy_count_rows_to_sv, taxonomy_partial_search, \
-    taxa_not_in_lit, taxonomy_partial_search_all_releases
-from api.db import get_gtdb_db, get_gtdb_web_db, GtdbDbDep, GtdbWebDbDep
+from api.controller.taxonomy import post_taxonomy_count, taxonomy_count_query, iter_taxonomy_count_download_rows, \
+    taxonomy_partial_search, taxa_not_in_lit, taxonomy_partial_search_all_releases
+from api.db import GtdbDbDep, GtdbWebDbDep, GtdbAsyncDbDep, GtdbWebAsyncDbDep
 from api.model.taxonomy import TaxonomyCountRequest, TaxonomyCountResponse, TaxaNotInLiterature, TaxonomyOptional, \
     TaxonomyOptionalRelease
-from api.util.io import rows_to_delim
+from api.util.io import delim_download_response
 
 router = APIRouter(prefix='/taxonomy', tags=['taxonomy'])
 
@@ -22,11 +22,12 @@ router = APIRouter(prefix='/taxonomy', tags=['taxonomy'])
     response_model=TaxonomyCountResponse,
     summary='Return the count of genomes in all species clusters.'
 )
-def v_get_taxonomy_count(
-        db_gtdb: GtdbDbDep,
-        db_web: GtdbWebDbDep,
+async def v_get_taxonomy_count(
+        db_gtdb: GtdbAsyncDbDep,
+        db_web: GtdbWebAsyncDbDep,
         page: Optional[int] = None,
         items_per_page: Optional[int] = Query(None, alias='items-per-page'),
+        cursor: Optional[str] = None,
         sort_by: Optional[str] = Query(None, alias='sort-by'),
         sort_desc: Optional[str] = Query(None, alias='sort-desc'),
         search: Optional[str] = None,
@@ -43,6 +44,7 @@ def v_get_taxonomy_count(
     request = TaxonomyCountRequest(
         page=page,
         itemsPerPage=items_per_page,
+        cursor=cursor,
         sortBy=[x for x in sort_by.split(',')] if sort_by else None,
         sortDesc=[x == 'true' for x in sort_desc.split(',')] if sort_desc else None,
         search=search,
@@ -55,7 +57,7 @@ def v_get_taxonomy_count(
         filterGenus=filter_genus,
         filterSpecies=filter_species
     )
-    return post_taxonomy_count(request, db_gtdb, db_web)
+    return await post_taxonomy_count(request, db_gtdb, db_web)
 
 
 @router.get(
@@ -63,16 +65,17 @@ def v_get_taxonomy_count(
     response_class=StreamingResponse,
     summary='Download the count of genomes in all species clusters.'
 )
-def taxonomy_count_download(
+async def taxonomy_count_download(
         fmt: Literal['csv', 'tsv'],
-        db_gtdb: GtdbDbDep,
-        db_web: GtdbWebDbDep,
+        db_gtdb: GtdbAsyncDbDep,
+        db_web: GtdbWebAsyncDbDep,
         page: Optional[int] = None,
         items_per_page: Optional[int] = Query(None, alias='items-per-page'),
         sort_by: Optional[str] = Query(None, alias='sort-by'),
         sort_desc: Optional[str] = Query(None, alias='sort-desc'),
         search: Optional[str] = None,
         proposed: Optional[bool] = Query(None, alias='gtdb-proposed'),
+        gzip: bool = False,
 ):
     request = TaxonomyCountRequest(
         page=page,
@@ -83,16 +86,11 @@ def taxonomy_count_download(
         search=search
     )
 
-    # Remove pagination to return the full set of data
-    request.itemsPerPage = None
-    request.page = None
-
-    # Transform into rows
-    rows = taxonomy_count_rows_to_sv(post_taxonomy_count(request, db_gtdb, db_web))
-    stream = rows_to_delim(rows, delim=',' if fmt == 'csv' else '\t')
-    response = StreamingResponse(iter([stream]), media_type="text/csv")
-    response.headers["Content-Disposition"] = f"attachment; filename=gtdb-taxonomy-table.{fmt}"
-    return response
+    # Pagination is ignored to return the full set of data
+    query, sort_columns = await taxonomy_count_query(request, db_web)
+    rows = iter_taxonomy_count_download_rows(query, sort_columns, db_gtdb)
+    return delim_download_response(rows, delim=',' if fmt == 'csv' else '\t',
+                                   filename=f'gtdb-taxonomy-table.{fmt}', gzip=gzip)
 
 
 @router.get(
@@ -101,9 +99,9 @@ def taxonomy_count_download(
     summary='Returns a list of all GTDB proposed taxa.'
 )
 async def get_taxon_not_in_literature(
-        db: GtdbWebDbDep
+        db: GtdbWebAsyncDbDep
 ):
-    return taxa_not_in_lit(db)
+    return await taxa_not_in_lit(db)
 
 
 # new below
@@ -6,15 +6,22 @@ if __name__ == '__main__':
     load_dotenv()
 
 import asyncio
+import signal
+from contextlib import asynccontextmanager
 
-import httpx
 import uvicorn
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import PlainTextResponse
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from api import __version__
-from api.config import ENV_NAME, Env
+from api.config import (
+    ENV_NAME, Env, TAXON_HISTORY_INDEX_ENABLED, TAXON_SEARCH_INDEX_ENABLED, TAXON_TREE_INDEX_ENABLED
+)
+from api.controller.taxon import load_taxon_history_index, load_taxon_search_index, load_taxon_tree_index
+from api.db import gtdb_async_engine, gtdb_web_async_engine, gtdb_common_async_engine
+from api.util.analytics import analytics, build_plausible_event
 from api.view import (
     advanced, genome, genomes, meta, sankey, search, sitemap, skani, species, status, taxa, taxon, taxonomy, util
 )
@@ -80,6 +87,55 @@ tags_metadata = [
 ]
 tags_metadata = sorted(tags_metadata, key=lambda x: x['name'])
 
+
+async def load_indexes():
+    """Load the in-memory indexes, if this fails the previous index (or the database) continues to be used."""
+    if TAXON_TREE_INDEX_ENABLED:
+        try:
+            async with AsyncSession(gtdb_web_async_engine) as db:
+                index = await load_taxon_tree_index(db)
+            print(f'Loaded the GTDB tree index ({len(index):,} nodes) in {index.build_ms:,.0f} ms')
+        except Exception as e:
+            print(f'Unable to load the GTDB tree index: {e}')
+    if TAXON_SEARCH_INDEX_ENABLED:
+        try:
+            async with AsyncSession(gtdb_async_engine) as db:
+                index = await load_taxon_search_index(db)
+            print(f'Loaded the taxon search index ({len(index):,} taxa) in {index.build_ms:,.0f} ms')
+        except Exception as e:
+            print(f'Unable to load the taxon search index: {e}')
+    if TAXON_HISTORY_INDEX_ENABLED:
+        try:
+            async with AsyncSession(gtdb_web_async_engine) as db:
+                index = await load_taxon_history_index(db)
+            print(f'Loaded the taxon history index ({len(index):,} taxa) in {index.build_ms:,.0f} ms')
+        except Exception as e:
+            print(f'Unable to load the taxon history index: {e}')
+
+
+# Keeps a reference to reloads triggered by SIGHUP, so they are not garbage collected
+RELOAD_TASKS = set()
+
+
+def reload_indexes():
+    task = asyncio.ensure_future(load_indexes())
+    RELOAD_TASKS.add(task)
+    task.add_done_callback(RELOAD_TASKS.discard)
+
+
+# Start and stop background services with the app
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    await analytics.start()
+    await load_indexes()
+    if hasattr(signal, 'SIGHUP'):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_indexes)
+    yield
+    await analytics.stop()
+    for engine in (gtdb_async_engine, gtdb_web_async_engine, gtdb_common_async_engine):
+        await engine.dispose()
+
+
 # Initialise the app
 app = FastAPI(
     title='GTDB API',
@@ -93,7 +149,8 @@ app = FastAPI(
                 f'<li><a href="https://github.com/Ecogenomics/api.gtdb.ecogenomic.org" target="_blank">GitHub repository</a><br></li>'
                 f'<li><a href="https://github.com/Ecogenomics/api.gtdb.ecogenomic.org/blob/main/CHANGELOG.md" target="_blank">CHANGELOG</a></li>'
                 f'</ul>',
-    openapi_tags=tags_metadata
+    openapi_tags=tags_metadata,
+    lifespan=lifespan
 )
 
 # Add routes
@@ -131,49 +188,11 @@ else:
     port = 9000
 
 
-async def send_request_to_plausible(request: Request):
-    # https://plausible.io/docs/custom-event-goals
-    #
-    try:
-        if ENV_NAME is Env.PROD:
-            domain = 'gtdb-api.ecogenomic.org'
-        elif ENV_NAME is Env.DEV:
-            domain = 'gtdb-api-dev.ecogenomic.org'
-        else:
-            print('Running local - skipping analytics.')
-            return
-
-        url = 'https://gtdb-stats.ecogenomic.org/api/event'
-        user_agent = request.headers.get('user-agent')
-        x_forwarded_for = request.headers.get('x-forwarded-for')
-
-        if x_forwarded_for is None:
-            print('Unable to determine IP address for plausible analytics.')
-            return
-
-        headers = {
-            'User-Agent': user_agent,
-            'X-Forwarded-For': x_forwarded_for,
-            'Content-Type': 'application/json'
-        }
-        data = {
-            'name': 'pageview',
-            'url': f'https://{domain}{request.get("path", "")}',
-            'domain': domain,
-            'props': {
-                'method': request.method
-            }
-        }
-        httpx.post(url, headers=headers, json=data, timeout=2.0)
-    except Exception as e:
-        print(f'Unable to send to plausible: {e}')
-    return
-
-
 # This will be executed on each API call
 @app.middleware("http")
 async def intercept_http_request(request: Request, call_next):
-    response, _ = await asyncio.gather(call_next(request), send_request_to_plausible(request))
+    analytics.enqueue(build_plausible_event(request))
+    response = await call_next(request)
 
     # For requests that provide a cacheKey, cache the response for 1 year
     if ENV_NAME is Env.PROD and 'Cache-Control' not in response.headers and 'cacheKey' in request.query_params:
@@ -0,0 +1,87 @@
+"""
+Compare the latency of the legacy /search/gtdb predicate (an ILIKE per column
+and keyword) against the trigram-indexed search document.
+
+Each case runs the same two statements the endpoint does: the total row count,
+and the first page of results. The indexes must have been created first
+(scripts/release/create_search_indexes.py).
+
+    python scripts/benchmark/search_gtdb.py --repeats 10
+"""
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+import argparse
+import statistics
+import time
+
+import sqlmodel as sm
+from sqlmodel import Session
+
+from api.controller.search import SEARCH_FIELDS, generate_search_query_2, generate_search_query_trgm
+from api.db import gtdb_engine
+from api.db.gtdb import DbGtdbSearchMtView
+from api.model.search import SearchColumnEnum
+
+# (description, search field, keywords)
+CASES = (
+    ('short', SearchColumnEnum.ALL, ['coli']),
+    ('long', SearchColumnEnum.ALL, ['s__Escherichia coli']),
+    ('multi-keyword', SearchColumnEnum.ALL, ['Escherichia', 'Salmonella', 'Bacillus']),
+    ('accession', SearchColumnEnum.NCBI_GENOME_ID, ['G000005845']),
+    ('gtdb taxonomy', SearchColumnEnum.GTDB_TAX, ['g__Prochlorococcus']),
+    ('two characters', SearchColumnEnum.ALL, ['sp']),
+)
+
+PREDICATES = {
+    'legacy': generate_search_query_2,
+    'trgm': generate_search_query_trgm,
+}
+
+
+def run_search(db: Session, where_clause, page_size: int) -> int:
+    query = (
+        sm.select(DbGtdbSearchMtView.id_at_source, DbGtdbSearchMtView.gtdb_taxonomy)
+        .where(sm.or_(*where_clause))
+    )
+    total_rows = db.exec(sm.select(sm.func.count()).select_from(query.subquery())).first()
+    db.exec(query.order_by(DbGtdbSearchMtView.id_at_source).limit(page_size)).all()
+    return total_rows
+
+
+def time_case(db: Session, predicate, list_fields, keywords, repeats: int, page_size: int):
+    where_clause = predicate(list_fields, keywords)
+
+    # Warm the buffer cache so that the first run does not dominate
+    total_rows = run_search(db, where_clause, page_size)
+    timings = list()
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run_search(db, where_clause, page_size)
+        timings.append((time.perf_counter() - start) * 1000)
+    return total_rows, timings
+
+
+def main(args):
+    print(f'{"case":<16}{"predicate":<10}{"rows":>10}{"median ms":>12}{"max ms":>10}')
+    with Session(gtdb_engine) as db:
+        for name, search_field, keywords in CASES:
+            medians = dict()
+            for predicate_name, predicate in PREDICATES.items():
+                total_rows, timings = time_case(db, predicate, SEARCH_FIELDS[search_field], keywords,
+                                                args.repeats, args.page_size)
+                medians[predicate_name] = statistics.median(timings)
+                print(f'{name:<16}{predicate_name:<10}{total_rows:>10,}'
+                      f'{medians[predicate_name]:>12.1f}{max(timings):>10.1f}')
+            print(f'{"":<16}{"speedup":<10}{"":>10}{medians["legacy"] / medians["trgm"]:>11.1f}x')
+    return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeats', help='Number of timed runs for each case.', type=int, default=5)
+    parser.add_argument('--page-size', help='Number of rows in the first page.', type=int, default=100)
+    main(parser.parse_args())
@@ -0,0 +1,79 @@
+"""
+Compare the time taken to compute the heatmap leaf order using cluster_matrix
+(Euclidean distance and optimal ordering on both axes), against cluster_leaves
+(distance from the ANI values, and optimal ordering only up to a maximum size).
+
+Synthetic ANI matrices are generated with a species-like structure, either where
+the query and reference genomes are the same (TRIANGLE), or are different (QVR).
+
+    python scripts/benchmark/skani_cluster.py --sizes 100 250 500
+"""
+
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from api.config import ANI_HEATMAP_OPTIMAL_ORDERING_MAX_GENOMES
+from api.util.matrix import cluster_leaves, cluster_matrix
+
+
+def create_ani_matrix(n_rows: int, n_cols: int, rng: np.random.Generator) -> np.ndarray:
+    """Genomes are assigned to clusters, those in the same cluster are closer than those in others."""
+    n_clusters = max(2, (n_rows + n_cols) // 20)
+    row_clusters = rng.integers(0, n_clusters, size=n_rows)
+    col_clusters = rng.integers(0, n_clusters, size=n_cols)
+    same = row_clusters[:, np.newaxis] == col_clusters[np.newaxis, :]
+    arr = np.where(same, rng.uniform(95, 100, size=same.shape), rng.uniform(75, 85, size=same.shape))
+    return np.round(arr, 2)
+
+
+def create_triangle_matrix(n: int, rng: np.random.Generator) -> np.ndarray:
+    arr = create_ani_matrix(n, n, rng)
+    arr = np.triu(arr) + np.triu(arr, 1).T
+    np.fill_diagonal(arr, 100)
+    return arr
+
+
+def time_it(fn, repeats: int):
+    timings = list()
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    print(f'Optimal ordering is used up to {args.max_optimal} genomes.')
+    print(f'{"mode":>9}{"size":>10}{"legacy ms":>11}{"optimal ms":>12}{"default ms":>12}{"speedup":>9}')
+    for n in args.sizes:
+        for mode in ('TRIANGLE', 'QVR'):
+            if mode == 'TRIANGLE':
+                arr, symmetric = create_triangle_matrix(n, rng), True
+            else:
+                arr, symmetric = create_ani_matrix(n, n // 2, rng), False
+
+            ms_legacy = time_it(lambda: cluster_matrix(arr), args.repeats)
+            ms_optimal = time_it(lambda: cluster_leaves(arr, symmetric, optimal_ordering_max_size=max(arr.shape)),
+                                 args.repeats)
+            ms_default = time_it(lambda: cluster_leaves(arr, symmetric, optimal_ordering_max_size=args.max_optimal),
+                                 args.repeats)
+
+            size = f'{arr.shape[0]}x{arr.shape[1]}'
+            print(f'{mode:>9}{size:>10}{ms_legacy:>11.1f}{ms_optimal:>12.1f}{ms_default:>12.1f}'
+                  f'{ms_legacy / ms_default:>8.1f}x')
+    return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', help='Number of query genomes in each matrix.', type=int, nargs='+',
+                        default=[100, 250, 500])
+    parser.add_argument('--repeats', help='Number of timed runs for each size.', type=int, default=3)
+    parser.add_argument('--max-optimal', help='Maximum number of genomes to optimally order.', type=int,
+                        default=ANI_HEATMAP_OPTIMAL_ORDERING_MAX_GENOMES)
+    parser.add_argument('--seed', help='Seed for the random matrices.', type=int, default=42)
+    main(parser.parse_args())
@@ -0,0 +1,117 @@
+"""
+Compare the assembly of the skani heatmap (merging the query/reference results,
+re-ordering by the dendrogram and rounding) using the previous Python loops,
+against the vectorised implementation in api.controller.skani.
+
+Synthetic jobs are generated where the query and reference genomes are the same
+(i.e. TRIANGLE mode), and where half of the genomes overlap. The clustering is
+timed separately, as it is the same for both.
+
+    python scripts/benchmark/skani_heatmap.py --sizes 10 50 100 250 500
+"""
+
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from api.controller.skani import util_merge_job_results
+from api.model.skani import UtilSkaniJobResults
+from api.util.matrix import cluster_matrix
+
+
+def create_job_results(n: int, overlap: bool, rng: np.random.Generator) -> UtilSkaniJobResults:
+    qry_ids = list(range(n))
+    ref_ids = list(range(n // 2, n // 2 + n)) if overlap else qry_ids
+    shape = (len(qry_ids), len(ref_ids))
+    return UtilSkaniJobResults(
+        qry_ids=qry_ids,
+        ref_ids=ref_ids,
+        ani=rng.integers(7500, 10001, size=shape) / 100,
+        af_qry=rng.integers(0, 10001, size=shape) / 100,
+        af_ref=rng.integers(0, 10001, size=shape) / 100
+    )
+
+
+def legacy_merge(job_results: UtilSkaniJobResults):
+    d_gid_to_ref_index = {x: idx for idx, x in enumerate(job_results.ref_ids)}
+    d_gid_to_qry_index = {x: idx for idx, x in enumerate(job_results.qry_ids)}
+    shape = (len(job_results.qry_ids), len(job_results.ref_ids))
+    arr_ani = np.zeros(shape=shape, dtype=float)
+    arr_af = np.zeros(shape=shape, dtype=float)
+    for qry_idx, qry_gid in enumerate(job_results.qry_ids):
+        for ref_idx, ref_gid in enumerate(job_results.ref_ids):
+            is_symmetric = qry_gid in d_gid_to_ref_index and ref_gid in d_gid_to_qry_index
+            ani = job_results.ani[qry_idx, ref_idx]
+            af_qry = job_results.af_qry[qry_idx, ref_idx]
+            af_ref = job_results.af_ref[qry_idx, ref_idx]
+            arr_ani[qry_idx, ref_idx] = ani
+            if is_symmetric:
+                arr_af[qry_idx, ref_idx] = af_qry
+                ref_idx_rev = d_gid_to_ref_index[qry_gid]
+                qry_idx_rev = d_gid_to_qry_index[ref_gid]
+                arr_ani[qry_idx_rev, ref_idx_rev] = ani
+                arr_af[qry_idx_rev, ref_idx_rev] = af_ref
+            else:
+                arr_af[qry_idx, ref_idx] = max(af_qry, af_ref)
+    return arr_ani, arr_af
+
+
+def legacy_output(arr_ani, arr_af, matrix, dendro_x, dendro_y):
+    out_ani, out_af = list(), list()
+    for y_idx, qry_idx_original in enumerate(dendro_y['leaves']):
+        cur_ani_row, cur_af_row = list(), list()
+        for x_idx, ref_idx_original in enumerate(dendro_x['leaves']):
+            cur_ani_row.append(round(float(matrix[y_idx, x_idx]), 2))
+            cur_af_row.append(round(float(arr_af[qry_idx_original, ref_idx_original]), 2))
+        out_ani.append(cur_ani_row)
+        out_af.append(cur_af_row)
+    return out_ani, out_af
+
+
+def vectorised_output(arr_ani, arr_af, matrix, dendro_x, dendro_y):
+    out_ani = np.round(matrix, 2).tolist()
+    out_af = np.round(arr_af[np.ix_(dendro_y['leaves'], dendro_x['leaves'])], 2).tolist()
+    return out_ani, out_af
+
+
+def time_it(fn, repeats: int):
+    timings = list()
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(timings)
+
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    print(f'{"size":>9}{"overlap":>9}{"cluster ms":>12}{"legacy ms":>11}{"numpy ms":>10}{"speedup":>9}')
+    for n in args.sizes:
+        for overlap in (False, True):
+            job_results = create_job_results(n, overlap, rng)
+            (arr_ani, arr_af), _ = time_it(lambda: util_merge_job_results(job_results), 1)
+            (matrix, dendro_x, dendro_y), ms_cluster = time_it(lambda: cluster_matrix(arr_ani), 1)
+
+            legacy, ms_legacy = time_it(lambda: legacy_output(
+                *legacy_merge(job_results), matrix, dendro_x, dendro_y), args.repeats)
+            vectorised, ms_numpy = time_it(lambda: vectorised_output(
+                *util_merge_job_results(job_results), matrix, dendro_x, dendro_y), args.repeats)
+
+            if legacy != vectorised:
+                raise ValueError(f'Output differs for {n}x{n} (overlap={overlap})')
+            size = f'{len(job_results.qry_ids)}x{len(job_results.ref_ids)}'
+            print(f'{size:>9}{str(overlap):>9}{ms_cluster:>12.1f}{ms_legacy:>11.1f}'
+                  f'{ms_numpy:>10.1f}{ms_legacy / ms_numpy:>8.1f}x')
+    return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', help='Number of query genomes in each job.', type=int, nargs='+',
+                        default=[10, 50, 100, 250, 500])
+    parser.add_argument('--repeats', help='Number of timed runs for each size.', type=int, default=3)
+    parser.add_argument('--seed', help='Seed for the random results.', type=int, default=42)
+    main(parser.parse_args())
@@ -0,0 +1,75 @@
+"""
+Create the pg_trgm GIN indexes used by /search/gtdb on gtdb_search_mtview.
+
+One expression index is created for each group of columns that can be searched
+(api.controller.search.SEARCH_FIELDS). These survive a REFRESH of the
+materialized view, but must be re-created if the view is dropped, i.e. for
+each new release database.
+
+    python scripts/release/create_search_indexes.py
+"""
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+import argparse
+import sys
+import time
+
+import sqlalchemy as sa
+
+from api.controller.search import SEARCH_FIELDS, search_document_sql
+from api.db import gtdb_engine, GTDB_DB_URL
+from api.db.gtdb import DbGtdbSearchMtView
+
+
+def confirm_database_selection():
+    gtdb_db = GTDB_DB_URL.split('/')[-1]
+
+    response = input(f'Creating indexes in GTDB {gtdb_db}. Is this OK? (Y/N)')
+    if response.upper() != 'Y':
+        print('Exiting.')
+        sys.exit(1)
+    print()
+
+
+def get_index_statements() -> list[tuple[str, str]]:
+    table = DbGtdbSearchMtView.__tablename__
+    out = list()
+    for search_field, list_fields in SEARCH_FIELDS.items():
+        name = f'{table}_trgm_{search_field.value}'
+        out.append((name, f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} '
+                          f'USING gin (({search_document_sql(list_fields)}) gin_trgm_ops)'))
+    return out
+
+
+def main(args):
+    statements = get_index_statements()
+    if args.dry_run:
+        print('CREATE EXTENSION IF NOT EXISTS pg_trgm;')
+        for _, statement in statements:
+            print(f'{statement};')
+        return
+
+    confirm_database_selection()
+
+    # Indexes cannot be built concurrently inside a transaction
+    with gtdb_engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(sa.text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        for name, statement in statements:
+            print(f'Creating {name}')
+            start = time.time()
+            conn.execute(sa.text(statement))
+            print(f'Done ({time.time() - start:.1f}s)')
+
+        print('Analyzing')
+        conn.execute(sa.text(f'ANALYZE {DbGtdbSearchMtView.__tablename__}'))
+    return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dry-run', help='Only print the statements that would be run.', action='store_true')
+    main(parser.parse_args())
@@ -0,0 +1,369 @@
+"""
+Refresh the materialized views that the API depends on, in dependency order.
+
+The dependencies between views (including through plain views) are read from
+the PostgreSQL catalog, so a view is only refreshed once every materialized
+view it reads from has been refreshed. Independent views are refreshed in
+parallel. REFRESH ... CONCURRENTLY is used where the view has a unique index
+(so reads are not blocked), otherwise a plain REFRESH is used.
+
+The duration of each refresh, and the modification counters of the tables each
+view reads from (pg_stat_user_tables), are recorded in a state file. Views whose
+tables are unchanged since their last refresh are skipped unless --full is given.
+
+    python scripts/release/refresh_materialized_views.py --dry-run
+    python scripts/release/refresh_materialized_views.py --workers 4
+"""
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+import sqlalchemy as sa
+
+from api.db import gtdb_engine, gtdb_web_engine, GTDB_DB_URL, GTDB_WEB_DB_URL
+from api.db.gtdb import (
+    DbGtdbSearchMtView, DbGtdbSpeciesClusterCount, DbGtdbTaxonomyMtView, DbMetadataMtView, DbMvGenomeCanonicalMarkers
+)
+from api.db.gtdb_web import DbTaxonHistoryMtView
+
+# The materialized views used by the API, for each database (upstream views are included automatically)
+DEFAULT_VIEWS = {
+    'gtdb': (
+        DbGtdbSearchMtView.__tablename__,
+        DbMetadataMtView.__tablename__,
+        DbGtdbSpeciesClusterCount.__tablename__,
+        DbGtdbTaxonomyMtView.__tablename__,
+        DbMvGenomeCanonicalMarkers.__tablename__,
+    ),
+    'gtdb_web': (
+        DbTaxonHistoryMtView.__tablename__,
+    ),
+}
+
+ENGINES = {
+    'gtdb': (gtdb_engine, GTDB_DB_URL.split('/')[-1]),
+    'gtdb_web': (gtdb_web_engine, GTDB_WEB_DB_URL.split('/')[-1]),
+}
+
+DEFAULT_STATE_PATH = os.path.expanduser('~/.gtdb_api_refresh_materialized_views.json')
+
+# All materialized views, as their regclass name (schema-qualified if not on the search path)
+QUERY_VIEWS = """
+SELECT format('%I.%I', schemaname, matviewname)::regclass::text AS name, ispopulated
+FROM pg_matviews
+"""
+
+# Materialized views that have a unique index usable by REFRESH ... CONCURRENTLY
+QUERY_UNIQUE_INDEXES = """
+SELECT DISTINCT i.indrelid::regclass::text AS name
+FROM pg_index i
+JOIN pg_class c ON c.oid = i.indrelid
+WHERE c.relkind = 'm' AND i.indisunique AND i.indisvalid AND i.indpred IS NULL AND i.indexprs IS NULL
+"""
+
+# The tables and materialized views each materialized view reads from, following plain views
+QUERY_DEPENDENCIES = """
+WITH RECURSIVE deps(view_oid, ref_oid) AS (
+    SELECT r.ev_class, d.refobjid
+    FROM pg_depend d
+    JOIN pg_rewrite r ON r.oid = d.objid
+    JOIN pg_class v ON v.oid = r.ev_class AND v.relkind = 'm'
+    WHERE d.classid = 'pg_rewrite'::regclass AND d.refclassid = 'pg_class'::regclass AND d.refobjid <> r.ev_class
+    UNION
+    SELECT deps.view_oid, d.refobjid
+    FROM deps
+    JOIN pg_class c ON c.oid = deps.ref_oid AND c.relkind = 'v'
+    JOIN pg_rewrite r ON r.ev_class = c.oid
+    JOIN pg_depend d ON d.objid = r.oid
+    WHERE d.classid = 'pg_rewrite'::regclass AND d.refclassid = 'pg_class'::regclass AND d.refobjid <> c.oid
+)
+SELECT DISTINCT deps.view_oid::regclass::text AS name, deps.ref_oid::regclass::text AS ref, c.relkind AS kind
+FROM deps
+JOIN pg_class c ON c.oid = deps.ref_oid
+WHERE c.relkind IN ('m', 'r', 'p')
+"""
+
+# Counters that change whenever rows are written to (or truncated from) a table
+QUERY_TABLE_COUNTERS = """
+SELECT relid::regclass::text AS name, n_tup_ins + n_tup_upd + n_tup_del AS n_changes, n_live_tup AS n_live
+FROM pg_stat_user_tables
+"""
+
+
+@dataclass
+class MatView:
+    db: str
+    name: str
+    populated: bool
+    concurrent: bool
+    depends_on: set[str] = field(default_factory=set)
+    tables: set[str] = field(default_factory=set)
+    sources: dict[str, list[int]] = field(default_factory=dict)
+    depth: int = 0
+    refresh: bool = True
+    reason: str = ''
+
+    @property
+    def key(self) -> tuple[str, str]:
+        return self.db, self.name
+
+
+def confirm_database_selection():
+    gtdb_db, web_db = ENGINES['gtdb'][1], ENGINES['gtdb_web'][1]
+
+    response = input(f'Refreshing materialized views in {gtdb_db} and {web_db}. Is this OK? (Y/N)')
+    if response.upper() != 'Y':
+        print('Exiting.')
+        sys.exit(1)
+    print()
+
+
+def read_views(db: str) -> dict[str, MatView]:
+    """Read every materialized view in this database, and what it depends on."""
+    engine = ENGINES[db][0]
+    with engine.connect() as conn:
+        concurrent = {row.name for row in conn.execute(sa.text(QUERY_UNIQUE_INDEXES))}
+        views = {row.name: MatView(db=db, name=row.name, populated=row.ispopulated, concurrent=row.name in concurrent)
+                 for row in conn.execute(sa.text(QUERY_VIEWS))}
+        counters = {row.name: [row.n_changes, row.n_live] for row in conn.execute(sa.text(QUERY_TABLE_COUNTERS))}
+        for row in conn.execute(sa.text(QUERY_DEPENDENCIES)):
+            if row.name not in views:
+                continue
+            if row.kind == 'm':
+                views[row.name].depends_on.add(row.ref)
+            else:
+                views[row.name].tables.add(row.ref)
+    for view in views.values():
+        view.sources = {x: counters.get(x, [-1, -1]) for x in sorted(view.tables)}
+    return views
+
+
+def select_views(views: dict[str, MatView], targets: set[str]) -> dict[str, MatView]:
+    """Returns the target views and every materialized view they (indirectly) depend on."""
+    out = dict()
+    queue = [x for x in views.values() if x.name in targets or x.name.split('.')[-1] in targets]
+    while queue:
+        view = queue.pop()
+        if view.name not in out:
+            out[view.name] = view
+            queue.extend(views[x] for x in view.depends_on if x in views)
+    return out
+
+
+def topological_order(views: dict[str, MatView]) -> list[MatView]:
+    """Sort the views so each is after those it depends on, setting the depth (stage) of each view."""
+    out, done, visiting = list(), set(), set()
+
+    def visit(view: MatView):
+        if view.name in done:
+            return
+        if view.name in visiting:
+            raise ValueError(f'Circular dependency involving {view.name}')
+        visiting.add(view.name)
+        parents = [views[x] for x in sorted(view.depends_on) if x in views]
+        for parent in parents:
+            visit(parent)
+        view.depth = max((x.depth + 1 for x in parents), default=0)
+        visiting.discard(view.name)
+        done.add(view.name)
+        out.append(view)
+
+    for cur_view in sorted(views.values(), key=lambda x: x.name):
+        visit(cur_view)
+    return out
+
+
+def previous_refresh(db: str, name: str, state: dict) -> dict | None:
+    return state.get(ENGINES[db][1], dict()).get(name)
+
+
+def plan_refresh(ordered: list[MatView], state: dict, full: bool):
+    """Decide which views need refreshing, a view is refreshed if its tables or upstream views changed."""
+    refreshed = set()
+    for view in ordered:
+        previous = previous_refresh(view.db, view.name, state)
+        upstream = sorted(x for x in view.depends_on if (view.db, x) in refreshed)
+        upstream_newer = list()
+        if previous is not None:
+            for parent in sorted(view.depends_on):
+                parent_previous = previous_refresh(view.db, parent, state)
+                if parent_previous is not None and parent_previous['refreshed'] > previous['refreshed']:
+                    upstream_newer.append(parent)
+        if full:
+            view.reason = 'full refresh requested'
+        elif not view.populated:
+            view.reason = 'not populated'
+        elif previous is None:
+            view.reason = 'no previous refresh recorded'
+        elif upstream:
+            view.reason = f'upstream refreshed ({", ".join(upstream)})'
+        elif upstream_newer:
+            view.reason = f'upstream refreshed since ({", ".join(upstream_newer)})'
+        elif previous.get('sources') != view.sources:
+            view.reason = 'source tables changed'
+        else:
+            view.refresh, view.reason = False, 'unchanged since last refresh'
+        if view.refresh:
+            refreshed.add(view.key)
+
+
+def previous_seconds(view: MatView, state: dict) -> float | None:
+    previous = previous_refresh(view.db, view.name, state)
+    return previous.get('seconds') if previous else None
+
+
+def print_plan(ordered: list[MatView], state: dict):
+    print(f'{"database":<10}{"stage":>6}  {"mode":<11}{"last (s)":>9}  {"view":<45}action')
+    d_finish = dict()
+    for view in ordered:
+        seconds = previous_seconds(view, state)
+        mode = 'concurrent' if view.concurrent and view.populated else 'blocking'
+        action = 'refresh' if view.refresh else 'skip'
+        last = f'{seconds:.1f}' if seconds is not None else '-'
+        print(f'{view.db:<10}{view.depth:>6}  {mode:<11}{last:>9}  {view.name:<45}{action} ({view.reason})')
+
+        # Estimate the critical path using the previous durations
+        start = max((d_finish.get((view.db, x), 0.0) for x in view.depends_on), default=0.0)
+        d_finish[view.key] = start + ((seconds or 0.0) if view.refresh else 0.0)
+    if d_finish:
+        print(f'\nEstimated time with unlimited workers: {max(d_finish.values()):.1f}s '
+              f'(serial: {sum((previous_seconds(x, state) or 0.0) for x in ordered if x.refresh):.1f}s)')
+
+
+def refresh_view(view: MatView) -> float:
+    """Refresh (and analyze) a materialized view, returning the number of seconds taken."""
+    concurrently = 'CONCURRENTLY ' if view.concurrent and view.populated else ''
+    start = time.time()
+
+    # Each refresh commits on its own connection, so independent views run in parallel
+    with ENGINES[view.db][0].connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(sa.text(f'REFRESH MATERIALIZED VIEW {concurrently}{view.name}'))
+        conn.execute(sa.text(f'ANALYZE {view.name}'))
+    return time.time() - start
+
+
+def read_state(path: str) -> dict:
+    if not os.path.isfile(path):
+        return dict()
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_state(path: str, state: dict):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def run_refresh(ordered: list[MatView], workers: int, state: dict, path_state: str) -> list[MatView]:
+    """Refresh each view once those it depends on are done, longest (previous duration) first.
+
+    Returns the views that failed, or were not refreshed as a view they depend on failed.
+    """
+    to_refresh = {x.key: x for x in ordered if x.refresh}
+    waiting_on = {k: {(v.db, x) for x in v.depends_on if (v.db, x) in to_refresh} for k, v in to_refresh.items()}
+    failed = list()
+
+    def ready() -> list[MatView]:
+        keys = [k for k, deps in waiting_on.items() if not deps]
+        for k in keys:
+            del waiting_on[k]
+        return sorted((to_refresh[k] for k in keys), key=lambda x: -(previous_seconds(x, state) or 0.0))
+
+    def drop_dependents(key: tuple[str, str]):
+        for k in [k for k, deps in waiting_on.items() if key in deps]:
+            del waiting_on[k]
+            print(f'Skipping {k[1]} ({k[0]}), as {key[1]} failed.')
+            failed.append(to_refresh[k])
+            drop_dependents(k)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = dict()
+        for view in ready():
+            print(f'Refreshing {view.name} ({view.db})')
+            running[executor.submit(refresh_view, view)] = view
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                view = running.pop(future)
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    print(f'Failed to refresh {view.name} ({view.db}): {e}')
+                    failed.append(view)
+                    drop_dependents(view.key)
+                    continue
+
+                print(f'Refreshed {view.name} ({view.db}) in {seconds:.1f}s')
+                state.setdefault(ENGINES[view.db][1], dict())[view.name] = {
+                    'refreshed': int(time.time()),
+                    'seconds': round(seconds, 3),
+                    'concurrent': view.concurrent and view.populated,
+                    'sources': view.sources,
+                }
+                write_state(path_state, state)
+                for deps in waiting_on.values():
+                    deps.discard(view.key)
+            for view in ready():
+                print(f'Refreshing {view.name} ({view.db})')
+                running[executor.submit(refresh_view, view)] = view
+    return failed
+
+
+def main(args):
+    state = read_state(args.state)
+    d_db_to_targets = {db: set(args.views) if args.views else set(views) for db, views in DEFAULT_VIEWS.items()}
+
+    print('Reading materialized views and their dependencies')
+    views, found = dict(), set()
+    for db, targets in d_db_to_targets.items():
+        selected = select_views(read_views(db), targets)
+        found.update(selected, (x.split('.')[-1] for x in selected))
+        views.update({(db, k): v for k, v in selected.items()})
+    for name in sorted(set.union(*d_db_to_targets.values()) - found):
+        print(f'Warning: {name} is not a materialized view, skipping.')
+
+    # Views in different databases cannot depend on each other, so they are ordered separately
+    ordered = list()
+    for db in d_db_to_targets:
+        ordered.extend(topological_order({k: v for (cur_db, k), v in views.items() if cur_db == db}))
+    plan_refresh(ordered, state, args.full)
+    print_plan(ordered, state)
+
+    n_refresh = sum(x.refresh for x in ordered)
+    if args.dry_run or n_refresh == 0:
+        return
+
+    # Confirm this is the correct database
+    if not args.yes:
+        confirm_database_selection()
+
+    start = time.time()
+    failed = run_refresh(ordered, args.workers, state, args.state)
+    print(f'Refreshed {n_refresh - len(failed):,} views in {time.time() - start:.1f}s, {len(failed):,} failed.')
+    if len(failed) > 0:
+        sys.exit(1)
+    return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--views', help='Only refresh these views (and those they depend on).', nargs='+')
+    parser.add_argument('--workers', help='Number of views to refresh concurrently.', type=int, default=4)
+    parser.add_argument('--full', help='Refresh all views, even if their tables are unchanged.', action='store_true')
+    parser.add_argument('--state', help='File recording the duration and sources of each refresh.',
+                        default=DEFAULT_STATE_PATH)
+    parser.add_argument('--dry-run', help='Only print the refresh plan.', action='store_true')
+    parser.add_argument('--yes', help='Do not prompt to confirm the database selection.', action='store_true')
+    main(parser.parse_args())
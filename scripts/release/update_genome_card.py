@@ -0,0 +1,147 @@
+"""
+Precompute the genome card of every genome in the release into gtdb_web.
+
+Each card is stored as a JSONB document keyed by the canonical genome id, so
+that /genome/{accession}/card is a single primary key lookup. The card is only
+returned for the accessions that the gtdb database would match (the GTDB and
+NCBI GenBank accessions). Otherwise (e.g. the table is stale, or the accession is
+a UBA alias) the card is built from the gtdb database.
+
+This must be run after the gtdb_web tables that the card depends on have been
+populated (e.g. update_genome_taxid.py).
+
+    python scripts/release/update_genome_card.py --workers 8
+"""
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+import argparse
+import asyncio
+import sys
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from tqdm import tqdm
+
+from api.controller.genome import build_genome_card
+from api.db import gtdb_engine, gtdb_web_engine, gtdb_async_engine, gtdb_web_async_engine
+from api.db import GTDB_DB_URL, GTDB_WEB_DB_URL
+from api.db.gtdb import DbGenomes
+from api.db.gtdb_web import DbGenomeCard
+from api.util.accession import canonical_gid
+from api.util.collection import iter_batches
+
+
+def confirm_database_selection():
+    gtdb_db = GTDB_DB_URL.split('/')[-1]
+    web_db = GTDB_WEB_DB_URL.split('/')[-1]
+
+    response = input(f'Using GTDB {gtdb_db}, writing to {web_db}. Is this OK? (Y/N)')
+    if response.upper() != 'Y':
+        print('Exiting.')
+        sys.exit(1)
+    print()
+
+
+def read_genome_accessions() -> list[str]:
+    with Session(gtdb_engine) as db:
+        query = sa.select(DbGenomes.id_at_source).order_by(DbGenomes.id_at_source)
+        return list(db.execute(query).scalars().all())
+
+
+def create_table(truncate: bool):
+    SQLModel.metadata.create_all(gtdb_web_engine, tables=[DbGenomeCard.__table__])
+    if truncate:
+        with Session(gtdb_web_engine) as db:
+            db.execute(sa.text(f'TRUNCATE TABLE {DbGenomeCard.__tablename__}'))
+            db.commit()
+
+
+def insert_rows(rows: list[dict]):
+    with Session(gtdb_web_engine) as db:
+        query = insert(DbGenomeCard).values(rows)
+        query = query.on_conflict_do_update(
+            index_elements=[DbGenomeCard.gid],
+            set_={'accessions': query.excluded.accessions, 'payload': query.excluded.payload}
+        )
+        db.execute(query)
+        db.commit()
+
+
+async def build_batch(accessions: list[str]) -> tuple[list[dict], list[str]]:
+    """Build the cards for a batch of genomes, re-using one session per database."""
+    rows, failed = list(), list()
+    async with AsyncSession(gtdb_async_engine) as db_gtdb, AsyncSession(gtdb_web_async_engine) as db_web:
+        for accession in accessions:
+            try:
+                card = await build_genome_card(accession, db_gtdb, db_web)
+            except Exception as e:
+                print(f'Unable to build the card for {accession}: {e}')
+                failed.append(accession)
+                continue
+            card_accessions = {accession}
+            if card.metadata_ncbi is not None and card.metadata_ncbi.ncbi_genbank_assembly_accession is not None:
+                card_accessions.add(card.metadata_ncbi.ncbi_genbank_assembly_accession)
+            rows.append({
+                'gid': canonical_gid(accession),
+                'accessions': sorted(card_accessions),
+                'payload': card.model_dump(mode='json')
+            })
+    return rows, failed
+
+
+async def build_cards(accessions: list[str], batch_size: int, workers: int) -> list[str]:
+    semaphore = asyncio.Semaphore(workers)
+
+    async def worker(batch):
+        async with semaphore:
+            rows, failed = await build_batch(batch)
+            if rows:
+                await asyncio.to_thread(insert_rows, rows)
+        return len(batch), failed
+
+    batches = list(iter_batches(accessions, batch_size))
+    failed = list()
+    with tqdm(total=len(accessions)) as p_bar:
+        for future in asyncio.as_completed([worker(batch) for batch in batches]):
+            n_done, batch_failed = await future
+            failed.extend(batch_failed)
+            p_bar.update(n_done)
+    await gtdb_async_engine.dispose()
+    await gtdb_web_async_engine.dispose()
+    return failed
+
+
+def main(args):
+    # Confirm this is the correct database
+    if not args.yes:
+        confirm_database_selection()
+
+    print('Creating the genome card table')
+    create_table(args.truncate)
+
+    print('Collecting genomes from the GTDB release')
+    accessions = read_genome_accessions()
+    print(f'Found {len(accessions):,} genomes.')
+
+    print('Building genome cards')
+    failed = asyncio.run(build_cards(accessions, args.batch_size, args.workers))
+
+    print(f'Stored {len(accessions) - len(failed):,} genome cards, {len(failed):,} failed.')
+    if len(failed) > 0:
+        sys.exit(1)
+    return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', help='Number of batches to build concurrently.', type=int, default=4)
+    parser.add_argument('--batch-size', help='Number of cards to build and insert per batch.', type=int, default=500)
+    parser.add_argument('--truncate', help='Remove all existing cards before building.', action='store_true')
+    parser.add_argument('--yes', help='Do not prompt to confirm the database selection.', action='store_true')
+    main(parser.parse_args())
@@ -0,0 +1,78 @@
+"""
+Summarise taxon_hist (one row per genome per release) into taxon_hist_summary.
+
+Each taxon is stored once with the first and last GTDB release it was seen in,
+and if it is present in the current release. The API loads the taxa that are
+not in the current release into memory for /taxon/{taxon}/previous-releases.
+
+This must be run after taxon_hist has been populated for the new release, then
+the API reloaded (SIGHUP) or restarted.
+
+    python scripts/release/update_taxon_hist_summary.py
+"""
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+import argparse
+import sys
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, SQLModel
+from tqdm import tqdm
+
+from api.config import CURRENT_RELEASE, GTDB_RELEASES
+from api.controller.taxon import read_taxon_history_rows
+from api.db import gtdb_web_engine, GTDB_WEB_DB_URL
+from api.db.gtdb_web import DbTaxonHistSummary
+from api.util.collection import iter_batches
+from api.util.taxon_history import summarise_taxon_history
+
+
+def confirm_database_selection():
+    web_db = GTDB_WEB_DB_URL.split('/')[-1]
+
+    response = input(f'Writing to {web_db} (current release {CURRENT_RELEASE}). Is this OK? (Y/N)')
+    if response.upper() != 'Y':
+        print('Exiting.')
+        sys.exit(1)
+    print()
+
+
+def main(args):
+    print('Reading the distinct taxa of each release from taxon_hist')
+    with Session(gtdb_web_engine) as db:
+        rows = read_taxon_history_rows(db)
+    print(f'Found {len(rows):,} (taxon, release) pairs.')
+
+    entries = summarise_taxon_history(rows, GTDB_RELEASES, CURRENT_RELEASE)
+    n_previous = sum(not x.present_in_current for x in entries)
+    print(f'Summarised into {len(entries):,} taxa ({n_previous:,} not in {CURRENT_RELEASE}).')
+
+    if args.dry_run:
+        return
+
+    # Confirm this is the correct database
+    if not args.yes:
+        confirm_database_selection()
+
+    # The table is replaced in a single transaction, so the API never reads a partial summary
+    SQLModel.metadata.create_all(gtdb_web_engine, tables=[DbTaxonHistSummary.__table__])
+    with Session(gtdb_web_engine) as db:
+        db.execute(sa.text(f'TRUNCATE TABLE {DbTaxonHistSummary.__tablename__}'))
+        for batch in tqdm(list(iter_batches(entries, args.batch_size))):
+            db.execute(insert(DbTaxonHistSummary).values([x._asdict() for x in batch]))
+        db.commit()
+    print(f'Stored {len(entries):,} taxa in {DbTaxonHistSummary.__tablename__}.')
+    return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-size', help='Number of rows to insert per statement.', type=int, default=5000)
+    parser.add_argument('--dry-run', help='Only summarise the taxa, do not write them.', action='store_true')
+    parser.add_argument('--yes', help='Do not prompt to confirm the database selection.', action='store_true')
+    main(parser.parse_args())
@@ -0,0 +1,184 @@
+"""
+Precompute the summary statistics of every taxon in the release into gtdb_web.
+
+The taxonomy, species representative flag, and GC% of every genome are read in
+a single scan, then aggregated for each rank using NumPy group-bys. Each taxon
+is stored with its genome count, higher ranks, GC% summary and a fixed-resolution
+GC% histogram, so /taxon/{taxon}/card and /taxon/{taxon}/gc-histogram-bins are
+a single primary key lookup. Taxa that are not present fall back to the gtdb database.
+
+    python scripts/release/update_taxon_stats.py
+"""
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+import argparse
+import sys
+
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, SQLModel
+from tqdm import tqdm
+
+from api.db import gtdb_engine, gtdb_web_engine
+from api.db import GTDB_DB_URL, GTDB_WEB_DB_URL
+from api.db.gtdb import DbMetadataNucleotide, DbMetadataTaxonomy
+from api.db.gtdb_web import DbTaxonStats
+from api.util.collection import iter_batches
+from api.util.histogram import GC_HISTOGRAM_RESOLUTION
+
+RANK_COLUMNS = (
+    DbMetadataTaxonomy.gtdb_domain,
+    DbMetadataTaxonomy.gtdb_phylum,
+    DbMetadataTaxonomy.gtdb_class,
+    DbMetadataTaxonomy.gtdb_order,
+    DbMetadataTaxonomy.gtdb_family,
+    DbMetadataTaxonomy.gtdb_genus,
+    DbMetadataTaxonomy.gtdb_species,
+)
+
+
+def confirm_database_selection():
+    gtdb_db = GTDB_DB_URL.split('/')[-1]
+    web_db = GTDB_WEB_DB_URL.split('/')[-1]
+
+    response = input(f'Using GTDB {gtdb_db}, writing to {web_db}. Is this OK? (Y/N)')
+    if response.upper() != 'Y':
+        print('Exiting.')
+        sys.exit(1)
+    print()
+
+
+def read_genomes() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the taxonomy (genomes x ranks), species representative flag, and GC% (NaN if missing)."""
+    with Session(gtdb_engine) as db:
+        query = (
+            sa.select(*RANK_COLUMNS, DbMetadataTaxonomy.gtdb_representative, DbMetadataNucleotide.gc_percentage)
+            .outerjoin(DbMetadataNucleotide, DbMetadataNucleotide.id == DbMetadataTaxonomy.id)
+        )
+        rows = db.execute(query).fetchall()
+    taxonomy = np.array([[x or '' for x in row[:len(RANK_COLUMNS)]] for row in rows], dtype=object)
+    is_rep = np.array([row[-2] is True for row in rows], dtype=bool)
+    gc = np.array([row[-1] if row[-1] is not None else np.nan for row in rows], dtype=np.float64)
+    return taxonomy.reshape(len(rows), len(RANK_COLUMNS)), is_rep, gc
+
+
+def encode_ranks(taxonomy: np.ndarray) -> tuple[list[np.ndarray], list[np.ndarray]]:
+    """Assign each genome an index for the taxon it belongs to at each rank, returns the (sorted) names and codes."""
+    names, codes = list(), list()
+    for rank_idx in range(taxonomy.shape[1]):
+        cur_names, cur_codes = np.unique(taxonomy[:, rank_idx].astype(str), return_inverse=True)
+        names.append(cur_names)
+        codes.append(cur_codes.astype(np.int64))
+    return names, codes
+
+
+def aggregate_rank(rank_idx: int, codes: list[np.ndarray], names: list[np.ndarray],
+                   is_rep: np.ndarray, gc: np.ndarray) -> list[dict]:
+    """Aggregate the genomes by the taxa of this rank, codes[i] is the taxon index of each genome at rank i."""
+    cur_codes, cur_names = codes[rank_idx], names[rank_idx]
+    n_taxa = len(cur_names)
+    has_gc = ~np.isnan(gc)
+    gc_codes, gc_values = cur_codes[has_gc], gc[has_gc]
+
+    n_genomes = np.bincount(cur_codes, minlength=n_taxa)
+    n_sp_reps = np.bincount(cur_codes, weights=is_rep, minlength=n_taxa).astype(np.int64)
+    gc_n = np.bincount(gc_codes, minlength=n_taxa)
+    gc_sum = np.bincount(gc_codes, weights=gc_values, minlength=n_taxa)
+    gc_min = np.full(n_taxa, np.inf)
+    gc_max = np.full(n_taxa, -np.inf)
+    np.minimum.at(gc_min, gc_codes, gc_values)
+    np.maximum.at(gc_max, gc_codes, gc_values)
+
+    # The histogram is sparse (taxon, bin) counts, sorted by taxon then bin
+    gc_bins = np.floor(gc_values / GC_HISTOGRAM_RESOLUTION + 1e-9).astype(np.int64)
+    n_gc_bins = int(gc_bins.max()) + 1 if len(gc_bins) > 0 else 1
+    hist_keys, hist_counts = np.unique(gc_codes * n_gc_bins + gc_bins, return_counts=True)
+    hist_codes, hist_bins = np.divmod(hist_keys, n_gc_bins)
+    hist_bounds = np.searchsorted(hist_codes, np.arange(n_taxa + 1))
+
+    # The higher ranks are only reported if they are the same for every genome in the taxon
+    first_idx = np.unique(cur_codes, return_index=True)[1]
+    consistent = np.ones(n_taxa, dtype=bool)
+    for higher_codes in codes[:rank_idx]:
+        lowest = np.full(n_taxa, np.iinfo(np.int64).max)
+        highest = np.full(n_taxa, -1)
+        np.minimum.at(lowest, cur_codes, higher_codes)
+        np.maximum.at(highest, cur_codes, higher_codes)
+        consistent &= lowest == highest
+
+    out = list()
+    for i, taxon in enumerate(cur_names):
+        # Skip genomes that are not assigned at this rank (e.g. "g__")
+        if len(taxon) <= 3:
+            continue
+        start, end = hist_bounds[i], hist_bounds[i + 1]
+        higher_ranks = None
+        if consistent[i]:
+            higher_ranks = [str(names[j][codes[j][first_idx[i]]]) for j in range(rank_idx)]
+        out.append({
+            'taxon': str(taxon),
+            'n_genomes': int(n_genomes[i]),
+            'n_sp_reps': int(n_sp_reps[i]),
+            'higher_ranks': higher_ranks,
+            'gc_n': int(gc_n[i]),
+            'gc_min': float(gc_min[i]) if gc_n[i] > 0 else None,
+            'gc_max': float(gc_max[i]) if gc_n[i] > 0 else None,
+            'gc_mean': float(gc_sum[i] / gc_n[i]) if gc_n[i] > 0 else None,
+            'gc_bin_width': GC_HISTOGRAM_RESOLUTION,
+            'gc_bin_start': int(hist_bins[start]) if end > start else 0,
+            'gc_counts': histogram_counts(hist_bins[start:end], hist_counts[start:end])
+        })
+    return out
+
+
+def histogram_counts(bins: np.ndarray, counts: np.ndarray) -> list[int]:
+    """Expand the sparse (bin, count) pairs of a taxon into dense counts from the first bin."""
+    if len(bins) == 0:
+        return list()
+    out = np.zeros(bins[-1] - bins[0] + 1, dtype=np.int64)
+    out[bins - bins[0]] = counts
+    return out.tolist()
+
+
+def main(args):
+    print('Reading the taxonomy and GC% of all genomes')
+    taxonomy, is_rep, gc = read_genomes()
+    print(f'Found {len(taxonomy):,} genomes.')
+
+    names, codes = encode_ranks(taxonomy)
+
+    rows = list()
+    for rank_idx in tqdm(range(len(RANK_COLUMNS))):
+        rows.extend(aggregate_rank(rank_idx, codes, names, is_rep, gc))
+    n_inconsistent = sum(x['higher_ranks'] is None for x in rows)
+    print(f'Aggregated {len(rows):,} taxa ({n_inconsistent:,} with inconsistent higher ranks).')
+
+    if args.dry_run:
+        return
+
+    # Confirm this is the correct database
+    if not args.yes:
+        confirm_database_selection()
+
+    # The table is replaced in a single transaction, so the API never reads partial statistics
+    SQLModel.metadata.create_all(gtdb_web_engine, tables=[DbTaxonStats.__table__])
+    with Session(gtdb_web_engine) as db:
+        db.execute(sa.text(f'TRUNCATE TABLE {DbTaxonStats.__tablename__}'))
+        for batch in tqdm(list(iter_batches(rows, args.batch_size))):
+            db.execute(insert(DbTaxonStats).values(batch))
+        db.commit()
+    print(f'Stored {len(rows):,} taxa in {DbTaxonStats.__tablename__}.')
+    return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch-size', help='Number of rows to insert per statement.', type=int, default=2000)
+    parser.add_argument('--dry-run', help='Only aggregate the taxa, do not write them.', action='store_true')
+    parser.add_argument('--yes', help='Do not prompt to confirm the database selection.', action='store_true')
+    main(parser.parse_args())
@@ -0,0 +1,114 @@
+"""
+Warm the response cache of an API instance that is serving a new release.
+
+The most requested GET endpoints are read from an access log (nginx combined
+or uvicorn format) and replayed over HTTP against the new instance before
+cutover. Responses of endpoints decorated with @cached are written to the disk
+tier of the cache, which is shared by every process using the same CACHE_DIR.
+As the cache is namespaced by release, the new instance must share CACHE_DIR
+with production and be configured with the new release databases.
+
+Other caches are only warmed on the instance that is requested (i.e. the
+in-memory tier of each process and the database buffers), so these are only
+useful if that instance is the one that serves the release.
+
+    python scripts/release/warm_cache.py /var/log/nginx/access.log http://localhost:9001 --top 5000
+"""
+
+import argparse
+import re
+import sys
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter, Retry
+from tqdm import tqdm
+
+# Matches the request line and status code, e.g. "GET /taxon/d__Bacteria HTTP/1.1" 200
+RE_REQUEST = re.compile(r'"GET (?P<path>/\S*) HTTP/[\d.]+" (?P<status>\d{3})')
+
+# Endpoints that are user-specific, or otherwise not worth warming
+DEFAULT_EXCLUDE = ('/status', '/meta', '/skani', '/fastani', '/ani', '/util', '/robots.txt')
+
+RETRY = Retry(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=[502, 503, 504]
+)
+
+
+def normalise_path(path: str) -> str:
+    """Sort the query parameters, this mirrors the key used by the API cache."""
+    if '?' not in path:
+        return path
+    path, query = path.split('?', 1)
+    if not query:
+        return path
+    return f'{path}?{"&".join(sorted(query.split("&")))}'
+
+
+def read_top_paths(path_log: str, top: int, exclude: tuple[str, ...]) -> list[tuple[str, int]]:
+    counts = Counter()
+    with open(path_log, errors='replace') as f:
+        for line in f:
+            hit = RE_REQUEST.search(line)
+            if not hit or not hit.group('status').startswith('2'):
+                continue
+            path = normalise_path(hit.group('path'))
+            if path == '/' or path.startswith(exclude):
+                continue
+            counts[path] += 1
+    return counts.most_common(top)
+
+
+def warm_path(session: requests.Session, url: str, timeout: int) -> tuple[str, int | None, float]:
+    try:
+        r = session.get(url, timeout=timeout)
+        return url, r.status_code, r.elapsed.total_seconds()
+    except requests.RequestException as e:
+        print(f'Error requesting {url}: {e}')
+        return url, None, 0.0
+
+
+def main(args):
+    print(f'Reading the top {args.top:,} requests from {args.access_log}')
+    top_paths = read_top_paths(args.access_log, args.top, tuple(args.exclude))
+    print(f'Found {len(top_paths):,} distinct requests to warm.')
+
+    if args.dry_run:
+        for path, count in top_paths:
+            print(f'{count}\t{path}')
+        return
+
+    session = requests.Session()
+    adapter = HTTPAdapter(max_retries=RETRY, pool_maxsize=args.workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    base_url = args.url.rstrip('/')
+    n_failed, total_time = 0, 0.0
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(warm_path, session, f'{base_url}{path}', args.timeout) for path, _ in top_paths]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            url, status_code, elapsed = future.result()
+            total_time += elapsed
+            if status_code is None or status_code >= 500:
+                n_failed += 1
+
+    print(f'Warmed {len(top_paths) - n_failed:,} requests ({total_time:.1f}s total server time), {n_failed:,} failed.')
+    if n_failed > 0:
+        sys.exit(1)
+    return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('access_log', help='Path to the access log to read requests from.')
+    parser.add_argument('url', help='Base URL of the API instance serving the new release.')
+    parser.add_argument('--top', help='Number of the most requested paths to warm.', type=int, default=1000)
+    parser.add_argument('--workers', help='Number of concurrent requests.', type=int, default=4)
+    parser.add_argument('--timeout', help='Timeout for each request (seconds).', type=int, default=300)
+    parser.add_argument('--exclude', help='Path prefixes to skip.', nargs='*', default=list(DEFAULT_EXCLUDE))
+    parser.add_argument('--dry-run', help='Only print the requests that would be made.', action='store_true')
+    main(parser.parse_args())
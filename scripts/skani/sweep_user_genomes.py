@@ -0,0 +1,97 @@
+"""
+Remove the uploaded genomes in ANI_USER_GENOME_DIR that are no longer needed.
+
+Files are shared between jobs with identical uploads, so a file is only removed
+once no job that is still retained references it (i.e. every job is deleted, or
+past its delete_after_ts). Temporary files left behind by an interrupted upload
+are removed once they are older than --tmp-max-age hours.
+
+This should be run periodically (e.g. after jobs are deleted).
+
+    python scripts/skani/sweep_user_genomes.py --dry-run
+"""
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import sqlalchemy as sa
+import sqlmodel as sm
+from sqlmodel import Session
+
+from api.config import ANI_USER_GENOME_DIR
+from api.db import gtdb_common_engine
+from api.db.common import DbSkaniJob, DbSkaniUserGenome
+from api.util.collection import iter_batches
+from api.util.io import CONTENT_STORE_TMP_PREFIX, content_addressed_path
+
+
+def read_stored_files(root: Path) -> tuple[dict[str, Path], list[Path]]:
+    """Returns the stored files by their sha256 hash, and the temporary files."""
+    stored, tmp = dict(), list()
+    for dir_path, _, file_names in os.walk(root):
+        for file_name in file_names:
+            path = Path(dir_path) / file_name
+            if file_name.startswith(CONTENT_STORE_TMP_PREFIX):
+                tmp.append(path)
+                continue
+            sha256_hex = file_name.split('.')[0]
+            if path == content_addressed_path(root, sha256_hex):
+                stored[sha256_hex] = path
+    return stored, tmp
+
+
+def read_retained_hashes(hashes: list[str], db: Session, batch_size: int = 10000) -> set[str]:
+    """Returns the hashes that are referenced by a job that has not been deleted."""
+    out = set()
+    for batch in iter_batches(hashes, batch_size):
+        query = (
+            sm.select(DbSkaniUserGenome.sha256)
+            .join(DbSkaniJob, DbSkaniJob.id == DbSkaniUserGenome.job_id)
+            .where(DbSkaniUserGenome.sha256.in_(batch))
+            .where(DbSkaniJob.deleted == False)
+            .where(sa.or_(DbSkaniJob.delete_after_ts == None, DbSkaniJob.delete_after_ts > sm.func.now()))
+            .distinct()
+        )
+        out.update(db.exec(query).all())
+    return out
+
+
+def main(args):
+    if ANI_USER_GENOME_DIR is None:
+        print('ANI_USER_GENOME_DIR is not set.')
+        sys.exit(1)
+
+    print(f'Reading the files in {ANI_USER_GENOME_DIR}')
+    stored, tmp = read_stored_files(ANI_USER_GENOME_DIR)
+    min_tmp_mtime = time.time() - args.tmp_max_age * 60 * 60
+    tmp = [x for x in tmp if x.stat().st_mtime < min_tmp_mtime]
+    print(f'Found {len(stored):,} stored genomes and {len(tmp):,} expired temporary files.')
+
+    with Session(gtdb_common_engine) as db:
+        # Block new uploads until the files have been removed, otherwise a job could
+        # reference a file after it was checked (uploads are added after their job is committed)
+        db.execute(sa.text(f'LOCK TABLE {DbSkaniUserGenome.__table__.fullname} IN SHARE MODE'))
+        retained = read_retained_hashes(sorted(stored), db)
+        to_remove = [path for sha256_hex, path in stored.items() if sha256_hex not in retained] + tmp
+        print(f'Removing {len(to_remove):,} files.')
+        if not args.dry_run:
+            for path in to_remove:
+                path.unlink(missing_ok=True)
+        db.rollback()
+    print('Done.')
+    return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tmp-max-age', help='Remove temporary files older than this (hours).', type=float, default=24)
+    parser.add_argument('--dry-run', help='Only report the files that would be removed.', action='store_true')
+    main(parser.parse_args())
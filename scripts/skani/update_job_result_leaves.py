@@ -0,0 +1,92 @@
+"""
+Create the skani.job_result_leaves table, and optionally store the heatmap leaf
+order of every completed job that does not yet have one.
+
+The leaf order is otherwise computed (and stored) on the first request for the
+heatmap of a job, so the backfill is only needed to avoid that first slow request.
+
+Orders are stored with the clustering method (CLUSTER_LEAVES_METHOD), and those
+from any other method (e.g. before ANI_HEATMAP_OPTIMAL_ORDERING_MAX_GENOMES was
+changed) are removed.
+
+    python scripts/skani/update_job_result_leaves.py --backfill
+"""
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+import argparse
+
+import sqlmodel as sm
+from sqlmodel import Session, SQLModel
+from tqdm import tqdm
+
+from api.controller.skani import (
+    util_get_heatmap_leaves, util_get_job_query_reference_genomes, util_get_job_results, util_merge_job_results
+)
+from api.db import gtdb_common_engine
+from api.db.common import DbSkaniJob, DbSkaniJobResult, DbSkaniJobResultLeaves
+from api.util.matrix import CLUSTER_LEAVES_METHOD
+
+
+def read_jobs_without_leaves(db: Session) -> list:
+    query = (
+        sm.select(DbSkaniJob.id, DbSkaniJob.mode)
+        .join(DbSkaniJobResult, DbSkaniJobResult.job_id == DbSkaniJob.id)
+        .where(DbSkaniJob.completed != None)
+        .where(DbSkaniJob.error.is_not(True))
+        .where(DbSkaniJob.deleted == False)
+        .where(~sm.exists()
+               .where(DbSkaniJobResultLeaves.job_id == DbSkaniJob.id)
+               .where(DbSkaniJobResultLeaves.method == CLUSTER_LEAVES_METHOD))
+        .order_by(DbSkaniJob.id)
+    )
+    return list(db.exec(query).all())
+
+
+def store_job_leaves(job_id: int, mode, db: Session):
+    query_list, reference_list = list(), list()
+    for g in util_get_job_query_reference_genomes(job_id, db):
+        if g['source'] == 'query':
+            query_list.append(g['id'])
+        elif g['source'] == 'reference':
+            reference_list.append(g['id'])
+    job_results = util_get_job_results(job_id, qry_ids=query_list, ref_ids=reference_list, mode=mode, db=db)
+    arr_ani, arr_af = util_merge_job_results(job_results)
+    symmetric = job_results.qry_ids == job_results.ref_ids
+    util_get_heatmap_leaves(job_id, 'ani', arr_ani, symmetric, db)
+    util_get_heatmap_leaves(job_id, 'af', arr_af, symmetric, db)
+
+
+def create_table():
+    SQLModel.metadata.create_all(gtdb_common_engine, tables=[DbSkaniJobResultLeaves.__table__])
+    with Session(gtdb_common_engine) as db:
+        # Orders from other methods will never be used
+        n_deleted = db.exec(
+            sm.delete(DbSkaniJobResultLeaves).where(DbSkaniJobResultLeaves.method != CLUSTER_LEAVES_METHOD)
+        ).rowcount
+        print(f'Removed {n_deleted:,} leaf orders from other methods.')
+        db.commit()
+
+
+def main(args):
+    print(f'Creating the job result leaves table (method: {CLUSTER_LEAVES_METHOD})')
+    create_table()
+
+    if not args.backfill:
+        return
+
+    with Session(gtdb_common_engine) as db:
+        jobs = read_jobs_without_leaves(db)
+        print(f'Found {len(jobs):,} completed jobs without a leaf order.')
+        for job in tqdm(jobs):
+            store_job_leaves(job.id, job.mode, db)
+    return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backfill', help='Store the leaf order of all completed jobs.', action='store_true')
+    main(parser.parse_args())
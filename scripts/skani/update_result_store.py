@@ -0,0 +1,139 @@
+"""
+Copy the results of completed skani jobs into the pairwise result store
+(skani.result), so that later jobs with the same parameters that only contain
+known pairs are completed at creation instead of being queued.
+
+Only jobs where every genome is from NCBI are copied, as uploaded genomes are
+specific to a job. This is safe to re-run (e.g. periodically), existing pairs
+are kept.
+
+    python scripts/skani/update_result_store.py --min-job-id 0
+"""
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+import argparse
+
+import sqlalchemy as sa
+import sqlmodel as sm
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import Session
+from tqdm import tqdm
+
+from api.controller.skani import util_get_job_query_reference_genomes, util_get_job_results
+from api.db import gtdb_common_engine
+from api.db.common import DbSkaniJob, DbSkaniJobResult, DbSkaniResult
+from api.util.collection import iter_batches
+
+# Pairs are unique for each set of parameters, this is required for ON CONFLICT
+INDEX_NAME = 'result_param_id_qry_id_ref_id_idx'
+
+# Whether the index exists, and is valid (a failed concurrent build leaves an invalid index)
+QUERY_INDEX_VALID = '''
+SELECT i.indisvalid
+FROM pg_index i
+WHERE i.indexrelid = to_regclass(:name)
+'''
+
+# Keep the first of each duplicate pair (rows with a NULL genome are not unique in the index)
+DELETE_DUPLICATES = '''
+DELETE FROM skani.result r
+USING skani.result d
+WHERE r.param_id = d.param_id
+  AND r.qry_id = d.qry_id
+  AND r.ref_id = d.ref_id
+  AND r.id > d.id
+'''
+
+CREATE_INDEX = f'''
+CREATE UNIQUE INDEX CONCURRENTLY {INDEX_NAME}
+    ON skani.result (param_id, qry_id, ref_id)
+'''
+
+DROP_INDEX = f'DROP INDEX CONCURRENTLY IF EXISTS skani.{INDEX_NAME}'
+
+
+def create_unique_index():
+    """Create the unique index (without blocking writes), removing any duplicate pairs first."""
+    # Concurrent index operations cannot be run in a transaction
+    with gtdb_common_engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        is_valid = conn.execute(sa.text(QUERY_INDEX_VALID), {'name': f'skani.{INDEX_NAME}'}).scalar()
+        if is_valid:
+            return
+        if is_valid is False:
+            print('Removing the invalid index left by a previous build')
+            conn.execute(sa.text(DROP_INDEX))
+
+        n_deleted = conn.execute(sa.text(DELETE_DUPLICATES)).rowcount
+        print(f'Removed {n_deleted:,} duplicate pairs.')
+        try:
+            conn.execute(sa.text(CREATE_INDEX))
+        except DBAPIError:
+            # e.g. duplicates were written while the index was built, leave the table as it was
+            conn.execute(sa.text(DROP_INDEX))
+            raise
+
+
+def read_completed_jobs(db: Session, min_job_id: int) -> list:
+    query = (
+        sm.select(DbSkaniJob.id, DbSkaniJob.param_id, DbSkaniJob.mode)
+        .join(DbSkaniJobResult, DbSkaniJobResult.job_id == DbSkaniJob.id)
+        .where(DbSkaniJob.completed != None)
+        .where(DbSkaniJob.error.is_not(True))
+        .where(DbSkaniJob.id >= min_job_id)
+        .order_by(DbSkaniJob.id)
+    )
+    return list(db.exec(query).all())
+
+
+def store_job_results(job, batch_size: int, db: Session) -> int:
+    genomes = util_get_job_query_reference_genomes(job.id, db)
+    if any(x['origin'] != 'ncbi' for x in genomes):
+        return 0
+    qry_ids = [x['id'] for x in genomes if x['source'] == 'query']
+    ref_ids = [x['id'] for x in genomes if x['source'] == 'reference']
+    job_results = util_get_job_results(job.id, qry_ids, ref_ids, job.mode, db)
+
+    rows = list()
+    for qry_idx, qry_id in enumerate(job_results.qry_ids):
+        for ref_idx, ref_id in enumerate(job_results.ref_ids):
+            rows.append({
+                'param_id': job.param_id,
+                'qry_id': qry_id,
+                'ref_id': ref_id,
+                'ani': float(job_results.ani[qry_idx, ref_idx]),
+                'af_qry': float(job_results.af_qry[qry_idx, ref_idx]),
+                'af_ref': float(job_results.af_ref[qry_idx, ref_idx]),
+            })
+    for batch in iter_batches(rows, batch_size):
+        stmt = insert(DbSkaniResult).values(batch).on_conflict_do_nothing(
+            index_elements=[DbSkaniResult.param_id, DbSkaniResult.qry_id, DbSkaniResult.ref_id]
+        )
+        db.exec(stmt)
+    db.commit()
+    return len(rows)
+
+
+def main(args):
+    print('Creating the unique index on the result store')
+    create_unique_index()
+
+    with Session(gtdb_common_engine) as db:
+        jobs = read_completed_jobs(db, args.min_job_id)
+        print(f'Found {len(jobs):,} completed jobs.')
+        n_pairs = 0
+        for job in tqdm(jobs):
+            n_pairs += store_job_results(job, args.batch_size, db)
+        print(f'Stored up to {n_pairs:,} pairs (existing pairs are kept).')
+    return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--min-job-id', help='Only copy jobs with at least this id.', type=int, default=0)
+    parser.add_argument('--batch-size', help='Number of pairs to insert per statement.', type=int, default=5000)
+    main(parser.parse_args())
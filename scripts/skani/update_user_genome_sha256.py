@@ -0,0 +1,44 @@
+"""
+Add the sha256 column to skani.user_genome, which is required before setting
+ANI_USER_GENOME_DIR.
+
+Once set, uploaded genomes are stored as {ANI_USER_GENOME_DIR}/ab/cd/{sha256}.fna.gz
+(gzip compressed, named by the SHA-256 of the uncompressed content), and the
+fna column is NULL. Existing rows keep their fna content, so workers should
+read fna if present and otherwise the file for the sha256. The column is only
+written while ANI_USER_GENOME_DIR is set, so jobs can be created without it.
+
+Files are shared by jobs with identical uploads, and are removed by
+scripts/skani/sweep_user_genomes.py once no retained job references them.
+
+    python scripts/skani/update_user_genome_sha256.py
+"""
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+import sqlalchemy as sa
+from sqlmodel import Session
+
+from api.db import gtdb_common_engine
+
+STATEMENTS = (
+    'ALTER TABLE skani.user_genome ADD COLUMN IF NOT EXISTS sha256 CHAR(64)',
+    'CREATE INDEX IF NOT EXISTS user_genome_sha256_idx ON skani.user_genome (sha256)',
+)
+
+
+def main():
+    with Session(gtdb_common_engine) as db:
+        for statement in STATEMENTS:
+            print(statement)
+            db.execute(sa.text(statement))
+        db.commit()
+    print('Done.')
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+from api.controller.genome import genome_card
+from api.exceptions import HttpNotFound
+
+PAYLOAD = {
+    'genome': {'accession': 'GCA_000005845.2', 'name': 'Escherichia coli K-12'},
+    'metadata_ncbi': {'ncbi_genbank_assembly_accession': 'GCA_000005845.2'}
+}
+
+
+def mock_session(*rows) -> AsyncMock:
+    """A session where each call to exec returns the next row (from first)."""
+    db = AsyncMock()
+    db.exec.side_effect = [MagicMock(first=MagicMock(return_value=row)) for row in rows]
+    return db
+
+
+class TestGenomeCard(unittest.IsolatedAsyncioTestCase):
+
+    async def test_precomputed(self):
+        db_web = mock_session(SimpleNamespace(accessions=['GB_GCA_000005845.2', 'GCA_000005845.2'], payload=PAYLOAD))
+        db_gtdb = mock_session()
+        card = await genome_card('GCA_000005845.2', db_gtdb, db_web)
+        self.assertEqual('GCA_000005845.2', card.genome.accession)
+        db_gtdb.exec.assert_not_called()
+
+    async def test_precomputed_other_version_not_found(self):
+        # The canonical id matches, but the version does not (and neither does the live lookup)
+        db_web = mock_session(SimpleNamespace(accessions=['GB_GCA_000005845.2', 'GCA_000005845.2'], payload=PAYLOAD))
+        db_gtdb = mock_session(None, None)
+        with self.assertRaises(HttpNotFound):
+            await genome_card('GCA_000005845.1', db_gtdb, db_web)
+        self.assertEqual(2, db_gtdb.exec.call_count)
+
+    async def test_precomputed_other_prefix_not_found(self):
+        db_web = mock_session(SimpleNamespace(accessions=['GB_GCA_000005845.2', 'GCA_000005845.2'], payload=PAYLOAD))
+        db_gtdb = mock_session(None, None)
+        with self.assertRaises(HttpNotFound):
+            await genome_card('GCF_000005845.2', db_gtdb, db_web)
@@ -0,0 +1,139 @@
+import unittest
+from unittest import mock
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from api.controller import skani
+from api.controller.skani import util_get_job_snapshot, util_job_table_columns, util_merge_job_results
+from api.exceptions import HttpNotFound
+from api.model.skani import UtilSkaniJobResults, UtilSkaniJobSnapshot
+from api.util.cache_store import LruCache
+
+
+def mock_session(*rows) -> MagicMock:
+    """A session where each call to exec returns the next row (from first)."""
+    db = MagicMock()
+    db.exec.side_effect = [MagicMock(first=MagicMock(return_value=row)) for row in rows]
+    return db
+
+
+class TestJobSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        patch = mock.patch.object(skani, 'JOB_SNAPSHOT_CACHE', LruCache(10))
+        self.cache = patch.start()
+        self.addCleanup(patch.stop)
+        self.snapshot = UtilSkaniJobSnapshot.model_construct(id=1, name='job', delete_after_ts=None)
+        self.cache.set('job', self.snapshot)
+
+    def test_cached(self):
+        db = mock_session(False)
+        self.assertIs(self.snapshot, util_get_job_snapshot('job', db))
+        self.assertEqual(1, db.exec.call_count)
+
+    def test_cached_job_deleted(self):
+        # The job is no longer returned by the snapshot query either
+        db = mock_session(True, None)
+        with self.assertRaises(HttpNotFound):
+            util_get_job_snapshot('job', db)
+        self.assertNotIn('job', self.cache)
+
+
+def create_job_results(qry_ids: list[int], ref_ids: list[int], seed: int = 0) -> UtilSkaniJobResults:
+    rng = np.random.default_rng(seed)
+    shape = (len(qry_ids), len(ref_ids))
+    return UtilSkaniJobResults(
+        qry_ids=qry_ids,
+        ref_ids=ref_ids,
+        ani=rng.integers(7500, 10001, size=shape) / 100,
+        af_qry=rng.integers(0, 10001, size=shape) / 100,
+        af_ref=rng.integers(0, 10001, size=shape) / 100
+    )
+
+
+def legacy_merge_job_results(job_results: UtilSkaniJobResults) -> tuple[np.ndarray, np.ndarray]:
+    """The loop that util_merge_job_results replaced."""
+    d_gid_to_ref_index = {x: idx for idx, x in enumerate(job_results.ref_ids)}
+    d_gid_to_qry_index = {x: idx for idx, x in enumerate(job_results.qry_ids)}
+    shape = (len(job_results.qry_ids), len(job_results.ref_ids))
+    arr_ani = np.zeros(shape=shape, dtype=float)
+    arr_af = np.zeros(shape=shape, dtype=float)
+    for qry_idx, qry_gid in enumerate(job_results.qry_ids):
+        for ref_idx, ref_gid in enumerate(job_results.ref_ids):
+            is_symmetric = qry_gid in d_gid_to_ref_index and ref_gid in d_gid_to_qry_index
+            ani = job_results.ani[qry_idx, ref_idx]
+            af_qry = job_results.af_qry[qry_idx, ref_idx]
+            af_ref = job_results.af_ref[qry_idx, ref_idx]
+            arr_ani[qry_idx, ref_idx] = ani
+            if is_symmetric:
+                arr_af[qry_idx, ref_idx] = af_qry
+                ref_idx_rev = d_gid_to_ref_index[qry_gid]
+                qry_idx_rev = d_gid_to_qry_index[ref_gid]
+                arr_ani[qry_idx_rev, ref_idx_rev] = ani
+                arr_af[qry_idx_rev, ref_idx_rev] = af_ref
+            else:
+                arr_af[qry_idx, ref_idx] = max(af_qry, af_ref)
+    return arr_ani, arr_af
+
+
+class TestMergeJobResults(unittest.TestCase):
+
+    def assertMatchesLegacy(self, qry_ids: list[int], ref_ids: list[int]):
+        for seed in range(3):
+            job_results = create_job_results(qry_ids, ref_ids, seed)
+            arr_ani, arr_af = util_merge_job_results(job_results)
+            legacy_ani, legacy_af = legacy_merge_job_results(job_results)
+            np.testing.assert_array_equal(legacy_ani, arr_ani)
+            np.testing.assert_array_equal(legacy_af, arr_af)
+
+    def test_triangle(self):
+        self.assertMatchesLegacy([1, 2, 3, 4, 5], [1, 2, 3, 4, 5])
+
+    def test_qvr_disjoint(self):
+        self.assertMatchesLegacy([1, 2, 3], [4, 5, 6, 7])
+
+    def test_qvr_overlapping(self):
+        self.assertMatchesLegacy([1, 2, 3, 4], [3, 4, 5])
+        self.assertMatchesLegacy([5, 3, 1, 4], [4, 2, 5, 1, 6])
+
+    def test_qvr_reference_in_query(self):
+        self.assertMatchesLegacy([1, 2, 3, 4, 5], [4, 2])
+
+    def test_single(self):
+        self.assertMatchesLegacy([1], [1])
+
+
+class TestJobTableColumns(unittest.TestCase):
+
+    def setUp(self):
+        self.job_results = UtilSkaniJobResults(
+            qry_ids=[1, 2],
+            ref_ids=[1, 3],
+            ani=np.array([[100.0, 0.0], [97.123, 0.0]]),
+            af_qry=np.array([[100.0, 0.0], [80.456, 0.0]]),
+            af_ref=np.array([[100.0, 0.0], [75.0, 12.5]])
+        )
+        self.names = {1: 'a', 2: 'b', 3: 'c'}
+
+    def columns(self, get_nulls: bool, get_self: bool) -> list[tuple]:
+        columns = util_job_table_columns(self.job_results, self.names, get_nulls, get_self)
+        return list(zip(columns['qry'], columns['ref'], columns['ani'], columns['afQry'], columns['afRef']))
+
+    def test_all(self):
+        self.assertListEqual([
+            ('a', 'a', 100.0, 100.0, 100.0),
+            ('a', 'c', 0.0, 0.0, 0.0),
+            ('b', 'a', 97.12, 80.46, 75.0),
+            ('b', 'c', 0.0, 0.0, 12.5),
+        ], self.columns(get_nulls=True, get_self=True))
+
+    def test_skip_self(self):
+        self.assertListEqual(['ac', 'ba', 'bc'], [x[0] + x[1] for x in self.columns(get_nulls=True, get_self=False)])
+
+    def test_skip_nulls(self):
+        # A row is only null if every value is zero
+        self.assertListEqual(['aa', 'ba', 'bc'], [x[0] + x[1] for x in self.columns(get_nulls=False, get_self=True)])
+
+    def test_skip_self_and_nulls(self):
+        self.assertListEqual(['ba', 'bc'], [x[0] + x[1] for x in self.columns(get_nulls=False, get_self=False)])
@@ -0,0 +1,35 @@
+import unittest
+from unittest import mock
+from unittest.mock import MagicMock
+
+from api.controller import taxon
+from api.controller.taxon import get_taxon_stats
+
+
+def mock_session(*values) -> MagicMock:
+    """A session where each call to exec returns the next value (from scalar and first)."""
+    db = MagicMock()
+    db.exec.side_effect = [MagicMock(scalar=MagicMock(return_value=x), first=MagicMock(return_value=x)) for x in values]
+    return db
+
+
+class TestGetTaxonStats(unittest.TestCase):
+
+    def setUp(self):
+        patch = mock.patch.object(taxon, 'TAXON_STATS_TABLE_EXISTS', False)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_table_missing(self):
+        # The table is checked again on the next request, as it may have been created since
+        db = mock_session(False, False)
+        self.assertIsNone(get_taxon_stats('g__Foo', db))
+        self.assertIsNone(get_taxon_stats('g__Foo', db))
+        self.assertEqual(2, db.exec.call_count)
+
+    def test_table_exists(self):
+        # Once the table exists, only the statistics are read
+        db = mock_session(True, 'a', 'b')
+        self.assertEqual('a', get_taxon_stats('g__Foo', db))
+        self.assertEqual('b', get_taxon_stats('g__Bar', db))
+        self.assertEqual(3, db.exec.call_count)
@@ -0,0 +1,89 @@
+import unittest
+
+import numpy as np
+
+from api.util.histogram import GC_HISTOGRAM_RESOLUTION, rebin_fixed_histogram
+from scripts.release.update_taxon_stats import aggregate_rank, encode_ranks, histogram_counts
+
+TAXONOMY = np.array([
+    ['d__Bacteria', 'p__A', 'g__X'],
+    ['d__Bacteria', 'p__A', 'g__X'],
+    ['d__Bacteria', 'p__B', 'g__X'],
+    ['d__Bacteria', 'p__B', ''],
+    ['d__Archaea', 'p__C', 'g__'],
+    ['d__Archaea', 'p__C', 'g__Y'],
+], dtype=object)
+IS_REP = np.array([True, False, False, False, True, True])
+GC = np.array([50.04, 50.26, np.nan, 60.3, 40.0, 30.0])
+
+
+class TestAggregateRank(unittest.TestCase):
+
+    def setUp(self):
+        self.names, self.codes = encode_ranks(TAXONOMY)
+
+    def aggregate(self, rank_idx: int, is_rep=IS_REP, gc=GC) -> dict[str, dict]:
+        return {x['taxon']: x for x in aggregate_rank(rank_idx, self.codes, self.names, is_rep, gc)}
+
+    def test_skips_unassigned(self):
+        self.assertListEqual(['g__X', 'g__Y'], sorted(self.aggregate(2)))
+
+    def test_higher_ranks(self):
+        self.assertIsNone(self.aggregate(2)['g__X']['higher_ranks'])
+        self.assertListEqual(['d__Archaea', 'p__C'], self.aggregate(2)['g__Y']['higher_ranks'])
+        self.assertListEqual(['d__Bacteria'], self.aggregate(1)['p__B']['higher_ranks'])
+        self.assertListEqual([], self.aggregate(0)['d__Bacteria']['higher_ranks'])
+
+    def test_counts(self):
+        row = self.aggregate(2)['g__X']
+        self.assertEqual(3, row['n_genomes'])
+        self.assertEqual(1, row['n_sp_reps'])
+        self.assertEqual(2, row['gc_n'])
+        self.assertAlmostEqual(50.04, row['gc_min'])
+        self.assertAlmostEqual(50.26, row['gc_max'])
+        self.assertAlmostEqual(50.15, row['gc_mean'])
+
+    def test_histogram_bounds(self):
+        rows = self.aggregate(1)
+        self.assertEqual(500, rows['p__A']['gc_bin_start'])
+        self.assertListEqual([1, 0, 1], rows['p__A']['gc_counts'])
+
+        # The GC% of the genome without a genus is counted, but not the missing value
+        self.assertEqual(603, rows['p__B']['gc_bin_start'])
+        self.assertListEqual([1], rows['p__B']['gc_counts'])
+        self.assertEqual(1, rows['p__B']['gc_n'])
+
+        self.assertEqual(300, rows['p__C']['gc_bin_start'])
+        self.assertListEqual([1] + [0] * 99 + [1], rows['p__C']['gc_counts'])
+
+    def test_no_gc(self):
+        row = self.aggregate(2, gc=np.full(len(GC), np.nan))['g__X']
+        self.assertEqual(0, row['gc_n'])
+        self.assertIsNone(row['gc_mean'])
+        self.assertListEqual([], row['gc_counts'])
+
+    def test_matches_live_histogram(self):
+        rng = np.random.default_rng(7)
+        gc = np.round(rng.normal(52, 4, 300), 2)
+        taxonomy = np.array([['d__Bacteria', 'p__A', 'g__X']] * len(gc), dtype=object)
+        names, codes = encode_ranks(taxonomy)
+        row = aggregate_rank(2, codes, names, np.zeros(len(gc), dtype=bool), gc)[0]
+
+        counts, bin_edges = rebin_fixed_histogram(row['gc_counts'], row['gc_bin_start'], row['gc_bin_width'])
+        live_counts, live_bin_edges = np.histogram(gc, bins='auto')
+        self.assertEqual(GC_HISTOGRAM_RESOLUTION, row['gc_bin_width'])
+        self.assertEqual(live_counts.sum(), counts.sum())
+        self.assertLessEqual(bin_edges[0], gc.min())
+        self.assertGreater(bin_edges[-1], gc.max())
+        self.assertListEqual(np.histogram(gc, bins=bin_edges)[0].tolist(), counts.tolist())
+        width, live_width = bin_edges[1] - bin_edges[0], live_bin_edges[1] - live_bin_edges[0]
+        self.assertAlmostEqual(live_width, width, delta=0.1 * live_width + GC_HISTOGRAM_RESOLUTION)
+
+
+class TestHistogramCounts(unittest.TestCase):
+
+    def test_dense(self):
+        self.assertListEqual([2, 0, 0, 1], histogram_counts(np.array([3, 6]), np.array([2, 1])))
+
+    def test_empty(self):
+        self.assertListEqual([], histogram_counts(np.array([], dtype=np.int64), np.array([], dtype=np.int64)))
@@ -0,0 +1,28 @@
+import unittest
+
+from api.util.autocomplete import RankAutocomplete, TaxonAutocompleteIndex
+
+
+class TestRankAutocomplete(unittest.TestCase):
+
+    def test_prefix(self):
+        rank = RankAutocomplete(['Escherichia', 'Bacillus', 'Bacteroides', 'bacillus_A', None])
+        self.assertEqual(['Bacillus', 'bacillus_A', 'Bacteroides'], rank.prefix('BAC', limit=10))
+        self.assertEqual(['Bacillus'], rank.prefix('bac', limit=1))
+        self.assertEqual([], rank.prefix('z', limit=10))
+
+    def test_substring(self):
+        rank = RankAutocomplete(['Escherichia', 'Bacillus', 'Bacteroides', 'Lactobacillus'])
+        self.assertEqual(['Bacillus', 'Lactobacillus'], rank.substring('CILL', limit=10))
+        self.assertEqual(['Bacillus'], rank.substring('cill', limit=1))
+        self.assertEqual(['Escherichia'], rank.substring('ia', limit=10))
+        self.assertEqual([], rank.substring('s\0b', limit=10))
+
+
+class TestTaxonAutocompleteIndex(unittest.TestCase):
+
+    def test_search(self):
+        index = TaxonAutocompleteIndex({'d__': ['Bacteria', 'Archaea'], 'g__': ['Bacillus', 'Bacteria_A']})
+        self.assertEqual(['g__Bacillus', 'g__Bacteria_A'], index.search_rank('g__', 'bac', limit=10))
+        self.assertEqual(['d__Bacteria', 'g__Bacteria_A'], index.search_all('cteri', limit=10))
+        self.assertEqual(4, len(index))
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from fastapi import Request, Response
+from pydantic import BaseModel
+from sqlmodel import Session, create_engine, literal, select
+
+from api.util import cache
+from api.util.cache import cached, coalesced
+from api.util.cache_store import DiskCache, MemoryCache
+from api.util.singleflight import SingleFlight
+
+
+def make_request(path: str) -> Request:
+    return Request({
+        'type': 'http',
+        'method': 'GET',
+        'scheme': 'http',
+        'server': ('testserver', 80),
+        'root_path': '',
+        'path': path,
+        'query_string': b'',
+        'headers': []
+    })
+
+
+class Item(BaseModel):
+    name: str
+
+
+class TestCached(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        root = Path(self.tmp_dir.name)
+        patches = (
+            mock.patch.object(cache, 'CACHE_DIR', root),
+            mock.patch.object(cache, 'DISK_CACHE', DiskCache(root=root, max_bytes=1024 * 1024)),
+            mock.patch.object(cache, 'MEMORY_CACHE', MemoryCache(max_bytes=1024 * 1024, max_item_bytes=1024)),
+            mock.patch.object(cache, 'SINGLE_FLIGHT', SingleFlight()),
+        )
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.engine = create_engine('sqlite://')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    async def test_concurrent_requests_use_own_session(self):
+        sessions = list()
+
+        @cached(ttl=60, disk=True)
+        async def endpoint(request: Request, db: Session):
+            sessions.append(db)
+            await asyncio.sleep(0.01)
+            return {'value': 1}
+
+        with Session(self.engine) as db_a, Session(self.engine) as db_b:
+            responses = await asyncio.gather(
+                endpoint(request=make_request('/a'), db=db_a),
+                endpoint(request=make_request('/a'), db=db_b)
+            )
+
+        # The endpoint ran once, with a new session on the same engine
+        self.assertEqual(1, len(sessions))
+        self.assertNotIn(sessions[0], (db_a, db_b))
+        self.assertIs(self.engine, sessions[0].bind)
+
+        # Each request is sent its own response
+        self.assertIsNot(responses[0], responses[1])
+        self.assertListEqual([{'value': 1}] * 2, [json.loads(x.body) for x in responses])
+
+        # The next request is read from the cache
+        response = await endpoint(request=make_request('/a'), db=db_a)
+        self.assertEqual(1, len(sessions))
+        self.assertEqual('true', response.headers['X-API-Cached'])
+
+    async def test_response_is_not_shared(self):
+        n_calls = 0
+
+        @cached(ttl=60, disk=True)
+        async def endpoint(request: Request):
+            nonlocal n_calls
+            n_calls += 1
+            await asyncio.sleep(0.01)
+            return Response(content=b'abc', media_type='text/plain', headers={'X-Test': '1'})
+
+        responses = await asyncio.gather(*[endpoint(request=make_request('/b')) for _ in range(3)])
+        self.assertEqual(1, n_calls)
+        self.assertEqual(3, len({id(x) for x in responses}))
+        for response in responses:
+            self.assertEqual(b'abc', response.body)
+            self.assertEqual('1', response.headers['X-Test'])
+            self.assertEqual('text/plain; charset=utf-8', response.headers['Content-Type'])
+
+        # The response is not cached
+        await endpoint(request=make_request('/b'))
+        self.assertEqual(2, n_calls)
+
+
+class TestCoalesced(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        patch = mock.patch.object(cache, 'SINGLE_FLIGHT', SingleFlight())
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.engine = create_engine('sqlite://')
+
+    async def test_cancelled_request_does_not_close_session(self):
+        started = asyncio.Event()
+        sessions = list()
+
+        @coalesced
+        async def endpoint(request: Request, db: Session):
+            sessions.append(db)
+            started.set()
+            await asyncio.sleep(0.02)
+            return [Item(name=str(db.exec(select(literal(1))).one()))]
+
+        with Session(self.engine) as db_a:
+            leader = asyncio.ensure_future(endpoint(request=make_request('/c'), db=db_a))
+            await started.wait()
+        with Session(self.engine) as db_b:
+            follower = asyncio.ensure_future(endpoint(request=make_request('/c'), db=db_b))
+            await asyncio.sleep(0)
+
+            # The request that started the computation is cancelled (and its session closed)
+            leader.cancel()
+            self.assertListEqual([{'name': '1'}], await follower)
+
+        self.assertEqual(1, len(sessions))
+        self.assertNotIn(sessions[0], (db_a, db_b))
+
+    async def test_sync_endpoint(self):
+        n_calls = 0
+
+        @coalesced
+        def endpoint(request: Request, db: Session):
+            nonlocal n_calls
+            n_calls += 1
+            return Item(name=str(db.exec(select(literal(1))).one()))
+
+        with Session(self.engine) as db:
+            results = await asyncio.gather(*[endpoint(request=make_request('/d'), db=db) for _ in range(3)])
+        self.assertListEqual([{'name': '1'}] * 3, results)
+        self.assertEqual(1, n_calls)
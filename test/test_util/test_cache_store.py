@@ -0,0 +1,110 @@
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from api.util.cache_store import ExpiringValue, LruCache, MemoryCache, DiskCache
+
+
+class TestMemoryCache(unittest.TestCase):
+
+    def test_get_set(self):
+        cache = MemoryCache(max_bytes=100, max_item_bytes=100)
+        self.assertIsNone(cache.get('a', ttl=10))
+        cache.set('a', b'123')
+        self.assertEqual((0, b'123'), cache.get('a', ttl=10))
+        self.assertEqual(3, cache.n_bytes)
+
+    def test_expired(self):
+        cache = MemoryCache(max_bytes=100, max_item_bytes=100)
+        cache.set('a', b'123', created=time.time() - 20)
+        self.assertIsNone(cache.get('a', ttl=10))
+        self.assertNotIn('a', cache)
+        self.assertEqual(0, cache.n_bytes)
+
+    def test_evicts_least_recently_used(self):
+        cache = MemoryCache(max_bytes=10, max_item_bytes=10)
+        cache.set('a', b'1234')
+        cache.set('b', b'1234')
+        cache.get('a', ttl=10)
+        cache.set('c', b'1234')
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(8, cache.n_bytes)
+        self.assertEqual(1, cache.stats.memory_evictions)
+
+    def test_item_too_large(self):
+        cache = MemoryCache(max_bytes=100, max_item_bytes=2)
+        self.assertFalse(cache.set('a', b'123'))
+        self.assertEqual(0, len(cache))
+
+
+class TestLruCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LruCache(max_items=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.set('c', 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEqual(3, cache.get('c'))
+        self.assertEqual(2, len(cache))
+
+    def test_pop(self):
+        cache = LruCache(max_items=2)
+        cache.set('a', 1)
+        cache.pop('a')
+        cache.pop('b')
+        self.assertIsNone(cache.get('a'))
+
+
+class TestExpiringValue(unittest.TestCase):
+
+    def test_recomputed_after_ttl(self):
+        calls = list()
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        value = ExpiringValue(ttl=60)
+        self.assertEqual(1, value.get(compute))
+        self.assertEqual(1, value.get(compute))
+        value.ttl = 0
+        self.assertEqual(2, value.get(compute))
+        value.clear()
+        value.ttl = 60
+        self.assertEqual(3, value.get(compute))
+
+
+class TestDiskCache(unittest.TestCase):
+
+    def test_read_write(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = Path(tmp_dir)
+            cache = DiskCache(root, max_bytes=100)
+            path = root / 'a' / 'b.cache'
+            self.assertIsNone(cache.read(path, ttl=10))
+            cache.write(path, b'123')
+            age, _, value = cache.read(path, ttl=10)
+            self.assertEqual(0, age)
+            self.assertEqual(b'123', value)
+            self.assertListEqual(['b.cache'], os.listdir(root / 'a'))
+
+    def test_evicts_oldest(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = Path(tmp_dir)
+            cache = DiskCache(root, max_bytes=25)
+            now = time.time()
+            for i in range(3):
+                path = root / f'{i}.cache'
+                cache.write(path, b'0123456789')
+                os.utime(path, (now - 100 + i, now - 100 + i))
+            self.assertFalse((root / '0.cache').exists())
+            self.assertTrue((root / '1.cache').exists())
+            self.assertTrue((root / '2.cache').exists())
+            self.assertEqual(1, cache.stats.disk_evictions)
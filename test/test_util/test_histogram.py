@@ -0,0 +1,43 @@
+import unittest
+
+import numpy as np
+
+from api.util.histogram import GC_HISTOGRAM_RESOLUTION, rebin_fixed_histogram
+
+
+class TestRebinFixedHistogram(unittest.TestCase):
+
+    def test_empty(self):
+        with self.assertRaises(ValueError):
+            rebin_fixed_histogram([0, 0], 100, 0.1)
+
+    def test_trims_zeros(self):
+        counts, bin_edges = rebin_fixed_histogram([0, 0, 3, 0, 1, 0], 100, 0.1)
+        self.assertListEqual([3, 0, 1], counts.tolist())
+        self.assertListEqual([10.2, 10.3, 10.4, 10.5], bin_edges.tolist())
+
+    def test_merges_bins(self):
+        # The last bin is padded with empty bins
+        counts, bin_edges = rebin_fixed_histogram([1] * 10, 0, 0.5)
+        self.assertListEqual([3, 3, 3, 1], counts.tolist())
+        self.assertListEqual([0.0, 1.5, 3.0, 4.5, 6.0], bin_edges.tolist())
+
+    def test_matches_live_histogram(self):
+        rng = np.random.default_rng(42)
+        values = np.concatenate([rng.normal(45, 3, 500), rng.normal(60, 2, 150)])
+        bins = np.floor(values / GC_HISTOGRAM_RESOLUTION + 1e-9).astype(np.int64)
+        fixed_counts = np.bincount(bins - bins.min())
+
+        counts, bin_edges = rebin_fixed_histogram(fixed_counts.tolist(), int(bins.min()), GC_HISTOGRAM_RESOLUTION)
+        live_counts, live_bin_edges = np.histogram(values, bins='auto')
+
+        # The bins cover all values, and agree with binning the values directly
+        self.assertLessEqual(bin_edges[0], values.min())
+        self.assertGreater(bin_edges[-1], values.max())
+        self.assertEqual(live_counts.sum(), counts.sum())
+        self.assertListEqual(np.histogram(values, bins=bin_edges)[0].tolist(), counts.tolist())
+
+        # The width is close to the live estimate (it is a multiple of the resolution)
+        width, live_width = bin_edges[1] - bin_edges[0], live_bin_edges[1] - live_bin_edges[0]
+        self.assertAlmostEqual(0, round(width / GC_HISTOGRAM_RESOLUTION, 6) % 1)
+        self.assertAlmostEqual(live_width, width, delta=0.1 * live_width + GC_HISTOGRAM_RESOLUTION)
@@ -0,0 +1,61 @@
+import asyncio
+import unittest
+
+from api.util.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+
+    async def test_shares_result(self):
+        sf = SingleFlight()
+        n_calls = 0
+
+        async def fn():
+            nonlocal n_calls
+            n_calls += 1
+            await asyncio.sleep(0.01)
+            return n_calls
+
+        results = await asyncio.gather(*[sf.do('a', fn) for _ in range(5)])
+        self.assertListEqual([1] * 5, results)
+        self.assertEqual(1, n_calls)
+        self.assertEqual(1, sf.n_executed)
+        self.assertEqual(4, sf.n_shared)
+        self.assertEqual(0, len(sf))
+
+        # Once complete, the next call executes again
+        self.assertEqual(2, await sf.do('a', fn))
+
+    async def test_shares_exception(self):
+        sf = SingleFlight()
+
+        async def fn():
+            await asyncio.sleep(0.01)
+            raise ValueError('error')
+
+        results = await asyncio.gather(*[sf.do('a', fn) for _ in range(3)], return_exceptions=True)
+        self.assertEqual(1, sf.n_executed)
+        self.assertTrue(all(isinstance(x, ValueError) for x in results))
+
+    async def test_different_keys(self):
+        sf = SingleFlight()
+
+        async def fn():
+            await asyncio.sleep(0.01)
+            return True
+
+        await asyncio.gather(sf.do('a', fn), sf.do('b', fn))
+        self.assertEqual(2, sf.n_executed)
+
+    async def test_caller_cancelled(self):
+        sf = SingleFlight()
+
+        async def fn():
+            await asyncio.sleep(0.05)
+            return 'done'
+
+        first = asyncio.ensure_future(sf.do('a', fn))
+        second = asyncio.ensure_future(sf.do('a', fn))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        self.assertEqual('done', await second)
@@ -0,0 +1,46 @@
+import unittest
+
+from api.util.taxon_history import TaxonHistoryEntry, TaxonHistoryIndex, summarise_taxon_history
+
+RELEASES = ('R80', 'R95', 'R220', 'NCBI')
+
+
+class TestSummariseTaxonHistory(unittest.TestCase):
+
+    def test_summarise(self):
+        rows = [
+            ('g__Foo', 'R80'), ('g__FOO', 'R95'), ('g__foo', 'NCBI'),
+            ('g__Bar', 'R95'), ('g__Bar', 'R220'),
+            ('g__Baz ', 'NCBI'),
+        ]
+        self.assertEqual([
+            TaxonHistoryEntry('g__Bar', 'R95', 'R220', True),
+            TaxonHistoryEntry('g__FOO', 'R80', 'R95', False),
+        ], summarise_taxon_history(rows, RELEASES, current_release='R220'))
+
+
+class TestTaxonHistoryIndex(unittest.TestCase):
+
+    def test_search(self):
+        index = TaxonHistoryIndex([
+            ('g__Bacillus_A', 'R80', 'R95', False),
+            ('g__Lactobacillus', 'R80', 'R202', False),
+            ('s__Escherichia coli_A', 'R89', 'R89', False),
+        ])
+        self.assertEqual(['g__Bacillus_A', 'g__Lactobacillus'], [x.taxon for x in index.search('BACILL')])
+        self.assertEqual('R89', index.search('coli')[0].last_seen)
+        self.assertEqual([], index.search('d__'))
+
+    def test_search_matches_summary(self):
+        rows = [
+            ('g__bacillus', 'R80'), ('g__Bacillus_A', 'R80'), ('g__Bacillus_A', 'R95'),
+            ('g__BacillusB', 'R95'), ('g__Bacillus', 'R220'), ('s__Bacillus sp1', 'R80'),
+        ]
+        entries = [x for x in summarise_taxon_history(rows, RELEASES, 'R220') if not x.present_in_current]
+
+        # Rows are read in the database collation (which ignores case and punctuation), not the code point order
+        db_order = sorted(entries, key=lambda x: (x.taxon.lower().replace('_', ''), x.taxon))
+        self.assertNotEqual(entries, db_order)
+        index = TaxonHistoryIndex(db_order)
+        for query in ('bacillus', 'BACILLUS_', 's__', 'x'):
+            self.assertEqual([x for x in entries if query.lower() in x.taxon.lower()], index.search(query))
@@ -0,0 +1,37 @@
+import unittest
+
+from api.util.tree_index import TaxonTreeIndex
+
+NODES = [
+    (10, 'd__Bacteria', 3, 'taxon', None, None, 2, None, None, 'https://lpsn/b', 2, None),
+    (11, 'p__A', 2, 'taxon', None, None, 1, 'https://bergeys/a', None, None, None, None),
+    (12, 'p__B', 1, 'taxon', None, None, 1, None, None, None, None, None),
+    (13, 'GCA_000000001.1', 1, 'genome', True, 'type strain', 0, None, None, None, None, None),
+    (14, 'GCA_000000002.1', 1, 'genome', False, None, 0, None, None, None, None, None),
+]
+
+# (parent_id, child_id, order_id), deliberately out of order
+EDGES = [(10, 12, 1), (11, 14, 0), (10, 11, 0), (12, 13, 0)]
+
+
+class TestTaxonTreeIndex(unittest.TestCase):
+
+    def test_children_in_order(self):
+        index = TaxonTreeIndex(NODES, EDGES)
+        self.assertEqual(5, len(index))
+        self.assertEqual(['p__A', 'p__B'], [x.taxon for x in index.children_of('d__Bacteria')])
+        self.assertEqual(['GCA_000000002.1'], [x.taxon for x in index.children_of('p__A')])
+        self.assertEqual([], index.children_of('GCA_000000001.1'))
+
+    def test_node_columns(self):
+        index = TaxonTreeIndex(NODES, EDGES)
+        node = index.children_of('p__B')[0]
+        self.assertEqual('genome', node.type)
+        self.assertTrue(node.is_rep)
+        self.assertEqual('type strain', node.type_material)
+        self.assertEqual('https://bergeys/a', index.children_of('d__Bacteria')[0].bergeys_url)
+
+    def test_missing_and_duplicate(self):
+        index = TaxonTreeIndex(NODES + [(15, 'p__B', 0, 'taxon', None, None, 0, None, None, None, None, None)], EDGES)
+        self.assertRaises(KeyError, index.children_of, 'p__C')
+        self.assertEqual({'p__B'}, index.duplicate_taxa)